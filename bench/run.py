@@ -0,0 +1,407 @@
+"""
+Benchmark dotplate against synthetic source trees.
+
+For each requested tree size, a temporary source tree is generated containing
+that many templates spread across nested directories, each of which includes
+a chain of partial templates, with the templates divided among a number of
+suites.  The tree can optionally be committed to a Git repository.  Each
+phase of processing is then timed over several repetitions, and its peak
+traced memory usage is recorded in a separate, untimed run.  Much larger
+trees, on which rendering everything would take too long, can be generated
+with ``--discovery-sizes`` in order to time just template discovery.
+
+Results are written as JSON so that runs on different commits can be
+compared, either by hand or with the ``--compare`` option (``tox -e bench --
+ARGS`` works as well)::
+
+    python bench/run.py --sizes 100,1000 -o before.json
+    git checkout some-branch
+    python bench/run.py --sizes 100,1000 -o after.json --compare before.json
+"""
+
+from __future__ import annotations
+import argparse
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import gc
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+from dotplate import Config, Dotplate, RenderedFile, __version__
+from dotplate.util import listdir
+
+#: Bump this when the structure of the results file changes
+RESULTS_VERSION = 1
+
+#: Number of templates per generated directory
+DIR_SIZE = 100
+
+#: One out of this many installed files are modified for the "diff-changed"
+#: phase
+CHANGED_EVERY = 4
+
+
+@dataclass
+class TreeSpec:
+    templates: int
+    depth: int
+    suites: int
+    git: bool
+    #: Whether to only time the phases that discover templates
+    discovery_only: bool = False
+
+    @property
+    def label(self) -> str:
+        label = (
+            f"templates={self.templates} depth={self.depth}"
+            f" suites={self.suites} git={self.git}"
+        )
+        if self.discovery_only:
+            label += " discovery-only"
+        return label
+
+
+@dataclass
+class PhaseResult:
+    #: Wall-clock time of each repetition, in seconds
+    seconds: list[float]
+    #: Peak memory traced by `tracemalloc` during a separate run, in bytes
+    peak_memory: int | None = None
+
+    @property
+    def best(self) -> float:
+        return min(self.seconds)
+
+
+@dataclass
+class TreeResult:
+    spec: TreeSpec
+    phases: dict[str, PhaseResult] = field(default_factory=dict)
+
+
+def generate_tree(root: Path, spec: TreeSpec) -> Path:
+    """
+    Generate a source tree & config file under `root` and return the path to
+    the config file
+    """
+    src = root / "src"
+    inc = src / "_include"
+    inc.mkdir(parents=True)
+    for level in range(spec.depth):
+        if level + 1 < spec.depth:
+            nested = f'{{% include "_include/level{level + 1}.j2" %}}'
+        else:
+            nested = ""
+        (inc / f"level{level}.j2").write_text(
+            f"# Level {level} for {{{{ dotplate.template }}}}\n"
+            f"{{% for p in dotplate.vars.paths %}}{level}:{{{{ p }}}}\n"
+            f"{{% endfor %}}{nested}"
+        )
+    include = '{% include "_include/level0.j2" %}\n' if spec.depth else ""
+    suite_files: list[list[str]] = [[] for _ in range(spec.suites)]
+    for i in range(spec.templates):
+        rel = f"dir{i // DIR_SIZE:04d}/file{i:06d}.conf"
+        p = src / rel
+        p.parent.mkdir(exist_ok=True)
+        p.write_text(
+            f"# Template {i}\n"
+            "editor = {{ dotplate.vars.editor }}\n"
+            "{% if dotplate.vars.enabled %}enabled = true{% endif %}\n"
+            f"{include}"
+        )
+        if spec.suites and i % 2:
+            suite_files[i % spec.suites].append(rel)
+    cfg = [
+        "[core]",
+        'src = "src"',
+        'dest = "dest"',
+        "",
+        "[vars]",
+        'editor = "vim"',
+        "enabled = true",
+        'paths = ["/usr/local/bin", "/usr/bin", "/bin"]',
+    ]
+    for n, files in enumerate(suite_files):
+        enabled = "true" if n % 2 == 0 else "false"
+        cfg.extend(["", f"[suites.suite{n:03d}]", f"enabled = {enabled}"])
+        cfg.append("files = [" + ", ".join(json.dumps(f) for f in files) + "]")
+    cfgfile = root / "dotplate.toml"
+    cfgfile.write_text("\n".join(cfg) + "\n")
+    if spec.git:
+        git = ["git", "-c", "user.name=Bench", "-c", "user.email=bench@example.nil"]
+        subprocess.run([*git, "init", "-q"], cwd=root, check=True)
+        subprocess.run([*git, "add", "."], cwd=root, check=True)
+        subprocess.run([*git, "commit", "-q", "-m", "Bench"], cwd=root, check=True)
+    return cfgfile
+
+
+def modify_files(dest: Path) -> None:
+    """
+    Edit one out of every `CHANGED_EVERY` of the installed files in `dest`,
+    changing one line & adding another
+    """
+    for i, p in enumerate(sorted(dest.rglob("*.conf"))):
+        if i % CHANGED_EVERY == 0:
+            text = p.read_text().replace("editor = vim", "editor = emacs")
+            p.write_text(text + "# Local addition\n")
+
+
+def run_phase(
+    setup: Callable[[], Any], body: Callable[[Any], Any], repeat: int, memory: bool
+) -> PhaseResult:
+    """
+    Time `body(setup())` `repeat` times, only timing `body`.  If `memory` is
+    true, do one more run with `tracemalloc` enabled to record peak memory.
+    """
+    seconds = []
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.perf_counter()
+        body(arg)
+        seconds.append(time.perf_counter() - start)
+    result = PhaseResult(seconds=seconds)
+    if memory:
+        arg = setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            body(arg)
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def bench_tree(spec: TreeSpec, repeat: int, memory: bool) -> TreeResult:
+    result = TreeResult(spec=spec)
+    with tempfile.TemporaryDirectory(prefix="dotplate-bench-") as tmp:
+        root = Path(tmp)
+        cfgfile = generate_tree(root, spec)
+        cfg = Config.load(cfgfile)
+        src = cfg.core.src
+
+        def fresh() -> Dotplate:
+            return Dotplate.from_config(cfg.model_copy(deep=True))
+
+        dest_counter = 0
+
+        def fresh_dest() -> Dotplate:
+            nonlocal dest_counter
+            dest_counter += 1
+            dp = fresh()
+            dp.dest = root / f"dest{dest_counter}"
+            return dp
+
+        def rendered(dest: Path | None = None) -> list[RenderedFile]:
+            dp = fresh()
+            if dest is not None:
+                dp.dest = dest
+            return [dp.render(t) for t in dp.templates()]
+
+        def full_diff(files: list[RenderedFile]) -> None:
+            # A diff's delta & stat are computed lazily, so they have to be
+            # accessed in order for the line diffing to be timed:
+            for f in files:
+                f.diff().delta
+                f.diff().stat
+
+        phases: dict[str, tuple[Callable[[], Any], Callable[[Any], Any]]] = {
+            "discovery": (lambda: src, listdir),
+            "templates": (fresh, lambda dp: dp.templates()),
+        }
+        if not spec.discovery_only:
+            # Give the "diff" phase existing destination files to compare
+            # with, and give the "diff-changed" phase destination files of
+            # which some differ from their templates:
+            fresh().install()
+            changed = fresh_dest()
+            changed.install()
+            modify_files(changed.dest)
+            phases["render"] = (
+                fresh,
+                lambda dp: [dp.render(t) for t in dp.templates()],
+            )
+            phases["diff"] = (rendered, lambda files: [f.diff() for f in files])
+            phases["diff-changed"] = (lambda: rendered(changed.dest), full_diff)
+            phases["install"] = (fresh_dest, lambda dp: dp.install())
+        for name, (setup, body) in phases.items():
+            result.phases[name] = run_phase(setup, body, repeat, memory)
+    return result
+
+
+def source_commit() -> str | None:
+    """Return the commit of the dotplate checkout being benchmarked, if any"""
+    try:
+        r = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return None
+    return r.stdout.strip()
+
+
+def to_json(results: list[TreeResult]) -> dict[str, Any]:
+    return {
+        "version": RESULTS_VERSION,
+        "dotplate_version": __version__,
+        "commit": source_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "platform": platform.platform(),
+        "results": [
+            {
+                **asdict(r.spec),
+                "phases": {
+                    name: {**asdict(ph), "best": ph.best}
+                    for name, ph in r.phases.items()
+                },
+            }
+            for r in results
+        ],
+    }
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any]) -> None:
+    def key(entry: dict[str, Any]) -> tuple:
+        return (
+            entry["templates"],
+            entry["depth"],
+            entry["suites"],
+            entry["git"],
+            entry.get("discovery_only", False),
+        )
+
+    base = {key(e): e for e in baseline["results"]}
+    print(f"Compared to {baseline.get('commit') or 'baseline'}:")
+    for entry in current["results"]:
+        if (old := base.get(key(entry))) is None:
+            continue
+        spec = TreeSpec(
+            templates=entry["templates"],
+            depth=entry["depth"],
+            suites=entry["suites"],
+            git=entry["git"],
+            discovery_only=entry.get("discovery_only", False),
+        )
+        print(f"  {spec.label}")
+        for name, ph in entry["phases"].items():
+            if (oldph := old["phases"].get(name)) is None:
+                continue
+            ratio = ph["best"] / oldph["best"] if oldph["best"] else float("inf")
+            print(
+                f"    {name:<12} {oldph['best']:9.4f}s -> {ph['best']:9.4f}s"
+                f"  ({ratio:.2f}x)"
+            )
+
+
+def parse_sizes(s: str) -> list[int]:
+    return [int(n) for n in s.split(",") if n.strip()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark dotplate")
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=[100, 1000, 10000],
+        help="Comma-separated numbers of templates  [default: 100,1000,10000]",
+    )
+    parser.add_argument(
+        "--discovery-sizes",
+        type=parse_sizes,
+        default=[100000],
+        help=(
+            "Comma-separated numbers of templates for trees on which only"
+            " template discovery is timed  [default: 100000]"
+        ),
+    )
+    parser.add_argument(
+        "--depth", type=int, default=5, help="Depth of include chains  [default: 5]"
+    )
+    parser.add_argument(
+        "--suites", type=int, default=20, help="Number of suites  [default: 20]"
+    )
+    parser.add_argument(
+        "--git",
+        choices=["yes", "no", "both"],
+        default="both",
+        help="Whether to commit the trees to Git  [default: both]",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Timed runs per phase  [default: 3]"
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="Don't measure peak memory usage",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=Path,
+        default=Path("bench-results.json"),
+        help="Write results to the given file  [default: bench-results.json]",
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        metavar="BASELINE",
+        help="Print a comparison against a previous results file",
+    )
+    args = parser.parse_args(argv)
+    if args.git == "both":
+        gitmodes = [False, True]
+    else:
+        gitmodes = [args.git == "yes"]
+    if True in gitmodes and shutil.which("git") is None:
+        print("Git is not installed; skipping Git-tracked trees", file=sys.stderr)
+        gitmodes.remove(True)
+    # Don't let the user's environment affect the results:
+    os.environ.pop("DOTPLATE_CONFIG_CACHE", None)
+    specs = [
+        TreeSpec(templates=size, depth=args.depth, suites=args.suites, git=git)
+        for size in args.sizes
+        for git in gitmodes
+    ]
+    specs.extend(
+        TreeSpec(templates=size, depth=0, suites=0, git=git, discovery_only=True)
+        for size in args.discovery_sizes
+        for git in gitmodes
+    )
+    results = []
+    for spec in specs:
+        print(spec.label, file=sys.stderr)
+        r = bench_tree(spec, args.repeat, args.memory)
+        for name, ph in r.phases.items():
+            mem = (
+                f"  peak {ph.peak_memory / 1048576:8.1f} MiB"
+                if ph.peak_memory is not None
+                else ""
+            )
+            print(f"  {name:<12} {ph.best:9.4f}s{mem}", file=sys.stderr)
+        results.append(r)
+    data = to_json(results)
+    args.outfile.write_text(json.dumps(data, indent=2) + "\n")
+    if args.compare is not None:
+        compare(data, json.loads(args.compare.read_text()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
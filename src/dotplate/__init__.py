@@ -20,7 +20,8 @@ Features
   ignored.
 
 - Templates are automatically discovered by traversing the source directory.
-  If the directory is tracked by Git, only committed files are recognized.
+  If the directory is tracked by Git, only committed files (and, optionally,
+  staged files) are recognized.
 
 - If a template has the executable bit set, the installed file will have the
   executable bit set.
@@ -52,22 +53,48 @@ __author_email__ = "dotplate@varonathe.org"
 __license__ = "MIT"
 __url__ = "https://github.com/jwodder/dotplate"
 
-from .config import (
-    Config,
-    CoreConfig,
-    JinjaConfig,
-    LocalConfig,
-    LocalTblConfig,
-    SelectAutoescapeConfig,
-    SuiteConfig,
-)
-from .dotplate import Diff, DiffState, Dotplate, RenderedFile, XBitDiff
-from .errors import DotplateError, InactiveTemplate, TemplateNotFound
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .config import (
+        BytecodeCacheConfig,
+        Config,
+        CoreConfig,
+        JinjaConfig,
+        LocalConfig,
+        LocalTblConfig,
+        SelectAutoescapeConfig,
+        SuiteConfig,
+    )
+    from .dotplate import (
+        BaseRenderedFile,
+        Diff,
+        DiffStat,
+        DiffState,
+        Dotplate,
+        RenderedFile,
+        StreamedFile,
+        VerbatimFile,
+        XBitDiff,
+    )
+    from .errors import (
+        DaemonRunning,
+        DotplateError,
+        InactiveTemplate,
+        RenderError,
+        RevisionNotFound,
+        TemplateNotFound,
+    )
 
 __all__ = [
+    "BaseRenderedFile",
+    "BytecodeCacheConfig",
     "Config",
     "CoreConfig",
+    "DaemonRunning",
     "Diff",
+    "DiffStat",
     "DiffState",
     "Dotplate",
     "DotplateError",
@@ -75,9 +102,57 @@ __all__ = [
     "JinjaConfig",
     "LocalConfig",
     "LocalTblConfig",
+    "RenderError",
     "RenderedFile",
+    "RevisionNotFound",
     "SelectAutoescapeConfig",
+    "StreamedFile",
     "SuiteConfig",
     "TemplateNotFound",
+    "VerbatimFile",
     "XBitDiff",
 ]
+
+# The submodules (and their dependencies, like Jinja and pydantic) are only
+# imported when one of their attributes is first accessed, so that importing
+# `dotplate` stays cheap:
+_LAZY_ATTRS = {
+    "BytecodeCacheConfig": "config",
+    "Config": "config",
+    "CoreConfig": "config",
+    "JinjaConfig": "config",
+    "LocalConfig": "config",
+    "LocalTblConfig": "config",
+    "SelectAutoescapeConfig": "config",
+    "SuiteConfig": "config",
+    "BaseRenderedFile": "dotplate",
+    "Diff": "dotplate",
+    "DiffStat": "dotplate",
+    "DiffState": "dotplate",
+    "Dotplate": "dotplate",
+    "RenderedFile": "dotplate",
+    "StreamedFile": "dotplate",
+    "VerbatimFile": "dotplate",
+    "XBitDiff": "dotplate",
+    "DaemonRunning": "errors",
+    "DotplateError": "errors",
+    "InactiveTemplate": "errors",
+    "RenderError": "errors",
+    "RevisionNotFound": "errors",
+    "TemplateNotFound": "errors",
+}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        modname = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = import_module(f".{modname}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -1,21 +1,28 @@
 from __future__ import annotations
 import argparse
 from collections.abc import Sequence
+from contextlib import aclosing
 from enum import Enum
 from pathlib import Path
 import sys
-from typing import Any
+from typing import TYPE_CHECKING, Any, Literal
 from . import __version__
-from .config import Config, LocalConfig
-from .dotplate import Dotplate, RenderedFile
+from .config import Config
+from .dotplate import BaseRenderedFile, DiffDetail, DiffStat, Dotplate
+from .errors import DaemonRunning, RenderError, RevisionNotFound
+from .install import Durability
+from .timing import NULL_PROFILER, Profiler
 
-try:
-    import readline  # noqa: F401
-except ImportError:
-    pass
+if TYPE_CHECKING:
+    from .daemon import Response
 
 DEFAULT_CONFIG_PATH = Path("dotplate.toml")
 
+#: The maximum width of the bars in the output of ``diff --stat``
+STAT_GRAPH_WIDTH = 50
+
+DiffFormat = Literal["patch", "stat", "name-only"]
+
 
 class EnableSuite(argparse.Action):
     def __call__(
@@ -47,22 +54,85 @@ class DisableSuite(argparse.Action):
         namespace.suites_enabled = enabled
 
 
+#: Subcommands that a daemon can run on behalf of the command-line client
+DAEMON_COMMANDS = {"deps", "diff", "install", "list", "render"}
+
+
 def main(argv: list[str] | None = None) -> int:
-    (dotplate, ns) = parse_args(argv)
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser()
+    ns = parser.parse_args(argv)
+    if (response := daemon_request(ns, argv)) is not None:
+        sys.stdout.write(response.stdout)
+        sys.stderr.write(response.stderr)
+        return response.rc
+    dotplate = setup(parser, ns)
+    try:
+        return run(dotplate, ns)
+    finally:
+        if dotplate.revision is not None:
+            dotplate.revision.close()
+        if isinstance(dotplate.profiler, Profiler):
+            if ns.profile_format == "json":
+                print(dotplate.profiler.report_json(), file=sys.stderr)
+            else:
+                print(dotplate.profiler.report_text(), file=sys.stderr)
+
+
+def run(dotplate: Dotplate, ns: argparse.Namespace) -> int:
+    if getattr(ns, "templates", None):
+        # Look up just the named templates instead of listing the whole
+        # source directory:
+        dotplate.discover_named(ns.templates)
     match ns.cmd:
         case "diff":
-            return diff(dotplate, ns.templates)
+            return diff(
+                dotplate,
+                ns.templates,
+                jobs=ns.jobs,
+                concurrency=ns.concurrency,
+                full=ns.full,
+                stream=ns.stream,
+                fmt=ns.format,
+            )
         case "install":
-            return install(dotplate, ns.templates, yes=ns.yes)
+            return install(
+                dotplate,
+                ns.templates,
+                yes=ns.yes,
+                jobs=ns.jobs,
+                concurrency=ns.concurrency,
+                full=ns.full,
+                stream=ns.stream,
+                durability=ns.durability,
+                transactional=ns.transactional,
+            )
+        case "deps":
+            return deps_cmd(dotplate, ns.template, dependencies=ns.dependencies)
         case "list":
             return list_cmd(dotplate)
         case "render":
-            return render(dotplate, ns.template)
+            if ns.archive is not None:
+                return render_archive(dotplate, ns)
+            return render(dotplate, ns.templates[0])
+        case "watch":
+            return watch(dotplate, ns)
+        case "daemon":
+            return daemon(dotplate, ns)
+        case "fleet":
+            return fleet(dotplate, ns)
         case _:
             raise RuntimeError(f"Unhandled subcommand: {ns.cmd!r}")
 
 
 def parse_args(argv: list[str] | None = None) -> tuple[Dotplate, argparse.Namespace]:
+    parser = build_parser()
+    ns = parser.parse_args(argv)
+    return (setup(parser, ns), ns)
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Yet another dotfile manager/templater",
         epilog=(
@@ -95,6 +165,34 @@ def parse_args(argv: list[str] | None = None) -> tuple[Dotplate, argparse.Namesp
         metavar="PATH",
         help="Read the local config from the given file  [default: set by config]",
     )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Don't hand the command off to a running daemon",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "On exit, print to stderr how long each phase of processing took,"
+            " in total and for the slowest templates"
+        ),
+    )
+    parser.add_argument(
+        "--profile-format",
+        choices=["text", "json"],
+        default="text",
+        help="Output format for --profile  [default: text]",
+    )
+    parser.add_argument(
+        "-r",
+        "--rev",
+        metavar="REV",
+        help=(
+            "Read templates from the given revision of the Git repository"
+            " containing the source directory instead of from the working tree"
+        ),
+    )
     parser.add_argument(
         "-s",
         "--enable-suite",
@@ -131,6 +229,56 @@ def parse_args(argv: list[str] | None = None) -> tuple[Dotplate, argparse.Namesp
         action="store_true",
         help="Install all active templates without prompting for confirmation",
     )
+    install.add_argument(
+        "--durability",
+        choices=["none", "syncfs", "fsync"],
+        help=(
+            "How to flush installed files to disk: not at all, once per"
+            " filesystem at the end, or after each file  [default: set by config]"
+        ),
+    )
+    install.add_argument(
+        "--transaction",
+        dest="transactional",
+        action="store_true",
+        default=None,
+        help=(
+            "Write all files to temporary locations first and only move them"
+            " into place once everything has been written"
+        ),
+    )
+    install_par = install.add_mutually_exclusive_group()
+    install_par.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        metavar="N",
+        help="Render & diff templates using N worker processes  [default: 1]",
+    )
+    install_par.add_argument(
+        "--concurrency",
+        type=positive_int,
+        metavar="N",
+        help=(
+            "Render, diff, & install up to N files at once on a pool of threads;"
+            " useful when the destination is on a slow network filesystem.  When"
+            " prompting, files are installed after all prompts are answered."
+        ),
+    )
+    install.add_argument(
+        "--full",
+        action="store_true",
+        help="Process templates even if the state file shows them to be unchanged",
+    )
+    install.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Render templates to temporary files instead of memory; useful for"
+            " very large outputs"
+        ),
+    )
     install.add_argument("templates", nargs="*")
     diff = subparsers.add_parser(
         "diff",
@@ -143,19 +291,208 @@ def parse_args(argv: list[str] | None = None) -> tuple[Dotplate, argparse.Namesp
             "diffed."
         ),
     )
+    diff_par = diff.add_mutually_exclusive_group()
+    diff_par.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        metavar="N",
+        help="Render & diff templates using N worker processes  [default: 1]",
+    )
+    diff_par.add_argument(
+        "--concurrency",
+        type=positive_int,
+        metavar="N",
+        help=(
+            "Render & diff up to N files at once on a pool of threads; useful"
+            " when the destination is on a slow network filesystem"
+        ),
+    )
+    diff.add_argument(
+        "--full",
+        action="store_true",
+        help="Process templates even if the state file shows them to be unchanged",
+    )
+    diff.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Render templates to temporary files instead of memory; useful for"
+            " very large outputs"
+        ),
+    )
+    diff_fmt = diff.add_mutually_exclusive_group()
+    diff_fmt.add_argument(
+        "--stat",
+        action="store_const",
+        const="stat",
+        dest="format",
+        default="patch",
+        help="Output the number of lines added & removed in each changed file",
+    )
+    diff_fmt.add_argument(
+        "--name-only",
+        action="store_const",
+        const="name-only",
+        dest="format",
+        help="Output just the names of the changed templates",
+    )
     diff.add_argument("templates", nargs="*")
+    deps = subparsers.add_parser(
+        "deps",
+        help=(
+            "List the templates that include, import, or extend the given\n"
+            "template, directly or indirectly"
+        ),
+    )
+    deps.add_argument(
+        "--dependencies",
+        action="store_true",
+        help=(
+            "Instead list the templates that the given template includes,"
+            " imports, or extends"
+        ),
+    )
+    deps.add_argument("template")
     subparsers.add_parser("list", help="List all active templates")
     render = subparsers.add_parser(
-        "render", help="Render the given template and output the resulting text"
+        "render",
+        help=(
+            "Render the given template and output the resulting text.\n"
+            "\n"
+            "With --archive, render the given templates (default: all active\n"
+            "templates) into an archive instead, without touching the\n"
+            "destination directory."
+        ),
     )
-    render.add_argument("template")
-    ns = parser.parse_args(argv)
-    cfg = Config.from_file(ns.config)
-    if ns.local_config is None:
-        cfg.load_local_config()
+    render.add_argument(
+        "--archive",
+        choices=["tar", "zip"],
+        help="Output a tar or zip archive of the rendered templates",
+    )
+    render.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        metavar="PATH",
+        help="Write the archive to the given file  [default: stdout]",
+    )
+    render.add_argument("templates", nargs="*", metavar="template")
+    watch = subparsers.add_parser(
+        "watch",
+        help=(
+            "Watch the source directory & config files for changes, and re-diff\n"
+            "(or, with --install, install) the affected templates whenever\n"
+            "something changes.  All active templates are processed on startup.\n"
+            "Stop with Ctrl-C."
+        ),
+    )
+    watch.add_argument(
+        "--install",
+        action="store_true",
+        help="Install affected templates without prompting instead of diffing them",
+    )
+    watch.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes instead of using inotify",
+    )
+    watch.add_argument(
+        "--interval",
+        type=positive_float,
+        default=0.5,
+        metavar="SECONDS",
+        help="How often to poll for changes  [default: 0.5]",
+    )
+    daemon = subparsers.add_parser(
+        "daemon",
+        help=(
+            "Run in the foreground as a daemon that keeps the config & compiled\n"
+            "templates in memory and runs the deps, diff, install --yes, list, and\n"
+            "render commands on behalf of dotplate invocations that use the same\n"
+            "config files, reloading whenever the config or templates change.\n"
+            "Stop with Ctrl-C."
+        ),
+    )
+    daemon.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes instead of using inotify",
+    )
+    fleet = subparsers.add_parser(
+        "fleet",
+        help=(
+            "Render all active templates once for each of the given local config\n"
+            "files (one per host) and write each host's files to a directory (or\n"
+            "archive) in the output directory named after the local config file.\n"
+            "Nothing is installed, and the state file is not used."
+        ),
+    )
+    fleet.add_argument(
+        "-o",
+        "--outdir",
+        type=Path,
+        required=True,
+        metavar="DIRPATH",
+        help="Write the hosts' files under the given directory",
+    )
+    fleet.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        metavar="N",
+        help="Render hosts using N worker processes  [default: 1]",
+    )
+    fleet.add_argument(
+        "--archive",
+        choices=["tar", "zip"],
+        help="Write each host's files to an archive of the given format",
+    )
+    fleet.add_argument("local_configs", nargs="+", type=Path, metavar="LOCALCONFIG")
+    return parser
+
+
+def setup(parser: argparse.ArgumentParser, ns: argparse.Namespace) -> Dotplate:
+    """
+    Construct the `Dotplate` instance for the parsed command-line arguments,
+    reporting invalid combinations of options via `parser`
+    """
+    if ns.cmd == "watch" and ns.rev is not None:
+        parser.error("--rev cannot be used with watch")
+    if ns.cmd == "daemon" and not daemon_compatible(ns):
+        parser.error(
+            "--dest, --enable-suite, --disable-suite, and --rev cannot be used"
+            " with daemon"
+        )
+    if ns.cmd == "render":
+        if ns.archive is None and len(ns.templates) != 1:
+            parser.error(
+                "render requires exactly one template unless --archive is given"
+            )
+        if ns.archive is None and ns.output is not None:
+            parser.error("--output can only be used with --archive")
+    if ns.cmd == "fleet" and (ns.dest is not None or ns.local_config is not None):
+        parser.error("--dest and --local-config cannot be used with fleet")
+    profiler = Profiler() if ns.profile else NULL_PROFILER
+    with profiler.phase("config"):
+        try:
+            dotplate = load_dotplate(ns)
+        except RevisionNotFound as e:
+            parser.error(str(e))
+    dotplate.profiler = profiler
+    return dotplate
+
+
+def load_dotplate(ns: argparse.Namespace) -> Dotplate:
+    """Construct a `Dotplate` from the config & global command-line options"""
+    if ns.cmd == "fleet":
+        # Each host's local config is merged in separately, and the suite
+        # options are applied on top of that by `render_fleet()`
+        cfg = Config.from_file(ns.config)
     else:
-        lccfg = LocalConfig.from_file(ns.local_config)
-        cfg.merge_local_config(lccfg)
+        cfg = Config.load(ns.config, local_config=ns.local_config)
     if ns.dest is not None:
         cfg.core.dest = ns.dest
     for name, enable in getattr(ns, "suites_enabled", {}).items():
@@ -163,42 +500,326 @@ def parse_args(argv: list[str] | None = None) -> tuple[Dotplate, argparse.Namesp
             cfg.suites[name].enabled = enable
         except KeyError:
             pass
-    dotplate = Dotplate.from_config(cfg)
-    return (dotplate, ns)
+    return Dotplate.from_config(cfg, rev=ns.rev)
+
+
+def daemon_compatible(ns: argparse.Namespace) -> bool:
+    """
+    Test whether the global options are ones that a daemon can serve, i.e.,
+    whether they don't override anything in the config
+    """
+    return (
+        ns.dest is None
+        and not getattr(ns, "suites_enabled", {})
+        and ns.rev is None
+    )
 
 
-def diff(dotplate: Dotplate, templates: list[str]) -> int:
+def daemon_can_run(ns: argparse.Namespace) -> bool:
+    """Test whether a daemon can run the command given on the command line"""
+    match ns.cmd:
+        case "install":
+            # The daemon can't prompt the user
+            cmd_ok = ns.yes
+        case "render":
+            # Binary output can't be relayed by the daemon
+            cmd_ok = ns.archive is None
+        case cmd:
+            cmd_ok = cmd in DAEMON_COMMANDS
+    return cmd_ok and daemon_compatible(ns)
+
+
+def daemon_request(ns: argparse.Namespace, argv: list[str]) -> Response | None:
+    """
+    If a daemon is serving the config files named on the command line and can
+    run the requested command, have it do so and return its response
+    """
+    if ns.no_daemon or ns.profile or not daemon_can_run(ns):
+        return None
+    from .daemon import request, socket_path
+
+    path = socket_path(ns.config, ns.local_config)
+    if not path.exists():
+        return None
+    return request(path, argv)
+
+
+def run_in_daemon(dotplate: Dotplate, argv: list[str]) -> int | None:
+    """
+    Run the command for a client's command-line arguments in the daemon.
+    Returns `None` if the client needs to run the command itself.
+    """
+    parser = build_parser()
+    ns = parser.parse_args(argv)
+    if not daemon_can_run(ns):
+        parser.error("command cannot be run by the daemon")
+    if ns.cmd == "render" and dotplate.is_verbatim(ns.templates[0]):
+        # Verbatim files may be binary, and only text can be relayed
+        return None
+    return run(dotplate, ns)
+
+
+def positive_int(s: str) -> int:
+    try:
+        n = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: {s!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"value must be at least 1: {s!r}")
+    return n
+
+
+def positive_float(s: str) -> float:
+    try:
+        x = float(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {s!r}")
+    if not x > 0:
+        raise argparse.ArgumentTypeError(f"value must be positive: {s!r}")
+    return x
+
+
+def diff(
+    dotplate: Dotplate,
+    templates: list[str],
+    jobs: int = 1,
+    concurrency: int | None = None,
+    full: bool = False,
+    stream: bool = False,
+    fmt: DiffFormat = "patch",
+) -> int:
     if not templates:
         templates = dotplate.templates()
-    for sp in templates:
-        file = dotplate.render(sp)
-        d = file.diff()
-        if d.state:
-            print(d.delta, end="")
-    return 0
+    rc = 0
+    stats: list[tuple[str, DiffStat]] = []
+
+    def show(file: BaseRenderedFile | RenderError) -> None:
+        nonlocal rc
+        if isinstance(file, RenderError):
+            print(file, file=sys.stderr)
+            rc = 1
+            return
+        try:
+            d = file.diff()
+            if d.state:
+                match fmt:
+                    case "patch":
+                        print(d.delta, end="")
+                    case "stat":
+                        stats.append((file.template, d.stat))
+                    case "name-only":
+                        print(file.template)
+        finally:
+            file.discard()
+
+    # Compute the part of each diff that will be shown while diffing so that
+    # it's done by the workers:
+    detail: DiffDetail | None
+    match fmt:
+        case "patch":
+            detail = "delta"
+        case "stat":
+            detail = "stat"
+        case "name-only":
+            detail = None
+    if concurrency is None:
+        for file in dotplate.render_many(
+            templates,
+            jobs=jobs,
+            skip_unchanged=not full,
+            stream=stream,
+            detail=detail,
+        ):
+            show(file)
+    else:
+        import asyncio
+
+        async def show_all() -> None:
+            async with aclosing(
+                dotplate.arender_many(
+                    templates,
+                    concurrency=concurrency,
+                    skip_unchanged=not full,
+                    stream=stream,
+                    detail=detail,
+                )
+            ) as files:
+                async for file in files:
+                    show(file)
+
+        asyncio.run(show_all())
+    if stats:
+        print_stat(stats)
+    return rc
+
 
+def print_stat(stats: list[tuple[str, DiffStat]]) -> None:
+    """
+    Print a summary of the numbers of lines added & removed in each file in
+    the style of :command:`git diff --stat`
+    """
+    name_width = max(len(name) for name, _ in stats)
+    max_change = max(st.added + st.removed for _, st in stats)
+    count_width = len(str(max_change))
 
-def install(dotplate: Dotplate, templates: list[str], yes: bool) -> int:
+    def scale(n: int) -> int:
+        # Bars are shrunk to fit, but every nonzero count gets at least one
+        # character:
+        if max_change <= STAT_GRAPH_WIDTH or n == 0:
+            return n
+        return 1 + n * (STAT_GRAPH_WIDTH - 1) // max_change
+
+    for name, st in stats:
+        graph = "+" * scale(st.added) + "-" * scale(st.removed)
+        count = st.added + st.removed
+        print(f" {name:<{name_width}} | {count:>{count_width}} {graph}".rstrip())
+    added = sum(st.added for _, st in stats)
+    removed = sum(st.removed for _, st in stats)
+    summary = f" {len(stats)} file{'' if len(stats) == 1 else 's'} changed"
+    if added or not removed:
+        summary += f", {added} insertion{'' if added == 1 else 's'}(+)"
+    if removed or not added:
+        summary += f", {removed} deletion{'' if removed == 1 else 's'}(-)"
+    print(summary)
+
+
+def install(
+    dotplate: Dotplate,
+    templates: list[str],
+    yes: bool,
+    jobs: int = 1,
+    concurrency: int | None = None,
+    full: bool = False,
+    stream: bool = False,
+    durability: Durability | None = None,
+    transactional: bool | None = None,
+) -> int:
     if not templates:
         templates = dotplate.templates()
-    files = [dotplate.render(p) for p in templates]
-    for f in files:
-        if not f.diff():
-            continue
-        if yes:
-            action = PromptAction.YES
-        else:
-            action = install_prompt(f)
-            if action is PromptAction.ALL:
-                yes = True
-                action = PromptAction.YES
-            elif action is PromptAction.CTRL_C:
-                return 1
-        if action is PromptAction.YES:
-            f.install()
-            print(f"Installed {f.template} at {f.dest_path}")
-        elif action is PromptAction.QUIT:
-            break
+    if concurrency is not None:
+        import asyncio
+
+        return asyncio.run(
+            install_concurrently(
+                dotplate,
+                templates,
+                yes=yes,
+                concurrency=concurrency,
+                full=full,
+                stream=stream,
+                durability=durability,
+                transactional=transactional,
+            )
+        )
+    rc = 0
+    try:
+        with dotplate.installer(
+            durability=durability,
+            transactional=transactional,
+            on_install=print_installed,
+        ) as installer:
+            for f in dotplate.render_many(
+                templates, jobs=jobs, skip_unchanged=not full, stream=stream
+            ):
+                if isinstance(f, RenderError):
+                    print(f, file=sys.stderr)
+                    rc = 1
+                    continue
+                try:
+                    if not f.diff():
+                        dotplate.record_state(f)
+                        continue
+                    if yes:
+                        action = PromptAction.YES
+                    else:
+                        action = install_prompt(f)
+                        if action is PromptAction.ALL:
+                            yes = True
+                            action = PromptAction.YES
+                        elif action is PromptAction.CTRL_C:
+                            installer.rollback()
+                            return 1
+                    if action is PromptAction.YES:
+                        with dotplate.profiler.phase("install", f.template):
+                            installer.install(f)
+                    elif action is PromptAction.QUIT:
+                        break
+                finally:
+                    f.discard()
+    finally:
+        dotplate.save_state()
+    return rc
+
+
+async def install_concurrently(
+    dotplate: Dotplate,
+    templates: list[str],
+    yes: bool,
+    concurrency: int,
+    full: bool = False,
+    stream: bool = False,
+    durability: Durability | None = None,
+    transactional: bool | None = None,
+) -> int:
+    """
+    Like `install()`, but with the rendering, diffing, and installing done
+    by `dotplate.aio` with up to `concurrency` files at once.  Any prompting
+    is done as the diffs come in, and the files are installed afterwards.
+    """
+    from .aio import install_files
+
+    rc = 0
+    files: list[BaseRenderedFile] = []
+    try:
+        async with aclosing(
+            dotplate.arender_many(
+                templates,
+                concurrency=concurrency,
+                skip_unchanged=not full,
+                stream=stream,
+            )
+        ) as results:
+            async for f in results:
+                if isinstance(f, RenderError):
+                    print(f, file=sys.stderr)
+                    rc = 1
+                    continue
+                files.append(f)
+                if yes or not f.diff():
+                    continue
+                action = install_prompt(f)
+                if action is PromptAction.ALL:
+                    yes = True
+                elif action is PromptAction.CTRL_C:
+                    return 1
+                elif action is not PromptAction.YES:
+                    files.pop().discard()
+                    if action is PromptAction.QUIT:
+                        break
+        installer = dotplate.installer(
+            durability=durability,
+            transactional=transactional,
+            on_install=print_installed,
+        )
+        await install_files(dotplate, installer, files, concurrency)
+    finally:
+        for f in files:
+            f.discard()
+        dotplate.save_state()
+    return rc
+
+
+def print_installed(f: BaseRenderedFile) -> None:
+    print(f"Installed {f.template} at {f.dest_path}")
+
+
+def deps_cmd(dotplate: Dotplate, template: str, dependencies: bool = False) -> int:
+    if dependencies:
+        templates = dotplate.dependencies(template)
+    else:
+        templates = dotplate.dependents(template)
+    for t in templates:
+        print(t)
     return 0
 
 
@@ -209,11 +830,130 @@ def list_cmd(dotplate: Dotplate) -> int:
 
 
 def render(dotplate: Dotplate, template: str) -> int:
-    f = dotplate.render(template)
-    print(f.content, end="")
+    if dotplate.is_verbatim(template):
+        f = dotplate.copy(template)
+        sys.stdout.flush()
+        f.write_to(sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        return 0
+    for chunk in dotplate.generate(template):
+        sys.stdout.write(chunk)
     return 0
 
 
+def render_archive(dotplate: Dotplate, ns: argparse.Namespace) -> int:
+    templates = ns.templates or None
+    if ns.output is None:
+        sys.stdout.flush()
+        errors = dotplate.render_archive(sys.stdout.buffer, ns.archive, templates)
+        sys.stdout.buffer.flush()
+    else:
+        with ns.output.open("wb") as fp:
+            errors = dotplate.render_archive(fp, ns.archive, templates)
+    for err in errors:
+        print(err, file=sys.stderr)
+    return 1 if errors else 0
+
+
+def watch(dotplate: Dotplate, ns: argparse.Namespace) -> int:
+    from .watch import WatchSession, make_watcher
+
+    def show(f: BaseRenderedFile) -> None:
+        if ns.install:
+            print(f"Installed {f.template} at {f.dest_path}", flush=True)
+        else:
+            print(f.diff().delta, end="", flush=True)
+
+    def error(msg: str) -> None:
+        print(msg, file=sys.stderr, flush=True)
+
+    def reload() -> Dotplate:
+        dp = load_dotplate(ns)
+        dp.profiler = dotplate.profiler
+        return dp
+
+    config_files = [ns.config]
+    if ns.local_config is not None:
+        config_files.append(ns.local_config)
+    session = WatchSession(
+        dotplate,
+        reload=reload,
+        config_files=config_files,
+        install=ns.install,
+        on_result=show,
+        on_error=error,
+    )
+    with make_watcher(
+        dotplate.src, session.watched_files(), poll=ns.poll, interval=ns.interval
+    ) as watcher:
+        try:
+            session.run(watcher)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def daemon(dotplate: Dotplate, ns: argparse.Namespace) -> int:
+    import signal
+    from .daemon import Daemon, socket_path
+    from .watch import WatchSession, make_watcher
+
+    def error(msg: str) -> None:
+        print(msg, file=sys.stderr, flush=True)
+
+    config_files = [ns.config]
+    if ns.local_config is not None:
+        config_files.append(ns.local_config)
+    session = WatchSession(
+        dotplate,
+        reload=lambda: load_dotplate(ns),
+        config_files=config_files,
+        on_error=error,
+    )
+    path = socket_path(ns.config, ns.local_config)
+    with make_watcher(dotplate.src, session.watched_files(), poll=ns.poll) as watcher:
+        server = Daemon(session, watcher, path, run=run_in_daemon)
+        try:
+            server.listen()
+        except DaemonRunning as e:
+            error(str(e))
+            return 1
+        # Clean up the socket on `kill` as well as on Ctrl-C:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        error(f"Listening at {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+    return 0
+
+
+def fleet(dotplate: Dotplate, ns: argparse.Namespace) -> int:
+    from .fleet import load_hosts, render_fleet
+
+    try:
+        hosts = load_hosts(ns.local_configs)
+    except ValueError as e:
+        print(f"dotplate: {e}", file=sys.stderr)
+        return 1
+    ok = True
+    for r in render_fleet(
+        dotplate,
+        hosts,
+        ns.outdir,
+        jobs=ns.jobs,
+        archive=ns.archive,
+        suites_enabled=getattr(ns, "suites_enabled", {}),
+    ):
+        for err in r.errors:
+            print(f"{r.host}: {err}", file=sys.stderr)
+            ok = False
+        print(f"Rendered {r.files} files for {r.host} at {r.path}")
+    return 0 if ok else 1
+
+
 class PromptAction(Enum):
     YES = 1
     NO = 2
@@ -222,7 +962,13 @@ class PromptAction(Enum):
     CTRL_C = 5
 
 
-def install_prompt(rf: RenderedFile) -> PromptAction:
+def install_prompt(rf: BaseRenderedFile) -> PromptAction:
+    try:
+        # Importing readline enables line editing in input(); it's only
+        # needed when prompting, so don't pay for it otherwise.
+        import readline  # noqa: F401
+    except ImportError:
+        pass
     while True:
         try:
             print(f"Install {rf.template} at {rf.dest_path}?")
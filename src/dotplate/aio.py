@@ -0,0 +1,157 @@
+"""
+Rendering, diffing, and installing templates with asyncio, for destinations
+on high-latency filesystems (such as home directories on NFS) where every
+``stat()``, ``open()``, ``chmod()``, and ``rename()`` is a network round-trip.
+The blocking filesystem work for each file is run on a pool of threads so
+that the round-trips for different files overlap instead of adding up.
+"""
+
+from __future__ import annotations
+import asyncio
+from collections import deque
+from collections.abc import AsyncGenerator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import TYPE_CHECKING
+from .dotplate import BaseRenderedFile, _raise_render_error, _render_and_diff
+from .errors import RenderError
+from .install import Durability, Installer
+
+if TYPE_CHECKING:
+    from .dotplate import DiffDetail, Dotplate
+
+
+async def render_many(
+    dotplate: Dotplate,
+    templates: list[str] | None = None,
+    concurrency: int = 16,
+    skip_unchanged: bool = False,
+    stream: bool = False,
+    detail: DiffDetail | None = None,
+) -> AsyncGenerator[BaseRenderedFile | RenderError, None]:
+    """
+    Asynchronous counterpart to `Dotplate.render_many()`: render & diff each
+    of the given templates (default: all active templates) on a pool of
+    `concurrency` threads, yielding the results in the same order as the
+    input.  All threads share `dotplate`'s Jinja environment.
+    """
+    if templates is None:
+        templates = dotplate.templates()
+    fingerprint: str | None = None
+    if skip_unchanged and dotplate.state is not None:
+        fingerprint = dotplate.context_fingerprint()
+    # Create the shared Jinja environment before starting any threads so that
+    # they don't each create their own:
+    dotplate.jinja_env
+
+    def process(template: str) -> BaseRenderedFile | RenderError | None:
+        if fingerprint is not None:
+            with dotplate.profiler.phase("state"):
+                if dotplate._is_unchanged(
+                    template, dotplate.dest / template, fingerprint
+                ):
+                    return None
+        return _render_and_diff(dotplate, template, stream, detail)
+
+    loop = asyncio.get_running_loop()
+    # Keep more files in flight than there are threads so that one slow file
+    # at the head of the queue doesn't leave the other threads idle:
+    window = concurrency * 2
+    pending: deque[asyncio.Future[BaseRenderedFile | RenderError | None]] = deque()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for t in templates:
+            pending.append(loop.run_in_executor(pool, process, t))
+            if len(pending) >= window:
+                if (r := await pending.popleft()) is not None:
+                    yield r
+        while pending:
+            if (r := await pending.popleft()) is not None:
+                yield r
+    finally:
+        # If the caller stopped early, skip the templates that haven't been
+        # started yet, and clean up the temporary files of the rest:
+        pool.shutdown(wait=False, cancel_futures=True)
+        for res in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(res, BaseRenderedFile):
+                res.discard()
+
+
+async def install_files(
+    dotplate: Dotplate,
+    installer: Installer,
+    files: list[BaseRenderedFile],
+    concurrency: int = 16,
+) -> None:
+    """
+    Install each of `files` that differs from its destination using
+    `installer`, with up to `concurrency` files being installed at once, and
+    then commit the installer.  Files that need no installing are recorded in
+    the state manifest.  If anything fails, the installer is rolled back.
+    """
+    if dotplate.state is not None:
+        # Build the dependency graph (used when recording state) before
+        # starting any threads so that they don't each build it:
+        dotplate._known_graph()
+
+    def install_one(f: BaseRenderedFile) -> None:
+        with dotplate.profiler.phase("install", f.template):
+            if f.diff():
+                installer.install(f)
+            else:
+                dotplate.record_state(f)
+
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [loop.run_in_executor(pool, install_one, f) for f in files]
+    try:
+        await asyncio.gather(*futures)
+        await loop.run_in_executor(pool, installer.commit)
+    except BaseException:
+        # Wait for any installs that are already underway so that all of
+        # their staged files get cleaned up:
+        pool.shutdown(wait=False, cancel_futures=True)
+        await asyncio.gather(*futures, return_exceptions=True)
+        installer.rollback()
+        raise
+    finally:
+        pool.shutdown(wait=False)
+
+
+async def install(
+    dotplate: Dotplate,
+    templates: list[str] | None = None,
+    concurrency: int = 16,
+    full: bool = False,
+    stream: bool = False,
+    durability: Durability | None = None,
+    transactional: bool | None = None,
+) -> None:
+    """
+    Asynchronous counterpart to `Dotplate.install()`: render, diff, & install
+    the given templates (default: all active templates) with up to
+    `concurrency` files being processed at once.  If any template fails to
+    render, nothing is installed, and the exception raised by the rendering
+    is propagated.
+    """
+    files: list[BaseRenderedFile] = []
+    try:
+        async with aclosing(
+            render_many(
+                dotplate,
+                templates,
+                concurrency=concurrency,
+                skip_unchanged=not full,
+                stream=stream,
+            )
+        ) as results:
+            async for f in results:
+                if isinstance(f, RenderError):
+                    _raise_render_error(f)
+                files.append(f)
+        installer = dotplate.installer(durability, transactional)
+        await install_files(dotplate, installer, files, concurrency)
+    finally:
+        for f in files:
+            f.discard()
+        dotplate.save_state()
@@ -0,0 +1,112 @@
+"""
+Writing rendered files into tar & zip archives instead of onto the filesystem
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import shutil
+import stat
+import tarfile
+import time
+from types import TracebackType
+from typing import TYPE_CHECKING, BinaryIO, Literal
+import zipfile
+from .util import default_file_mode
+
+if TYPE_CHECKING:
+    from .dotplate import BaseRenderedFile
+
+ArchiveFormat = Literal["tar", "zip"]
+
+#: The supported archive formats
+ARCHIVE_FORMATS: list[ArchiveFormat] = ["tar", "zip"]
+
+
+class ArchiveWriter(ABC):
+    """
+    Writes files to an archive in a single sequential pass over `fp`, which
+    need not be seekable (e.g., it can be stdout).  Each file is given the
+    permissions that it would get if installed under the current umask, with
+    the executable bits set for executable files.
+    """
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self.fp = fp
+        self.mtime = int(time.time())
+        self.file_mode = default_file_mode()
+
+    def __enter__(self) -> ArchiveWriter:
+        return self
+
+    def __exit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def mode(self, executable: bool) -> int:
+        mode = self.file_mode
+        if executable:
+            mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        return mode
+
+    def add_file(self, f: BaseRenderedFile, arcname: str) -> None:
+        """Add the rendered file `f` to the archive at path `arcname`"""
+        with f.open() as src:
+            self.add(arcname, src, f.size(), f.executable)
+
+    @abstractmethod
+    def add(self, arcname: str, src: BinaryIO, size: int, executable: bool) -> None:
+        """Add `size` bytes read from `src` to the archive at path `arcname`"""
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        """Finish the archive.  `fp` is left open."""
+        ...
+
+
+class TarWriter(ArchiveWriter):
+    def __init__(self, fp: BinaryIO) -> None:
+        super().__init__(fp)
+        self.tar = tarfile.open(fileobj=fp, mode="w|", format=tarfile.PAX_FORMAT)
+
+    def add(self, arcname: str, src: BinaryIO, size: int, executable: bool) -> None:
+        info = tarfile.TarInfo(arcname)
+        info.size = size
+        info.mode = self.mode(executable)
+        info.mtime = self.mtime
+        self.tar.addfile(info, src)
+
+    def close(self) -> None:
+        self.tar.close()
+
+
+class ZipWriter(ArchiveWriter):
+    def __init__(self, fp: BinaryIO) -> None:
+        super().__init__(fp)
+        self.zip = zipfile.ZipFile(fp, mode="w", compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, arcname: str, src: BinaryIO, size: int, executable: bool) -> None:
+        info = zipfile.ZipInfo(arcname, time.localtime(self.mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = (stat.S_IFREG | self.mode(executable)) << 16
+        info.file_size = size
+        with self.zip.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as dst:
+            shutil.copyfileobj(src, dst)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+def open_archive(fp: BinaryIO, fmt: ArchiveFormat) -> ArchiveWriter:
+    """Return an `ArchiveWriter` for writing an archive of the given format"""
+    match fmt:
+        case "tar":
+            return TarWriter(fp)
+        case "zip":
+            return ZipWriter(fp)
+        case _:
+            raise ValueError(f"Unsupported archive format: {fmt!r}")
@@ -0,0 +1,81 @@
+from __future__ import annotations
+from hashlib import sha1
+import os
+from pathlib import Path
+from typing import Literal
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+CACHE_FILE_PATTERN = "__dotplate_%s.cache"
+
+
+class DotplateBytecodeCache(FileSystemBytecodeCache):
+    """
+    A persistent on-disk cache of compiled Jinja templates.
+
+    Jinja already discards a cached entry when the template's source changes;
+    in addition, the cache key for each template incorporates `salt`, which
+    should be a fingerprint of the environment settings that affect
+    compilation (delimiters, whitespace handling, extensions, etc.), so that
+    changing those settings never results in stale bytecode being loaded.
+
+    If `max_size` (in bytes) is set, the cache is pruned on construction:
+    with ``"lru"`` eviction, the least recently used entries are deleted until
+    the cache fits; with ``"clear"`` eviction, all entries are deleted.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        salt: str,
+        max_size: int | None = None,
+        eviction: Literal["lru", "clear"] = "lru",
+    ) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory), pattern=CACHE_FILE_PATTERN)
+        self.salt = salt
+        self.eviction = eviction
+        if max_size is not None:
+            self.prune(max_size)
+
+    def get_cache_key(self, name: str, filename: str | None = None) -> str:
+        h = sha1(self.salt.encode("utf-8"))
+        h.update(f"|{name}".encode("utf-8"))
+        if filename is not None:
+            h.update(f"|{filename}".encode("utf-8"))
+        return h.hexdigest()
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is not None and self.eviction == "lru":
+            # Access times are unreliable (noatime, relatime, etc.), so the
+            # modification time is bumped instead to record recent use.
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+    def prune(self, max_size: int) -> None:
+        entries: list[tuple[int, int, str]] = []
+        total = 0
+        prefix, _, suffix = CACHE_FILE_PATTERN.partition("%s")
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.startswith(prefix) and e.name.endswith(suffix):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, e.path))
+                    total += st.st_size
+        if total <= max_size:
+            return
+        if self.eviction == "lru":
+            entries.sort()
+        for _, size, path in entries:
+            if self.eviction == "lru" and total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
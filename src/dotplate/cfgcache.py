@@ -0,0 +1,106 @@
+"""
+An on-disk cache of validated configuration, so that repeated runs with
+unchanged config files can skip TOML parsing & pydantic validation
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import pickle
+import tempfile
+from typing import Any
+import pydantic
+from . import __version__
+from .util import user_cache_dir
+
+#: Environment variable that enables the config cache when set to a true
+#: value
+CACHE_ENVVAR = "DOTPLATE_CONFIG_CACHE"
+
+
+def config_cache_enabled() -> bool:
+    value = os.environ.get(CACHE_ENVVAR, "")
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class FileStamp:
+    """The identifying details of a (possibly nonexistent) file"""
+
+    path: str
+    mtime_ns: int | None
+    size: int | None
+
+    @classmethod
+    def of(cls, p: Path) -> FileStamp:
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            return cls(path=str(p), mtime_ns=None, size=None)
+        return cls(path=str(p), mtime_ns=st.st_mtime_ns, size=st.st_size)
+
+    def is_current(self) -> bool:
+        return FileStamp.of(Path(self.path)) == self
+
+
+def cache_path(filepath: str | Path, local_config: str | Path | None) -> Path:
+    """
+    Return the path at which to cache the config loaded from `filepath` &
+    `local_config`.  Everything other than the files' contents that can
+    affect the loaded config (e.g., relative paths and ``~`` expansion) is
+    part of the key.
+    """
+    key = json.dumps(
+        [
+            __version__,
+            pydantic.VERSION,
+            os.getcwd(),
+            os.path.expanduser("~"),
+            str(filepath),
+            None if local_config is None else str(local_config),
+        ]
+    )
+    digest = sha256(key.encode("utf-8")).hexdigest()
+    return user_cache_dir() / "config" / f"{digest}.pickle"
+
+
+def load_cached(cachefile: Path) -> Any:
+    """
+    Return the object cached at `cachefile` if it exists and all of the files
+    it was derived from are unchanged; otherwise, return `None`
+    """
+    try:
+        with cachefile.open("rb") as fp:
+            stamps, obj = pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Corrupt or written by an incompatible version; it'll be overwritten
+        return None
+    if all(s.is_current() for s in stamps):
+        return obj
+    return None
+
+
+def save_cached(cachefile: Path, stamps: list[FileStamp], obj: Any) -> None:
+    """
+    Cache `obj` at `cachefile` along with the stamps of the files it was
+    derived from.  Failure to write the cache is not an error.
+    """
+    try:
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cachefile.parent, prefix=cachefile.name)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump((stamps, obj), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cachefile)
+    except OSError:
+        os.unlink(tmp)
+    except BaseException:
+        os.unlink(tmp)
+        raise
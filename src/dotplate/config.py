@@ -1,14 +1,18 @@
 from __future__ import annotations
-from collections import defaultdict
 from collections.abc import Callable
+from hashlib import sha256
 from pathlib import Path
 import sys
-from typing import Annotated, Any, Literal
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from typing import TYPE_CHECKING, Annotated, Any, Literal
 from pydantic import BaseModel, Field
 from pydantic.functional_validators import AfterValidator
-from .jinja_ext import DotplateExt
-from .util import SuiteSet
+from . import __version__
+from .install import Durability
+from .util import SuiteMatcher, user_cache_dir
+
+if TYPE_CHECKING:
+    from jinja2 import BaseLoader, Environment
+    from .bccache import DotplateBytecodeCache
 
 if sys.version_info[:2] >= (3, 11):
     from tomllib import load as toml_load
@@ -40,12 +44,21 @@ class CoreConfig(BaseConfig):
     dest: ExpandedPath
     local_config: ExpandedPath | None = None
     backup_ext: str = Field(default=".dotplate.bak", min_length=1)
+    state_file: ExpandedPath | None = None
+    durability: Durability = "none"
+    transactional: bool = False
+    include_staged: bool = False
+    #: Glob patterns for files that are copied byte-for-byte instead of being
+    #: rendered
+    verbatim: list[str] = Field(default_factory=list)
 
     def resolve_paths_relative_to(self, p: Path) -> None:
         self.src = p / self.src
         self.dest = p / self.dest
         if self.local_config is not None:
             self.local_config = p / self.local_config
+        if self.state_file is not None:
+            self.state_file = p / self.state_file
 
 
 class SelectAutoescapeConfig(BaseConfig):
@@ -56,6 +69,8 @@ class SelectAutoescapeConfig(BaseConfig):
     default: bool = False
 
     def get(self) -> Callable[[str | None], bool]:
+        from jinja2 import select_autoescape
+
         return select_autoescape(
             enabled_extensions=self.enabled_extensions,
             disabled_extensions=self.disabled_extensions,
@@ -63,6 +78,18 @@ class SelectAutoescapeConfig(BaseConfig):
         )
 
 
+class BytecodeCacheConfig(BaseConfig):
+    directory: ExpandedPath | None = None
+    max_size: int | None = Field(default=None, ge=0)
+    eviction: Literal["lru", "clear"] = "lru"
+
+    def get_directory(self) -> Path:
+        if self.directory is None:
+            return user_cache_dir() / "bytecode"
+        else:
+            return self.directory
+
+
 class JinjaConfig(BaseConfig):
     block_start_string: str = "{%"
     block_end_string: str = "%}"
@@ -84,6 +111,7 @@ class JinjaConfig(BaseConfig):
     )
     cache_size: int = 400
     auto_reload: bool = True
+    bytecode_cache: BytecodeCacheConfig | None = None
 
     def get_autoescape(self) -> bool | Callable[[str | None], bool]:
         if self.autoescape is None:
@@ -91,8 +119,28 @@ class JinjaConfig(BaseConfig):
         else:
             return self.autoescape
 
+    def get_bytecode_cache(self) -> DotplateBytecodeCache | None:
+        if self.bytecode_cache is None:
+            return None
+        from .bccache import DotplateBytecodeCache
+
+        # Fingerprint every setting that can affect how templates are
+        # compiled:
+        settings = self.model_dump_json(
+            exclude={"bytecode_cache", "cache_size", "auto_reload"}
+        )
+        salt = sha256(f"{__version__}|{settings}".encode("utf-8")).hexdigest()
+        return DotplateBytecodeCache(
+            directory=self.bytecode_cache.get_directory(),
+            salt=salt,
+            max_size=self.bytecode_cache.max_size,
+            eviction=self.bytecode_cache.eviction,
+        )
+
 
 class SuiteConfig(BaseConfig):
+    # Exact paths, glob patterns, and directory prefixes ending in "/"; see
+    # `SuiteMatcher`
     files: list[str]
     enabled: bool = False
 
@@ -104,6 +152,46 @@ class Config(BaseConfig):
     vars: dict[str, Any] = Field(default_factory=dict)
     _exclude_config_path: str | None = None
 
+    @classmethod
+    def load(
+        cls,
+        filepath: str | Path,
+        local_config: str | Path | None = None,
+        use_cache: bool | None = None,
+    ) -> Config:
+        """
+        Read the config file at `filepath` and merge in the local config file
+        at `local_config` (default: the file named by ``core.local-config``,
+        if set & it exists).
+
+        If `use_cache` is true (default: if the :envvar:`DOTPLATE_CONFIG_CACHE`
+        environment variable is set to a true value), the resulting config is
+        cached on disk, and later calls with the same arguments return the
+        cached config for as long as neither file's mtime or size changes.
+        """
+        from . import cfgcache
+
+        if use_cache is None:
+            use_cache = cfgcache.config_cache_enabled()
+        if use_cache:
+            cachefile = cfgcache.cache_path(filepath, local_config)
+            cfg = cfgcache.load_cached(cachefile)
+            if isinstance(cfg, cls):
+                return cfg
+        # Files are stat'ed before they're read so that a change made while
+        # reading invalidates the cache entry.
+        stamps = [cfgcache.FileStamp.of(Path(filepath))]
+        cfg = cls.from_file(filepath)
+        if local_config is not None:
+            stamps.append(cfgcache.FileStamp.of(Path(local_config)))
+            cfg.merge_local_config(LocalConfig.from_file(local_config))
+        elif cfg.core.local_config is not None:
+            stamps.append(cfgcache.FileStamp.of(cfg.core.local_config))
+            cfg.load_local_config()
+        if use_cache:
+            cfgcache.save_cached(cachefile, stamps, cfg)
+        return cfg
+
     @classmethod
     def from_file(cls, filepath: str | Path) -> Config:
         with open(filepath, "rb") as fp:
@@ -144,20 +232,36 @@ class Config(BaseConfig):
 
     def resolve_paths_relative_to(self, p: Path) -> None:
         self.core.resolve_paths_relative_to(p)
+        bccfg = self.jinja.bytecode_cache
+        if bccfg is not None and bccfg.directory is not None:
+            bccfg.directory = p / bccfg.directory
 
     def default_suites(self) -> set[str]:
         return {name for name, suicfg in self.suites.items() if suicfg.enabled}
 
-    def paths2suites(self) -> defaultdict[str, SuiteSet]:
-        mapping: defaultdict[str, SuiteSet] = defaultdict(SuiteSet)
-        for name, suicfg in self.suites.items():
-            for file in suicfg.files:
-                mapping[file].suites.add(name)
-        return mapping
+    def paths2suites(self) -> SuiteMatcher:
+        """
+        Return a `SuiteMatcher` that maps each template path to the set of
+        suites it belongs to
+        """
+        return SuiteMatcher(
+            {name: suicfg.files for name, suicfg in self.suites.items()}
+        )
 
-    def make_jinja_env(self) -> Environment:
+    def make_jinja_env(self, loader: BaseLoader | None = None) -> Environment:
+        """
+        Create the Jinja environment for rendering templates.  By default,
+        templates are loaded from the source directory.
+        """
+        # Jinja is imported here rather than at module level so that commands
+        # that don't render anything don't pay for importing it.
+        from jinja2 import Environment, FileSystemLoader
+        from .jinja_ext import DotplateExt
+
+        if loader is None:
+            loader = FileSystemLoader(self.core.src, followlinks=True)
         return Environment(
-            loader=FileSystemLoader(self.core.src, followlinks=True),
+            loader=loader,
             block_start_string=self.jinja.block_start_string,
             block_end_string=self.jinja.block_end_string,
             variable_start_string=self.jinja.variable_start_string,
@@ -175,6 +279,7 @@ class Config(BaseConfig):
             autoescape=self.jinja.get_autoescape(),
             cache_size=self.jinja.cache_size,
             auto_reload=self.jinja.auto_reload,
+            bytecode_cache=self.jinja.get_bytecode_cache(),
         )
 
 
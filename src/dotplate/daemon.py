@@ -0,0 +1,241 @@
+"""
+A daemon that keeps a warm `Dotplate` instance in memory and runs commands
+sent by the command-line client over a Unix socket, so that repeated commands
+don't each pay for interpreter startup, config validation, template
+discovery, and template compilation
+"""
+
+from __future__ import annotations
+from collections.abc import Callable
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass
+from hashlib import sha256
+import io
+import json
+import os
+from pathlib import Path
+import socket
+import sys
+from typing import TYPE_CHECKING, Any
+from . import __version__
+from .errors import DaemonRunning
+from .util import user_cache_dir
+
+if TYPE_CHECKING:
+    from .dotplate import Dotplate
+    from .watch import Watcher, WatchSession
+
+#: Bump this when the format of requests or responses changes
+PROTOCOL_VERSION = 2
+
+
+def socket_path(config: Path, local_config: Path | None = None) -> Path:
+    """
+    Return the path of the socket for a daemon serving the config read from
+    `config` & `local_config`
+    """
+    key = json.dumps(
+        [
+            os.path.abspath(config),
+            None if local_config is None else os.path.abspath(local_config),
+        ]
+    )
+    # Socket paths are limited to about 100 bytes, so keep the name short:
+    digest = sha256(key.encode("utf-8")).hexdigest()[:16]
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        base = Path(runtime_dir, "dotplate")
+    else:
+        base = user_cache_dir() / "daemon"
+    return base / f"{digest}.sock"
+
+
+@dataclass
+class Response:
+    """The result of a command run by the daemon"""
+
+    rc: int
+    stdout: str
+    stderr: str
+
+
+def request(path: Path, argv: list[str]) -> Response | None:
+    """
+    Have the daemon listening at `path` run the command with the given
+    command-line arguments.  If no compatible daemon is listening, or if the
+    daemon says that the command must be run by the client, return `None`.
+    A daemon running with a different :envvar:`PATH` is not
+    compatible, as that affects what ``which()`` finds.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(os.fspath(path))
+            _send(
+                sock,
+                {
+                    "protocol": PROTOCOL_VERSION,
+                    "version": __version__,
+                    "argv": argv,
+                    "path": os.environ.get("PATH"),
+                },
+            )
+            sock.shutdown(socket.SHUT_WR)
+            data = _recv(sock)
+    except (OSError, ValueError):
+        # Includes stale sockets left behind by daemons that were killed
+        return None
+    try:
+        return Response(rc=data["rc"], stdout=data["stdout"], stderr=data["stderr"])
+    except (KeyError, TypeError):
+        # The daemon is a different version of dotplate
+        return None
+
+
+def is_listening(path: Path) -> bool:
+    """Test whether anything is accepting connections on the socket at `path`"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(os.fspath(path))
+    except OSError:
+        return False
+    return True
+
+
+def _send(sock: socket.socket, obj: Any) -> None:
+    sock.sendall(json.dumps(obj).encode("utf-8"))
+
+
+def _recv(sock: socket.socket) -> Any:
+    chunks = []
+    while chunk := sock.recv(65536):
+        chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+class Daemon:
+    """
+    Serves commands over a Unix socket using the `Dotplate` instance held by a
+    `WatchSession`.  Before each command, any changes to the config files or
+    source directory reported by `watcher` are applied, so that commands
+    always see the current config & templates.
+
+    Commands are run one at a time by calling `run` with the `Dotplate`
+    instance and the client's command-line arguments, with stdout & stderr
+    captured and sent back to the client.  If `run` returns `None`, the
+    client is told to run the command itself.
+    """
+
+    def __init__(
+        self,
+        session: WatchSession,
+        watcher: Watcher,
+        path: Path,
+        run: Callable[[Dotplate, list[str]], int | None],
+    ) -> None:
+        self.session = session
+        self.watcher = watcher
+        self.path = path
+        self.run = run
+        self._sock: socket.socket | None = None
+
+    def listen(self) -> None:
+        """
+        Create & bind the socket, replacing any stale socket left behind by
+        a daemon that was killed
+
+        :raises DaemonRunning: if another daemon is listening at `path`
+        """
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if is_listening(self.path):
+            raise DaemonRunning(str(self.path))
+        self.path.unlink(missing_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(os.fspath(self.path))
+            sock.listen()
+        except BaseException:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            self.path.unlink(missing_ok=True)
+
+    def warm(self) -> None:
+        """
+        Discover & compile all active templates and build the dependency
+        graph ahead of the first request
+        """
+        dp = self.session.dotplate
+        for t in dp.templates():
+            if dp.is_verbatim(t):
+                continue
+            try:
+                dp.jinja_env.get_template(t)
+            except Exception:
+                # Errors are reported when the template is rendered
+                pass
+        dp.dependency_graph.build()
+
+    def serve_forever(self) -> None:
+        if self._sock is None:
+            self.listen()
+        assert self._sock is not None
+        self.warm()
+        while True:
+            conn, _ = self._sock.accept()
+            with conn:
+                self.serve(conn)
+
+    def serve(self, conn: socket.socket) -> None:
+        """Handle a single request on an accepted connection"""
+        try:
+            req = _recv(conn)
+        except (OSError, ValueError):
+            return
+        if (
+            not isinstance(req, dict)
+            or req.get("protocol") != PROTOCOL_VERSION
+            or req.get("version") != __version__
+            or not isinstance(req.get("argv"), list)
+            or req.get("path") != os.environ.get("PATH")
+        ):
+            response: dict[str, Any] = {"error": "Incompatible client"}
+        else:
+            self.refresh()
+            response = self.handle(req["argv"])
+        try:
+            _send(conn, response)
+        except OSError:
+            pass
+
+    def refresh(self) -> None:
+        """Apply any changes to the config files or source directory"""
+        changes = self.watcher.wait(timeout=0)
+        if changes is None or changes:
+            if self.session.refresh(changes) is None:
+                self.warm()
+            for p in self.session.watched_files() - self.watcher.files:
+                self.watcher.add_file(p)
+        # Pick up changes made to the state file by anything else:
+        self.session.dotplate.reload_state()
+        self.session.dotplate.refresh_executables()
+
+    def handle(self, argv: list[str]) -> dict[str, Any]:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                rc = self.run(self.session.dotplate, argv)
+            except SystemExit as e:
+                rc = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(f"dotplate daemon: {type(e).__name__}: {e}", file=sys.stderr)
+                rc = 1
+        if rc is None:
+            return {"error": "Command must be run by the client"}
+        return {"rc": rc, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
@@ -0,0 +1,254 @@
+"""
+Tracking which templates include, import, or extend which other templates
+"""
+
+from __future__ import annotations
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from glob import escape
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, nodes
+
+#: Template globals whose results depend on the state of the system rather
+#: than on the rendering context
+IMPURE_GLOBALS = frozenset(["which"])
+
+
+@dataclass(frozen=True)
+class TemplateRefs:
+    """The references made by a single template to other templates"""
+
+    #: Templates referenced by name
+    names: frozenset[str] = frozenset()
+    #: Glob patterns (as used by `fnmatch.fnmatchcase()`) matching the names
+    #: of templates referenced via expressions that are only partially
+    #: constant, e.g., ``{% include "colors/" ~ theme %}``
+    patterns: frozenset[str] = frozenset()
+    #: Whether the template makes references that could be to any template
+    dynamic: bool = False
+    #: Whether the template uses any of `IMPURE_GLOBALS`
+    impure: bool = False
+
+    @property
+    def exact(self) -> bool:
+        """Whether all of the template's references are known by name"""
+        return not self.patterns and not self.dynamic
+
+    def matches(self, template: str) -> bool:
+        return (
+            self.dynamic
+            or template in self.names
+            or any(fnmatchcase(template, p) for p in self.patterns)
+        )
+
+
+def find_references(ast: nodes.Template) -> TemplateRefs:
+    """Return the references made by the template with the given AST"""
+    from jinja2 import nodes
+
+    names: set[str] = set()
+    patterns: set[str] = set()
+    dynamic = False
+
+    def add(expr: nodes.Expr | None) -> None:
+        nonlocal dynamic
+        if expr is None:
+            return
+        if isinstance(expr, nodes.Const) and isinstance(expr.value, (list, tuple)):
+            # `include` accepts a list of names to try in order
+            for v in expr.value:
+                if isinstance(v, str):
+                    names.add(v)
+        elif isinstance(expr, (nodes.Tuple, nodes.List)):
+            for item in expr.items:
+                add(item)
+        elif isinstance(expr, nodes.CondExpr):
+            add(expr.expr1)
+            add(expr.expr2)
+        else:
+            parts = _parts(expr)
+            if all(p is None for p in parts):
+                dynamic = True
+            elif None not in parts:
+                names.add("".join(p for p in parts if p is not None))
+            else:
+                patterns.add("".join("*" if p is None else escape(p) for p in parts))
+
+    kinds = (nodes.Extends, nodes.FromImport, nodes.Import, nodes.Include)
+    for node in ast.find_all(kinds):
+        assert isinstance(node, kinds)
+        add(node.template)
+    impure = any(
+        n.ctx == "load" and n.name in IMPURE_GLOBALS for n in ast.find_all(nodes.Name)
+    )
+    return TemplateRefs(
+        names=frozenset(names),
+        patterns=frozenset(patterns),
+        dynamic=dynamic,
+        impure=impure,
+    )
+
+
+def _parts(expr: nodes.Expr) -> list[str | None]:
+    """
+    Split a string expression into the parts that are constant and the parts
+    (represented by `None`) that can't be determined statically
+    """
+    from jinja2 import nodes
+
+    if isinstance(expr, nodes.Const) and isinstance(expr.value, str):
+        return [expr.value]
+    elif isinstance(expr, nodes.Concat):
+        return [p for n in expr.nodes for p in _parts(n)]
+    elif isinstance(expr, nodes.Add):
+        return _parts(expr.left) + _parts(expr.right)
+    else:
+        return [None]
+
+
+class DependencyGraph:
+    """
+    A graph of the references between the templates in a source directory.
+    Each template is parsed the first time that its references are needed;
+    call `forget()` when a template changes in order to have it parsed again.
+    `refs()` (and thus `dependencies()`) may be called from multiple threads
+    at once.
+    """
+
+    def __init__(
+        self,
+        jinja_env: Environment,
+        templates: Iterable[str],
+        verbatim: Callable[[str], bool] | None = None,
+    ) -> None:
+        self.jinja_env = jinja_env
+        #: All templates in the source directory
+        self.templates = list(templates)
+        #: Tests whether a template is copied verbatim, in which case it is
+        #: not parsed and is taken to refer to nothing
+        self.verbatim = verbatim
+        self._refs: dict[str, TemplateRefs] = {}
+        # Mapping from templates to the templates that reference them by
+        # name:
+        self._rdeps: defaultdict[str, set[str]] = defaultdict(set)
+        # Templates with non-exact references:
+        self._inexact: set[str] = set()
+        self._lock = threading.Lock()
+
+    def refs(self, template: str) -> TemplateRefs:
+        """Return the references made directly by `template`"""
+        try:
+            return self._refs[template]
+        except KeyError:
+            pass
+        refs = self._parse(template)
+        with self._lock:
+            if (known := self._refs.get(template)) is not None:
+                # Parsed by another thread in the meantime
+                return known
+            self._refs[template] = refs
+            for name in refs.names:
+                self._rdeps[name].add(template)
+            if not refs.exact:
+                self._inexact.add(template)
+        return refs
+
+    def _parse(self, template: str) -> TemplateRefs:
+        from jinja2 import TemplateNotFound
+
+        if self.verbatim is not None and self.verbatim(template):
+            return TemplateRefs()
+        env = self.jinja_env
+        assert env.loader is not None
+        try:
+            source, _, _ = env.loader.get_source(env, template)
+        except (TemplateNotFound, UnicodeDecodeError):
+            # Undecodable files fail to render before they can refer to
+            # anything
+            return TemplateRefs()
+        try:
+            ast = env.parse(source, name=template)
+        except Exception:
+            # We can't tell what a broken template refers to
+            return TemplateRefs(dynamic=True)
+        return find_references(ast)
+
+    def build(self) -> None:
+        """Parse every template that hasn't been parsed yet"""
+        for t in self.templates:
+            self.refs(t)
+
+    def forget(self, template: str) -> None:
+        """Discard the recorded references of `template`"""
+        with self._lock:
+            refs = self._refs.pop(template, None)
+            if refs is not None:
+                for name in refs.names:
+                    self._rdeps[name].discard(template)
+                self._inexact.discard(template)
+
+    def set_templates(self, templates: Iterable[str]) -> None:
+        """Update the list of templates in the source directory"""
+        self.templates = list(templates)
+        for t in set(self._refs) - set(self.templates):
+            self.forget(t)
+
+    def dependencies(self, template: str) -> set[str]:
+        """
+        Return the templates that `template` references, directly or
+        indirectly.  References that aren't by name are matched against the
+        templates in the source directory.
+        """
+        deps: set[str] = set()
+        queue = [template]
+        while queue:
+            refs = self.refs(queue.pop())
+            found = set(refs.names)
+            if not refs.exact:
+                found.update(t for t in self.templates if refs.matches(t))
+            queue.extend(found - deps)
+            deps |= found
+        deps.discard(template)
+        return deps
+
+    def has_exact_dependencies(self, template: str) -> bool:
+        """
+        Test whether all of the templates that `template` references, directly
+        or indirectly, are referenced by name
+        """
+        return self.refs(template).exact and all(
+            self.refs(t).exact for t in self.dependencies(template)
+        )
+
+    def is_pure(self, template: str) -> bool:
+        """
+        Test whether neither `template` nor any of the templates it
+        references, directly or indirectly, use any of `IMPURE_GLOBALS`
+        """
+        return not self.refs(template).impure and not any(
+            self.refs(t).impure for t in self.dependencies(template)
+        )
+
+    def dependents(self, templates: str | Iterable[str]) -> set[str]:
+        """
+        Return the templates in the source directory that reference any of
+        the given templates, directly or indirectly
+        """
+        self.build()
+        if isinstance(templates, str):
+            templates = [templates]
+        targets = set(templates)
+        found: set[str] = set()
+        queue = list(targets)
+        while queue:
+            name = queue.pop()
+            users = set(self._rdeps.get(name, ()))
+            users.update(t for t in self._inexact if self._refs[t].matches(name))
+            queue.extend(users - found)
+            found |= users
+        return found - targets
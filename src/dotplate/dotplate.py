@@ -1,202 +1,1388 @@
 from __future__ import annotations
-from bisect import bisect_left
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import AsyncGenerator, Callable, Iterable, Iterator
 from dataclasses import dataclass, field
-from difflib import unified_diff
 from enum import Enum
-from operator import itemgetter
+from hashlib import sha256
+from io import BytesIO
+import json
+import os
 from pathlib import Path
-from typing import Any
-from jinja2 import Environment
-from .config import Config
-from .errors import InactiveTemplate, TemplateNotFound
+import shutil
+import stat
+import tempfile
+from typing import TYPE_CHECKING, Any, BinaryIO, Literal, NoReturn
+from . import __version__
+from .config import Config, LocalConfig
+from .deps import DependencyGraph
+from .errors import (
+    InactiveTemplate,
+    RenderError,
+    RevisionNotFound,
+    TemplateNotFound,
+)
+from .git import RevisionFiles
+from .install import Durability, Installer
+from .state import StateEntry, StateManifest, file_sha256
+from .timing import NULL_PROFILER, NullProfiler, Profiler
 from .util import (
-    SuiteSet,
+    FrozenDict,
+    TemplateTable,
     backup,
+    copy_fd,
+    default_file_mode,
+    freeze,
+    find_files,
+    git_files,
+    glob_matcher,
     is_executable,
-    listdir,
+    is_normal_relpath,
     set_executable_bit,
+    streams_equal,
     unset_executable_bit,
+    walkdir,
 )
 
+if TYPE_CHECKING:
+    from jinja2 import Environment
+    from .archive import ArchiveFormat
+
+#: Which of `Diff.delta` and `Diff.stat` to compute while diffing, so that the
+#: work happens wherever the diffing does (e.g., in a worker process)
+DiffDetail = Literal["delta", "stat"]
+
 
 @dataclass
 class Dotplate:
     cfg: Config
     vars: dict[str, Any]
     suites: set[str]
-    jinja_env: Environment
     dest: Path
-    # Templates are in sorted order:
-    _templates: list[tuple[str, SuiteSet]] | None = field(init=False, default=None)
+    #: If set, templates are listed & loaded from this Git commit instead of
+    #: from the working tree
+    revision: RevisionFiles | None = None
+    #: Records how long each phase of processing takes; see `Profiler`
+    profiler: Profiler | NullProfiler = field(
+        default=NULL_PROFILER, repr=False, compare=False
+    )
+    _templates: TemplateTable | None = field(init=False, default=None)
+    # Templates looked up by `discover_named()` (along with the names that
+    # were requested) when not all templates have been discovered:
+    _named: tuple[frozenset[str], TemplateTable] | None = field(
+        init=False, default=None, repr=False
+    )
+    # The table & suites that the bitmask of enabled suites was last computed
+    # for, along with the mask.  These are replaced as a single tuple so that
+    # threads calling `_suite_mask()` at the same time never see a mask paired
+    # with the wrong table.
+    _mask: tuple[TemplateTable, frozenset[str], int] | None = field(
+        init=False, default=None, repr=False
+    )
+    _state: StateManifest | None = field(init=False, default=None)
+    # Blob IDs of the templates, if the source directory is tracked by Git:
+    _oids: dict[str, str] | None = field(init=False, default=None)
+    # The run-wide part of the template context, along with the values it was
+    # built from:
+    _context: FrozenDict | None = field(init=False, default=None, repr=False)
+    _context_cfg: Config | None = field(init=False, default=None, repr=False)
+    _context_suites: frozenset[str] = field(
+        init=False, default=frozenset(), repr=False
+    )
+    # Created on first use so that commands that don't render anything don't
+    # need to import Jinja:
+    _jinja_env: Environment | None = field(init=False, default=None, repr=False)
+    _deps: DependencyGraph | None = field(init=False, default=None, repr=False)
+    # The `core.verbatim` patterns along with a matcher compiled from them:
+    _verbatim: tuple[list[str], Callable[[str], bool]] | None = field(
+        init=False, default=None, repr=False
+    )
 
     @classmethod
     def from_config_file(cls, cfgfile: str | Path) -> Dotplate:
-        cfg = Config.from_file(cfgfile)
-        cfg.load_local_config()
-        return cls.from_config(cfg)
+        return cls.from_config(Config.load(cfgfile))
 
     @classmethod
-    def from_config(cls, cfg: Config) -> Dotplate:
+    def from_config(cls, cfg: Config, rev: str | None = None) -> Dotplate:
+        """
+        Construct a `Dotplate` instance from a `Config`.  If `rev` is given,
+        templates are read from that revision of the Git repository containing
+        the source directory instead of from the working tree.
+
+        :raises RevisionNotFound: if `rev` does not exist
+        """
         uservars = cfg.vars.copy()
         suites = cfg.default_suites()
-        jinja_env = cfg.make_jinja_env()
+        if rev is not None:
+            revision = RevisionFiles.load(cfg.core.src, rev)
+            if revision is None:
+                raise RevisionNotFound(rev)
+        else:
+            revision = None
         return cls(
             cfg=cfg,
             vars=uservars,
             suites=suites,
-            jinja_env=jinja_env,
             dest=cfg.core.dest,
+            revision=revision,
+        )
+
+    def with_local_config(self, local: LocalConfig) -> Dotplate:
+        """
+        Return a new `Dotplate` instance for the same source directory with
+        `local` merged into a copy of the config.  The new instance shares
+        this instance's discovered templates, Jinja environment (and thus
+        compiled templates), and Git revision, if any.
+        """
+        cfg = self.cfg.model_copy(deep=True)
+        cfg.merge_local_config(local)
+        dp = Dotplate(
+            cfg=cfg,
+            vars=cfg.vars.copy(),
+            suites=cfg.default_suites(),
+            dest=cfg.core.dest,
+            revision=self.revision,
+            profiler=self.profiler,
         )
+        dp._templates = self._ensure_templates()
+        dp._oids = self._oids
+        dp._jinja_env = self.jinja_env
+        return dp
+
+    @property
+    def jinja_env(self) -> Environment:
+        """
+        The Jinja environment used to render templates.  Unless set
+        explicitly, it is created from the config the first time it's needed.
+        """
+        if self._jinja_env is None:
+            self._jinja_env = _make_jinja_env(self.cfg, self.revision)
+        return self._jinja_env
+
+    @jinja_env.setter
+    def jinja_env(self, env: Environment) -> None:
+        self._jinja_env = env
+        self._deps = None
+
+    @property
+    def dependency_graph(self) -> DependencyGraph:
+        """
+        The graph of which templates include, import, or extend which other
+        templates.  Templates are only parsed as needed.
+        """
+        self._ensure_templates()
+        return self._known_graph()
+
+    def _known_graph(self) -> DependencyGraph:
+        # Only references that aren't by name are matched against the list of
+        # templates, so the graph can be used to look up references by name
+        # before every template has been discovered.  Discovering everything
+        # updates the existing graph.
+        if self._deps is None:
+            if self._templates is None and self._named is not None:
+                templates = self._named[1]
+            else:
+                templates = self._ensure_templates()
+            self._deps = DependencyGraph(
+                self.jinja_env, templates, verbatim=self.is_verbatim
+            )
+        return self._deps
 
     @property
     def src(self) -> Path:
         return self.cfg.core.src
 
-    def _ensure_templates(self) -> list[tuple[str, SuiteSet]]:
+    @property
+    def state(self) -> StateManifest | None:
+        """
+        The manifest of previously-installed templates, or `None` if
+        ``core.state-file`` is not set in the config or if templates are being
+        read from a Git revision
+        """
+        if self.revision is not None:
+            return None
+        if self._state is None and self.cfg.core.state_file is not None:
+            self._state = StateManifest.load(self.cfg.core.state_file)
+        return self._state
+
+    def _ensure_templates(self) -> TemplateTable:
         if self._templates is None:
-            suitemap = self.cfg.paths2suites()
-            templates = listdir(self.src)
-            # listdir() should return the paths in sorted order, but just to be
-            # sure…
-            templates.sort()
-            if self.cfg._exclude_config_path is not None:
-                try:
-                    templates.remove(self.cfg._exclude_config_path)
-                except ValueError:
-                    pass
-            self._templates = [(path, suitemap[path]) for path in templates]
+            with self.profiler.phase("discovery"):
+                self._templates = self._discover_templates()
+            if self._deps is not None:
+                self._deps.set_templates(self._templates)
         return self._templates
 
+    def _discover_templates(self, names: list[str] | None = None) -> TemplateTable:
+        # If `names` is given, only those templates are looked up.
+        if self.revision is not None:
+            files = self.revision.files
+            self._oids = {
+                path: oid
+                for path, (_, oid) in (
+                    files.items()
+                    if names is None
+                    else ((p, files[p]) for p in names if p in files)
+                )
+            }
+        else:
+            self._oids = git_files(
+                self.src, include_staged=self.cfg.core.include_staged, paths=names
+            )
+        if self._oids is not None:
+            templates = sorted(self._oids)
+        elif names is not None:
+            templates = find_files(self.src, names)
+        else:
+            templates = walkdir(self.src)
+        if self.cfg._exclude_config_path is not None:
+            try:
+                templates.remove(self.cfg._exclude_config_path)
+            except ValueError:
+                pass
+        return TemplateTable(templates, self.cfg.paths2suites())
+
+    def rediscover(self) -> None:
+        """
+        Forget the templates found in the source directory so that they are
+        discovered again on next use, e.g., after files are added or removed
+        """
+        self._templates = None
+        self._named = None
+        self._oids = None
+
+    def discover_named(self, templates: list[str]) -> None:
+        """
+        Look up just the given templates in the source directory (or Git
+        revision) so that working with only them doesn't require discovering
+        every template.  Git-tracked source directories are still limited to
+        tracked files.  Anything that needs the full list of templates, or
+        that refers to a template not looked up here, still causes every
+        template to be discovered.  Does nothing if every template has
+        already been discovered.
+        """
+        if self._templates is not None:
+            return
+        requested = frozenset(templates)
+        if self._named is not None:
+            requested |= self._named[0]
+        # Names that aren't in normalized form can't be templates:
+        names = sorted(t for t in requested if is_normal_relpath(t))
+        with self.profiler.phase("discovery"):
+            table = self._discover_templates(names)
+        self._named = (requested, table)
+        if self._deps is not None:
+            self._deps.set_templates(table)
+
+    def dependents(self, template: str) -> list[str]:
+        """
+        Return the templates (active or not) that include, import, or extend
+        `template`, directly or indirectly, in sorted order.  Templates whose
+        references can't be determined statically are assumed to depend on
+        every template that they could refer to.
+        """
+        return sorted(self.dependency_graph.dependents(template))
+
+    def dependencies(self, template: str) -> list[str]:
+        """
+        Return the templates that `template` includes, imports, or extends,
+        directly or indirectly, in sorted order
+        """
+        return sorted(self.dependency_graph.dependencies(template))
+
     def templates(self) -> list[str]:
-        templates = self._ensure_templates()
-        return [
-            path
-            for (path, suiteset) in templates
-            if suiteset.is_file_active(self.suites)
-        ]
+        table = self._ensure_templates()
+        return table.active(self._suite_mask(table))
+
+    def _table_for(self, templates: Iterable[str]) -> TemplateTable:
+        """
+        Return a table with the entries for the given templates, using the
+        table from `discover_named()` if it covers all of them
+        """
+        if (
+            self._templates is None
+            and self._named is not None
+            and self._named[0].issuperset(templates)
+        ):
+            return self._named[1]
+        return self._ensure_templates()
 
     def is_active(self, template: str) -> bool:
-        templates = self._ensure_templates()
-        if not templates:
-            raise TemplateNotFound(template)
-        i = bisect_left(templates, template, key=itemgetter(0))
-        (sp, suiteset) = templates[i]
-        if sp != template:
+        table = self._table_for([template])
+        try:
+            return table.is_active(template, self._suite_mask(table))
+        except KeyError:
             raise TemplateNotFound(template)
-        return suiteset.is_file_active(self.suites)
+
+    def _suite_mask(self, table: TemplateTable) -> int:
+        # Recompute the mask only if `suites` has been changed since it was
+        # last computed:
+        mask = self._mask
+        if mask is None or mask[0] is not table or mask[1] != self.suites:
+            suites = frozenset(self.suites)
+            mask = (table, suites, table.suite_mask(suites))
+            self._mask = mask
+        return mask[2]
+
+    def template_oid(self, template: str) -> str | None:
+        """
+        If the source directory is tracked by Git, return the ID of the Git
+        blob for the given template (as committed to :samp:`HEAD` or, if
+        ``core.include-staged`` is set, as staged), which can be used as a
+        cheap fingerprint of the template's contents.  Otherwise, return
+        `None`.
+
+        Note that the blob ID does not reflect uncommitted (or unstaged)
+        modifications in the working tree.
+        """
+        self.is_active(template)  # Raises TemplateNotFound if appropriate
+        if self._oids is None:
+            return None
+        return self._oids[template]
+
+    def is_verbatim(self, template: str) -> bool:
+        """
+        Test whether the given template matches one of the ``core.verbatim``
+        patterns and is thus copied as-is instead of being rendered
+        """
+        patterns = self.cfg.core.verbatim
+        if self._verbatim is None or self._verbatim[0] != patterns:
+            self._verbatim = (list(patterns), glob_matcher(patterns))
+        return self._verbatim[1](template)
+
+    def is_source_executable(self, template: str) -> bool:
+        """Test whether the source file for the given template is executable"""
+        if self.revision is not None:
+            return self.revision.is_executable(template)
+        else:
+            return is_executable(self.src / template)
 
     def render(self, template: str, dest_path: Path | None = None) -> RenderedFile:
         if not self.is_active(template):
             raise InactiveTemplate(template)
-        tmplobj = self.jinja_env.get_template(template)
+        with self.profiler.phase("compile", template):
+            tmplobj = self.jinja_env.get_template(template)
         if dest_path is None:
             dest_path = self.dest / template
-        return RenderedFile(
-            content=tmplobj.render(
+        with self.profiler.phase("render", template):
+            content = tmplobj.render(
                 self.get_context(template=template, dest_path=dest_path)
             )
-            + "\n",
+        return RenderedFile(
+            content=content + "\n",
             template=template,
-            executable=is_executable(self.src / template),
+            executable=self.is_source_executable(template),
             dest_path=dest_path,
             backup_ext=self.cfg.core.backup_ext,
         )
 
+    def generate(self, template: str, dest_path: Path | None = None) -> Iterator[str]:
+        """
+        Render the given template piece by piece, yielding the rendered text
+        in chunks rather than building it all in memory at once
+        """
+        if not self.is_active(template):
+            raise InactiveTemplate(template)
+        with self.profiler.phase("compile", template):
+            tmplobj = self.jinja_env.get_template(template)
+        if dest_path is None:
+            dest_path = self.dest / template
+        yield from tmplobj.generate(
+            self.get_context(template=template, dest_path=dest_path)
+        )
+        yield "\n"
+
+    def render_stream(
+        self, template: str, dest_path: Path | None = None
+    ) -> StreamedFile:
+        """
+        Render the given template to a temporary file next to the destination
+        path (or in the system temporary directory if the destination's
+        parent directory does not exist), so that memory usage stays bounded
+        regardless of the size of the output
+        """
+        if dest_path is None:
+            dest_path = self.dest / template
+        if not self.is_active(template):
+            raise InactiveTemplate(template)
+        # Compile up front so that compilation isn't counted as rendering time
+        with self.profiler.phase("compile", template):
+            self.jinja_env.get_template(template)
+        chunks = self.generate(template, dest_path)
+        tmpdir = dest_path.parent if dest_path.parent.is_dir() else None
+        fd, tmppath = tempfile.mkstemp(
+            dir=tmpdir, prefix=f".{dest_path.name}.", suffix=".dotplate.tmp"
+        )
+        h = sha256()
+        try:
+            with os.fdopen(fd, "wb") as fp, self.profiler.phase("render", template):
+                for chunk in chunks:
+                    if os.linesep != "\n":
+                        chunk = chunk.replace("\n", os.linesep)
+                    data = chunk.encode("utf-8")
+                    h.update(data)
+                    fp.write(data)
+            # mkstemp() creates files readable only by the current user, but
+            # the installed file should get the same permissions as a file
+            # created normally:
+            os.chmod(tmppath, default_file_mode())
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+        return StreamedFile(
+            path=Path(tmppath),
+            template=template,
+            executable=self.is_source_executable(template),
+            dest_path=dest_path,
+            backup_ext=self.cfg.core.backup_ext,
+            digest=h.hexdigest(),
+        )
+
+    def copy(self, template: str, dest_path: Path | None = None) -> VerbatimFile:
+        """
+        Return the given template's source file as-is, without rendering it,
+        for installation at `dest_path`
+        """
+        if not self.is_active(template):
+            raise InactiveTemplate(template)
+        if dest_path is None:
+            dest_path = self.dest / template
+        source: Path | bytes
+        if self.revision is not None:
+            data = self.revision.read(template)
+            assert data is not None
+            source = data
+        else:
+            source = self.src / template
+        return VerbatimFile(
+            source=source,
+            template=template,
+            executable=self.is_source_executable(template),
+            dest_path=dest_path,
+            backup_ext=self.cfg.core.backup_ext,
+        )
+
+    def render_file(
+        self, template: str, dest_path: Path | None = None, stream: bool = False
+    ) -> BaseRenderedFile:
+        """
+        Produce the file to install for the given template: a `VerbatimFile`
+        if the template is verbatim (see `is_verbatim()`), otherwise the
+        result of `render_stream()` if `stream` is true or of `render()` if
+        not
+        """
+        if self.is_verbatim(template):
+            return self.copy(template, dest_path)
+        elif stream:
+            return self.render_stream(template, dest_path)
+        else:
+            return self.render(template, dest_path)
+
     def install_path(self, template: str, dest_path: Path | None = None) -> None:
-        self.render(template, dest_path).install()
+        self.render_file(template, dest_path).install()
+
+    def render_archive(
+        self, fp: BinaryIO, fmt: ArchiveFormat, templates: list[str] | None = None
+    ) -> list[RenderError]:
+        """
+        Render each of the given templates (default: all active templates)
+        and write the results to `fp` as a tar or zip archive, with each file
+        stored under its template name and made executable if its source is.
+        The archive is written in a single sequential pass, so `fp` need not
+        be seekable.  Nothing is written to the destination directory.
+
+        Templates that fail to render are left out of the archive, and a
+        `RenderError` is returned for each one.
+        """
+        from .archive import open_archive
 
-    def install(self, templates: list[str] | None = None) -> None:
         if templates is None:
             templates = self.templates()
-        files = [self.render(p) for p in templates]
-        for f in files:
-            f.install()
+        errors: list[RenderError] = []
+        with open_archive(fp, fmt) as writer:
+            for t in templates:
+                f = _try_render(self, t)
+                if isinstance(f, RenderError):
+                    errors.append(f)
+                else:
+                    writer.add_file(f, t)
+        return errors
+
+    def render_many(
+        self,
+        templates: list[str] | None = None,
+        jobs: int = 1,
+        skip_unchanged: bool = False,
+        stream: bool = False,
+        detail: DiffDetail | None = None,
+    ) -> Iterator[BaseRenderedFile | RenderError]:
+        """
+        Render & diff each of the given templates (default: all active
+        templates), yielding a `RenderedFile` (with its diff already computed)
+        or a `RenderError` for each one in the same order as the input.  If
+        `stream` is true, `StreamedFile` instances created with
+        `render_stream()` are yielded instead of `RenderedFile` instances.
+        Verbatim templates are yielded as `VerbatimFile` instances.  If
+        `detail` is given, the `Diff.delta` or `Diff.stat` of each changed
+        file is computed along with the diff.
+
+        If `skip_unchanged` is true, templates that the state manifest shows
+        to be unchanged since they were last installed (see `is_unchanged()`)
+        are skipped without being rendered.
+
+        If `jobs` is greater than 1, the templates are rendered & diffed on a
+        pool of that many worker processes.  Each worker builds its own Jinja
+        environment from `cfg`, so any customizations made directly to
+        `jinja_env` are not seen by the workers.
+        """
+        if templates is None:
+            templates = self.templates()
+        if skip_unchanged and self.state is not None:
+            with self.profiler.phase("state"):
+                fingerprint = self.context_fingerprint()
+                templates = [
+                    t
+                    for t in templates
+                    if not self._is_unchanged(t, self.dest / t, fingerprint)
+                ]
+        if jobs <= 1 or len(templates) <= 1:
+            for t in templates:
+                yield _render_and_diff(self, t, stream, detail)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Large chunks cut down on IPC overhead, but chunks that are too large
+        # leave workers idle at the end of the run:
+        chunksize = max(1, len(templates) // (jobs * 4))
+        pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(
+                self.cfg,
+                self.vars,
+                self.suites,
+                self.dest,
+                self._table_for(templates),
+                stream,
+                detail,
+                self.revision,
+                self.profiler.enabled,
+            ),
+        )
+        futures = deque(
+            pool.submit(_render_in_worker, templates[i : i + chunksize])
+            for i in range(0, len(templates), chunksize)
+        )
+        current: deque[BaseRenderedFile | RenderError] = deque()
+        try:
+            while futures:
+                (results, timings) = futures.popleft().result()
+                if timings is not None:
+                    self.profiler.merge(timings)
+                current.extend(results)
+                while current:
+                    yield current.popleft()
+        finally:
+            pool.shutdown(cancel_futures=True)
+            # If the caller stopped early, clean up any temporary files
+            # belonging to results that were never yielded:
+            leftovers = list(current)
+            for fut in futures:
+                if not fut.cancelled() and fut.exception() is None:
+                    leftovers.extend(fut.result()[0])
+            for f in leftovers:
+                if isinstance(f, BaseRenderedFile):
+                    f.discard()
+
+    def install(
+        self,
+        templates: list[str] | None = None,
+        jobs: int = 1,
+        full: bool = False,
+        stream: bool = False,
+        durability: Durability | None = None,
+        transactional: bool | None = None,
+    ) -> None:
+        """
+        Render & install the given templates (default: all active templates).
+        If any template fails to render, nothing is installed, and the
+        exception raised by the rendering is propagated.  (When `jobs` is
+        greater than 1, the exception is raised in a worker process and is
+        instead reported as a `RenderError`.)
+
+        `durability` and `transactional` default to the ``core.durability``
+        and ``core.transactional`` config settings; see `Installer`.
+        """
+        files: list[BaseRenderedFile] = []
+        try:
+            for f in self.render_many(
+                templates, jobs=jobs, skip_unchanged=not full, stream=stream
+            ):
+                if isinstance(f, RenderError):
+                    _raise_render_error(f)
+                files.append(f)
+            with self.installer(durability, transactional) as installer:
+                for f in files:
+                    with self.profiler.phase("install", f.template):
+                        installer.install(f)
+                    if not f.diff():
+                        self.record_state(f)
+        finally:
+            for f in files:
+                f.discard()
+            self.save_state()
+
+    def arender_many(
+        self,
+        templates: list[str] | None = None,
+        concurrency: int = 16,
+        skip_unchanged: bool = False,
+        stream: bool = False,
+        detail: DiffDetail | None = None,
+    ) -> AsyncGenerator[BaseRenderedFile | RenderError, None]:
+        """
+        Like `render_many()`, but returns an async generator, and the templates
+        are rendered & diffed on a pool of `concurrency` threads sharing this
+        instance's Jinja environment.  This is useful when the destination is
+        on a filesystem with high latency, such as NFS.
+        """
+        from .aio import render_many
+
+        return render_many(
+            self,
+            templates,
+            concurrency=concurrency,
+            skip_unchanged=skip_unchanged,
+            stream=stream,
+            detail=detail,
+        )
+
+    async def ainstall(
+        self,
+        templates: list[str] | None = None,
+        concurrency: int = 16,
+        full: bool = False,
+        stream: bool = False,
+        durability: Durability | None = None,
+        transactional: bool | None = None,
+    ) -> None:
+        """
+        Like `install()`, but with the rendering, diffing, and installing of
+        up to `concurrency` files carried out at once on a pool of threads
+        """
+        from .aio import install
+
+        await install(
+            self,
+            templates,
+            concurrency=concurrency,
+            full=full,
+            stream=stream,
+            durability=durability,
+            transactional=transactional,
+        )
+
+    def installer(
+        self,
+        durability: Durability | None = None,
+        transactional: bool | None = None,
+        on_install: Callable[[BaseRenderedFile], None] | None = None,
+    ) -> Installer:
+        """
+        Return an `Installer` configured from the config file, with any
+        non-`None` arguments taking precedence.  Files are recorded in the
+        state manifest once they are installed.
+        """
+
+        def installed(f: BaseRenderedFile) -> None:
+            self.record_state(f)
+            if on_install is not None:
+                on_install(f)
+
+        return Installer(
+            durability=(
+                durability if durability is not None else self.cfg.core.durability
+            ),
+            transactional=(
+                transactional
+                if transactional is not None
+                else self.cfg.core.transactional
+            ),
+            on_install=installed,
+        )
+
+    def context_fingerprint(self) -> str:
+        """
+        Return a fingerprint of everything outside of the templates themselves
+        that can affect how templates are rendered
+        """
+        data = {
+            "version": __version__,
+            "vars": self.vars,
+            "suites": sorted(self.suites),
+            "suite_files": {
+                name: suicfg.files for name, suicfg in self.cfg.suites.items()
+            },
+            "jinja": self.cfg.jinja.model_dump(
+                mode="json", exclude={"bytecode_cache", "cache_size", "auto_reload"}
+            ),
+            "verbatim": self.cfg.core.verbatim,
+        }
+        blob = json.dumps(data, sort_keys=True, default=str)
+        return sha256(blob.encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, template: str, dest_path: Path | None = None) -> bool:
+        """
+        Test whether the state manifest shows that `template` was installed at
+        `dest_path` by a previous run and that neither the template, the
+        templates it references, the rendering context, nor the installed file
+        have changed since then.  Always returns `False` if there is no state
+        manifest.
+        """
+        if dest_path is None:
+            dest_path = self.dest / template
+        return self._is_unchanged(template, dest_path, self.context_fingerprint())
+
+    def _is_unchanged(self, template: str, dest_path: Path, fingerprint: str) -> bool:
+        if self.state is None or (entry := self.state.get(dest_path)) is None:
+            return False
+        if entry.template != template or entry.context != fingerprint:
+            return False
+        try:
+            if not self.is_active(template):
+                return False
+            if self.is_source_executable(template) != entry.executable:
+                return False
+            st = dest_path.stat()
+        except (FileNotFoundError, TemplateNotFound):
+            return False
+        if (st.st_mode & stat.S_IXUSR != 0) != entry.executable:
+            return False
+        if st.st_size != entry.size:
+            return False
+        if st.st_mtime_ns != entry.mtime_ns:
+            if file_sha256(dest_path) != entry.sha256:
+                return False
+            # The file was rewritten with the same contents; remember the new
+            # mtime so that the next run doesn't need to hash it again.
+            entry.mtime_ns = st.st_mtime_ns
+            self.state.dirty = True
+        return all(
+            file_sha256(self.src / name) == digest
+            for name, digest in entry.sources.items()
+        )
+
+    def record_state(self, file: BaseRenderedFile) -> None:
+        """
+        Record in the state manifest (if any) that `file` is installed at its
+        destination path.  This must only be called when the destination file
+        matches the rendered file, i.e., right after installing it or after
+        finding that it has no diff.
+        """
+        if self.state is None:
+            return
+        sources = self._template_sources(file.template)
+        if sources is None:
+            self.state.discard(file.dest_path)
+            return
+        st = file.dest_path.stat()
+        digest = file.sha256()
+        self.state.set(
+            file.dest_path,
+            StateEntry(
+                template=file.template,
+                context=self.context_fingerprint(),
+                sources=sources,
+                executable=file.executable,
+                size=st.st_size,
+                mtime_ns=st.st_mtime_ns,
+                sha256=digest,
+            ),
+        )
+
+    def reload_state(self) -> None:
+        """
+        Discard the in-memory state manifest so that it is read from disk
+        again on next use
+        """
+        self._state = None
+
+    def refresh_executables(self) -> None:
+        """
+        Make ``which()`` notice executables that have been installed or
+        removed since it was last called.  Long-running processes should call
+        this before rendering in response to a new request.
+        """
+        if self._jinja_env is not None:
+            from .jinja_ext import DotplateExt
+
+            ext = self._jinja_env.extensions.get(DotplateExt.identifier)
+            if isinstance(ext, DotplateExt):
+                ext.refresh_index()
+
+    def forget_compiled(self, templates: Iterable[str]) -> None:
+        """
+        Drop the compiled forms of the given templates from the Jinja
+        environment's cache so that they are compiled again from their
+        current sources on next use.  Long-running processes should call this
+        for templates whose sources have changed, as the environment only
+        notices such changes by itself if ``jinja.auto_reload`` is enabled.
+        """
+        if self._jinja_env is None or (cache := self._jinja_env.cache) is None:
+            return
+        names = set(templates)
+        # Cache keys are of the form `(weakref_to_loader, name)`
+        for key in list(cache.keys()):
+            if key[1] in names:
+                try:
+                    del cache[key]
+                except KeyError:
+                    pass
+
+    def save_state(self) -> None:
+        if self._state is not None:
+            self._state.save()
+
+    def _template_sources(self, template: str) -> dict[str, str | None] | None:
+        """
+        Return a mapping from `template` and all templates it transitively
+        references to the SHA256 digests of their sources, or `None` if any of
+        the references cannot be determined by name or if the output depends
+        on the state of the system (e.g., via ``which()``)
+        """
+        graph = self._known_graph()
+        if not graph.has_exact_dependencies(template) or not graph.is_pure(template):
+            return None
+        return {
+            name: file_sha256(self.src / name)
+            for name in [template, *graph.dependencies(template)]
+        }
 
     def get_context(self, template: str, dest_path: Path) -> dict[str, Any]:
+        """
+        Return the context for rendering the given template.  The parts of
+        the context that are the same for every template are built once and
+        shared between templates; they are read-only, so that templates
+        cannot affect each other.
+        """
         # Returns a fresh dict on each invocation
         return {
-            "dotplate": {
-                "suites": {
-                    name: {
-                        "files": suicfg.files,
-                        "enabled": name in self.suites,
-                    }
-                    for name, suicfg in self.cfg.suites.items()
-                },
-                "template": template,
-                "dest_path": str(dest_path),
-                "vars": self.vars.copy(),
-            }
+            "dotplate": FrozenDict(
+                self._shared_context(), template=template, dest_path=str(dest_path)
+            )
         }
 
+    def _shared_context(self) -> FrozenDict:
+        # Rebuild the shared context if `vars` or `suites` have been changed
+        # since it was last built.  (Comparing doesn't allocate anything,
+        # unlike rebuilding.)
+        if (
+            self._context is None
+            or self._context_cfg is not self.cfg
+            or self._context["vars"] != self.vars
+            or self._context_suites != self.suites
+        ):
+            self._context = freeze(
+                {
+                    "suites": {
+                        name: {
+                            "files": suicfg.files,
+                            "enabled": name in self.suites,
+                        }
+                        for name, suicfg in self.cfg.suites.items()
+                    },
+                    "vars": self.vars,
+                }
+            )
+            self._context_cfg = self.cfg
+            self._context_suites = frozenset(self.suites)
+        return self._context
+
+
+def _make_jinja_env(cfg: Config, revision: RevisionFiles | None) -> Environment:
+    if revision is not None:
+        from .loader import GitRevisionLoader
+
+        return cfg.make_jinja_env(loader=GitRevisionLoader(revision))
+    else:
+        return cfg.make_jinja_env()
+
+
+_worker_dotplate: Dotplate | None = None
+_worker_stream = False
+_worker_detail: DiffDetail | None = None
+
+
+def _init_worker(
+    cfg: Config,
+    uservars: dict[str, Any],
+    suites: set[str],
+    dest: Path,
+    templates: TemplateTable,
+    stream: bool,
+    detail: DiffDetail | None,
+    revision: RevisionFiles | None,
+    profile: bool,
+) -> None:
+    global _worker_dotplate, _worker_stream, _worker_detail
+    _worker_stream = stream
+    _worker_detail = detail
+    _worker_dotplate = Dotplate(
+        cfg=cfg,
+        vars=uservars,
+        suites=suites,
+        dest=dest,
+        revision=revision,
+        profiler=Profiler() if profile else NULL_PROFILER,
+    )
+    _worker_dotplate._templates = templates
+
+
+def _render_in_worker(
+    templates: list[str],
+) -> tuple[list[BaseRenderedFile | RenderError], dict[str, Any] | None]:
+    """
+    Render & diff a chunk of templates in a worker process, returning the
+    results along with the worker's timings for the chunk (if profiling)
+    """
+    assert _worker_dotplate is not None
+    results = [
+        _render_and_diff(_worker_dotplate, t, _worker_stream, _worker_detail)
+        for t in templates
+    ]
+    profiler = _worker_dotplate.profiler
+    timings = profiler.take() if isinstance(profiler, Profiler) else None
+    return (results, timings)
+
+
+def _try_render(dotplate: Dotplate, template: str) -> BaseRenderedFile | RenderError:
+    try:
+        return dotplate.render_file(template)
+    except Exception as e:
+        err = RenderError(template=template, message=f"{type(e).__name__}: {e}")
+        err.__cause__ = e
+        return err
+
+
+def _raise_render_error(err: RenderError) -> NoReturn:
+    """
+    Raise the exception that caused `err`, or `err` itself if the cause is not
+    available (because the rendering happened in a worker process)
+    """
+    if err.__cause__ is not None:
+        raise err.__cause__
+    raise err
+
+
+def _render_and_diff(
+    dotplate: Dotplate,
+    template: str,
+    stream: bool = False,
+    detail: DiffDetail | None = None,
+) -> BaseRenderedFile | RenderError:
+    f: BaseRenderedFile | None = None
+    try:
+        f = dotplate.render_file(template, stream=stream)
+        with dotplate.profiler.phase("diff", template):
+            d = f.diff()
+            if d.state:
+                match detail:
+                    case "delta":
+                        d.delta
+                    case "stat":
+                        d.stat
+    except Exception as e:
+        if f is not None:
+            f.discard()
+        err = RenderError(template=template, message=f"{type(e).__name__}: {e}")
+        err.__cause__ = e
+        return err
+    return f
+
+
+class BaseRenderedFile(ABC):
+    """
+    Base class for the output of rendering a template, independent of where
+    the output is stored
+    """
 
-@dataclass
-class RenderedFile:
-    content: str
     template: str
     dest_path: Path
     backup_ext: str
-    executable: bool = False
-    _diff: Diff | None = field(init=False, default=None)
+    executable: bool
+    _diff: Diff | None
+
+    @abstractmethod
+    def size(self) -> int:
+        """Return the size in bytes of the file as it will be installed"""
+        ...
+
+    @abstractmethod
+    def open(self) -> BinaryIO:
+        """Open the bytes of the file as it will be installed for reading"""
+        ...
+
+    @abstractmethod
+    def read_text(self) -> str:
+        """Return the rendered text"""
+        ...
+
+    @abstractmethod
+    def sha256(self) -> str:
+        """Return the SHA256 digest of the file as it will be installed"""
+        ...
+
+    def discard(self) -> None:  # noqa: B027
+        """Release any temporary resources held by the rendered file"""
+        pass
 
     def diff(self) -> Diff:
         if self._diff is None:
             try:
-                with self.dest_path.open("r", encoding="utf-8") as fp:
-                    dest_content = fp.read()
+                st = self.dest_path.stat()
             except FileNotFoundError:
-                dest_content = ""
                 state = DiffState.MISSING
                 xbit_diff = (
                     XBitDiff.MISSING_SET if self.executable else XBitDiff.MISSING_UNSET
                 )
             else:
                 state = (
-                    DiffState.NODIFF
-                    if dest_content == self.content
-                    else DiffState.CHANGED
+                    DiffState.NODIFF if self._dest_matches(st) else DiffState.CHANGED
                 )
-                match (self.executable, is_executable(self.dest_path)):
+                match (self.executable, st.st_mode & stat.S_IXUSR != 0):
                     case (True, False):
                         xbit_diff = XBitDiff.REMOVED
                     case (False, True):
                         xbit_diff = XBitDiff.ADDED
                     case _:
                         xbit_diff = XBitDiff.NOCHANGE
-            delta = xbit_diff.diff_header() + "".join(
-                unified_diff(
-                    dest_content.splitlines(True),
-                    self.content.splitlines(True),
-                    fromfile=str(self.dest_path),
-                    tofile=self.template,
-                )
-            )
-            self._diff = Diff(delta=delta, state=state, xbit_diff=xbit_diff)
+            self._diff = Diff(state=state, xbit_diff=xbit_diff, file=self)
         return self._diff
 
-    def install(self) -> None:
-        if diff := self.diff():
-            if diff.state:
-                backup(self.dest_path, self.backup_ext)
-                self.dest_path.parent.mkdir(parents=True, exist_ok=True)
-                with self.dest_path.open("w", encoding="utf-8") as fp:
-                    fp.write(self.content)
-            if self.executable:
-                set_executable_bit(self.dest_path)
-            else:
-                unset_executable_bit(self.dest_path)
+    def _dest_matches(self, st: os.stat_result) -> bool:
+        # Compare sizes before reading anything, as most changed files will
+        # differ in size
+        if st.st_size != self.size():
+            return False
+        with self.open() as fp1, self.dest_path.open("rb") as fp2:
+            return streams_equal(fp1, fp2)
+
+    def _make_delta(self) -> str:
+        from .linediff import unified_diff
+
+        diff = self.diff()
+        delta = diff.xbit_diff.diff_header()
+        if not diff.state:
+            return delta
+        try:
+            old_lines = self._dest_lines()
+            new_lines = self._new_lines()
+        except UnicodeDecodeError:
+            return delta + f"Binary files {self.dest_path} and {self.template} differ\n"
+        return delta + "".join(
+            unified_diff(
+                old_lines, new_lines, fromfile=str(self.dest_path), tofile=self.template
+            )
+        )
+
+    def _make_stat(self) -> DiffStat:
+        from .linediff import count_changes
+
+        if not self.diff().state:
+            return DiffStat(added=0, removed=0)
+        try:
+            old_lines = self._dest_lines()
+            new_lines = self._new_lines()
+        except UnicodeDecodeError:
+            # Binary files don't have lines
+            return DiffStat(added=0, removed=0)
+        (added, removed) = count_changes(old_lines, new_lines)
+        return DiffStat(added=added, removed=removed)
+
+    # Both sides of the diff are read without newline translation so that
+    # files differing only in their line endings get a non-empty diff
+
+    def _dest_lines(self) -> list[str]:
+        if self.diff().state is DiffState.MISSING:
+            return []
+        with self.dest_path.open("r", encoding="utf-8", newline="") as fp:
+            return fp.read().splitlines(True)
+
+    def _new_lines(self) -> list[str]:
+        with self.open() as fp:
+            return fp.read().decode("utf-8").splitlines(True)
+
+    def install(self, durability: Durability = "none") -> None:
+        """
+        Atomically install the rendered file at `dest_path` if it differs
+        from what's there now
+        """
+        with Installer(durability=durability) as installer:
+            installer.install(self)
+
+    def stage(self, fsync: bool = False) -> Path:
+        """
+        Write the rendered file to a new temporary file in the destination
+        directory (creating the directory if necessary) and return the path to
+        the temporary file, which should then be passed to `commit()`
+        """
+        self.dest_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(
+            dir=self.dest_path.parent,
+            prefix=f".{self.dest_path.name}.",
+            suffix=".dotplate.tmp",
+        )
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                self.write_to(fp)
+                if fsync:
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            os.chmod(tmppath, self._mode())
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+        return Path(tmppath)
+
+    def write_to(self, fp: BinaryIO) -> None:
+        """Write the bytes of the file as it will be installed to `fp`"""
+        with self.open() as src:
+            shutil.copyfileobj(src, fp)
+
+    def commit(self, staged: Path) -> None:
+        """
+        Back up the current destination file (if any) and move the staged
+        file into its place
+        """
+        backup(self.dest_path, self.backup_ext)
+        os.replace(staged, self.dest_path)
+
+    def fix_executable_bit(self) -> None:
+        if self.executable:
+            set_executable_bit(self.dest_path)
+        else:
+            unset_executable_bit(self.dest_path)
+
+    def _mode(self) -> int:
+        mode = default_file_mode()
+        if self.executable:
+            mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        return mode
 
 
 @dataclass
+class RenderedFile(BaseRenderedFile):
+    """A rendered template held in memory"""
+
+    content: str
+    template: str
+    dest_path: Path
+    backup_ext: str
+    executable: bool = False
+    _diff: Diff | None = field(init=False, default=None)
+
+    def encoded(self) -> bytes:
+        """
+        Return the rendered content as the bytes that are written on
+        installation
+        """
+        content = self.content
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        return content.encode("utf-8")
+
+    def size(self) -> int:
+        return len(self.encoded())
+
+    def open(self) -> BinaryIO:
+        return BytesIO(self.encoded())
+
+    def read_text(self) -> str:
+        return self.content
+
+    def sha256(self) -> str:
+        return sha256(self.encoded()).hexdigest()
+
+    def _dest_matches(self, st: os.stat_result) -> bool:
+        data = self.encoded()
+        if st.st_size != len(data):
+            return False
+        with self.dest_path.open("rb") as fp:
+            return fp.read() == data
+
+
+@dataclass
+class StreamedFile(BaseRenderedFile):
+    """
+    A rendered template that was streamed to a temporary file (located next to
+    the destination path when possible) instead of being held in memory.  On
+    installation, the temporary file is moved into place.
+
+    Call `discard()` once done with an instance in order to delete the
+    temporary file if it was not installed.
+    """
+
+    path: Path
+    template: str
+    dest_path: Path
+    backup_ext: str
+    digest: str
+    executable: bool = False
+    _diff: Diff | None = field(init=False, default=None)
+    _handed_off: bool = field(init=False, default=False)
+
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+    def open(self) -> BinaryIO:
+        return self.path.open("rb")
+
+    def read_text(self) -> str:
+        with self.path.open("r", encoding="utf-8") as fp:
+            return fp.read()
+
+    def sha256(self) -> str:
+        return self.digest
+
+    def stage(self, fsync: bool = False) -> Path:
+        if self.path.parent != self.dest_path.parent:
+            # The temporary file has to be in the same directory as the
+            # destination in order to be renamed into place
+            return super().stage(fsync)
+        if fsync:
+            with self.path.open("rb+") as fp:
+                os.fsync(fp.fileno())
+        os.chmod(self.path, self._mode())
+        # The temporary file now belongs to whoever commits or rolls back the
+        # staging:
+        self._handed_off = True
+        return self.path
+
+    def discard(self) -> None:
+        if not self._handed_off:
+            self.path.unlink(missing_ok=True)
+
+
+@dataclass
+class VerbatimFile(BaseRenderedFile):
+    """
+    A template that is installed byte-for-byte as it appears in the source
+    directory, without going through Jinja.  When the source is a file on
+    disk, it is compared to the destination as bytes and copied into place by
+    the kernel (see `copy_fd()`) without being read into memory.  When
+    templates are read from a Git revision, `source` is the file's contents.
+    """
+
+    source: Path | bytes
+    template: str
+    dest_path: Path
+    backup_ext: str
+    executable: bool = False
+    _diff: Diff | None = field(init=False, default=None)
+
+    def size(self) -> int:
+        if isinstance(self.source, bytes):
+            return len(self.source)
+        return self.source.stat().st_size
+
+    def open(self) -> BinaryIO:
+        if isinstance(self.source, bytes):
+            return BytesIO(self.source)
+        return self.source.open("rb")
+
+    def read_text(self) -> str:
+        """
+        Return the contents of the file decoded as UTF-8
+
+        :raises UnicodeDecodeError: if the file is not UTF-8 text
+        """
+        with self.open() as fp:
+            return fp.read().decode("utf-8")
+
+    def sha256(self) -> str:
+        if isinstance(self.source, bytes):
+            return sha256(self.source).hexdigest()
+        digest = file_sha256(self.source)
+        if digest is None:
+            raise FileNotFoundError(self.source)
+        return digest
+
+    def write_to(self, fp: BinaryIO) -> None:
+        if isinstance(self.source, bytes):
+            fp.write(self.source)
+            return
+        try:
+            dst = fp.fileno()
+        except (AttributeError, OSError):
+            super().write_to(fp)
+            return
+        fp.flush()
+        with self.source.open("rb") as src:
+            copy_fd(src.fileno(), dst)
+
+
 class Diff:
-    delta: str
-    state: DiffState
-    xbit_diff: XBitDiff
+    """
+    The differences between a rendered file and its destination.  `delta`
+    and `stat` can be given when constructing a `Diff`; otherwise, they are
+    computed from `file` on first access, at which point the destination file
+    is read again, so they should be accessed before installing.
+    """
+
+    def __init__(
+        self,
+        state: DiffState,
+        xbit_diff: XBitDiff,
+        delta: str | None = None,
+        stat: DiffStat | None = None,
+        file: BaseRenderedFile | None = None,
+    ) -> None:
+        self.state = state
+        self.xbit_diff = xbit_diff
+        #: The rendered file that `delta` and `stat` are computed from if not
+        #: given
+        self.file = file
+        self._delta = delta
+        self._stat = stat
+
+    def __repr__(self) -> str:
+        return (
+            f"Diff(state={self.state!r}, xbit_diff={self.xbit_diff!r},"
+            f" delta={self._delta!r}, stat={self._stat!r})"
+        )
+
+    @property
+    def delta(self) -> str:
+        """The textual diff between the destination file and the rendered file"""
+        if self._delta is None:
+            self._delta = self._source()._make_delta()
+        return self._delta
+
+    @property
+    def stat(self) -> DiffStat:
+        """
+        The numbers of lines added & removed by the diff, computed without
+        building the textual diff
+        """
+        if self._stat is None:
+            self._stat = self._source()._make_stat()
+        return self._stat
+
+    def _source(self) -> BaseRenderedFile:
+        if self.file is None:
+            raise ValueError("Diff has no file to compute its details from")
+        return self.file
 
     def __bool__(self) -> bool:
         return bool(self.state) or bool(self.xbit_diff)
 
 
+@dataclass
+class DiffStat:
+    added: int
+    removed: int
+
+
 class DiffState(Enum):
     # File is in src but not dest
     MISSING = 1
@@ -20,3 +20,33 @@ class InactiveTemplate(DotplateError):
 
     def __str__(self) -> str:
         return f"Template is not active: {self.template}"
+
+
+@dataclass
+class RevisionNotFound(DotplateError):
+    rev: str
+
+    def __str__(self) -> str:
+        return f"Git revision not found: {self.rev}"
+
+
+@dataclass
+class DaemonRunning(DotplateError):
+    socket: str
+
+    def __str__(self) -> str:
+        return f"A dotplate daemon is already listening at {self.socket}"
+
+
+@dataclass
+class RenderError(DotplateError):
+    template: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"Error rendering {self.template}: {self.message}"
+
+    def __reduce__(self) -> tuple[type[RenderError], tuple[str, str]]:
+        # Needed in order to be passed back from worker processes, as
+        # dataclass exceptions do not populate `args`
+        return (type(self), (self.template, self.message))
@@ -0,0 +1,219 @@
+"""
+Rendering a source tree for many hosts, each with its own local config, in a
+single process
+"""
+
+from __future__ import annotations
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from itertools import repeat
+from pathlib import Path
+from .archive import ArchiveFormat
+from .config import Config, LocalConfig
+from .dotplate import BaseRenderedFile, Dotplate, _try_render
+from .errors import RenderError
+from .git import RevisionFiles
+from .util import TemplateTable, set_executable_bit, unset_executable_bit
+
+
+@dataclass
+class HostResult:
+    """The outcome of rendering the source tree for one host"""
+
+    host: str
+    #: The directory or archive that the host's files were written to
+    path: Path
+    #: The number of files written
+    files: int = 0
+    errors: list[RenderError] = field(default_factory=list)
+
+
+def load_hosts(paths: list[Path]) -> dict[str, LocalConfig]:
+    """
+    Read the given local config files, returning a `dict` mapping each
+    host's name (the file's name without its extension) to its config
+
+    :raises ValueError: if two files have the same name
+    """
+    hosts: dict[str, LocalConfig] = {}
+    for p in paths:
+        if p.stem in hosts:
+            raise ValueError(f"Multiple local configs for host {p.stem!r}")
+        hosts[p.stem] = LocalConfig.from_file(p)
+    return hosts
+
+
+def render_fleet(
+    dotplate: Dotplate,
+    hosts: dict[str, LocalConfig],
+    outdir: Path,
+    jobs: int = 1,
+    archive: ArchiveFormat | None = None,
+    suites_enabled: dict[str, bool] | None = None,
+) -> Iterator[HostResult]:
+    """
+    For each host in `hosts`, render the templates that are active under the
+    host's local config and write them to either a directory tree at
+    :samp:`{outdir}/{host}` or, if `archive` is set, an archive at
+    :samp:`{outdir}/{host}.{archive}`.  Templates see the destination paths
+    set by the host's local config (or by the main config), not paths in
+    `outdir`.  Suites enabled or disabled by `suites_enabled` (as with the
+    ``--enable-suite`` and ``--disable-suite`` options) are enabled or
+    disabled for every host regardless of the hosts' local configs.
+
+    Template discovery is done once for the whole fleet.  If `jobs` is
+    greater than 1, hosts are rendered on a pool of that many worker
+    processes, each of which builds its own Jinja environment from
+    `dotplate.cfg` and compiles each template at most once; otherwise, all
+    hosts share `dotplate`'s Jinja environment, unless its template cache is
+    too small to hold every template, in which case they share a new one
+    with a larger cache.  `dotplate` itself is not modified.  A `HostResult`
+    is yielded
+    for each host in the order of `hosts`.  Templates that fail to render are
+    reported in the results and skipped.
+    """
+    cfg = dotplate.cfg
+    templates = dotplate._ensure_templates()
+    if 0 < cfg.jinja.cache_size < len(templates):
+        # Make sure that compiled templates aren't evicted from the cache
+        # before every host has used them.  This is done on a copy of the
+        # config so as not to affect anything else using it.
+        cfg = cfg.model_copy(
+            update={
+                "jinja": cfg.jinja.model_copy(update={"cache_size": len(templates)})
+            }
+        )
+    suites_enabled = suites_enabled or {}
+    outdir.mkdir(parents=True, exist_ok=True)
+    if jobs <= 1 or len(hosts) <= 1:
+        if cfg is dotplate.cfg:
+            base = dotplate
+        else:
+            base = _base_dotplate(
+                cfg, templates, dotplate._oids, dotplate.revision
+            )
+            base.profiler = dotplate.profiler
+        for name, local in hosts.items():
+            hostdp = _host_dotplate(base, local, suites_enabled)
+            yield render_host(name, hostdp, outdir, archive)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(
+            cfg,
+            templates,
+            dotplate._oids,
+            dotplate.revision,
+            suites_enabled,
+        ),
+    ) as pool:
+        yield from pool.map(
+            _render_host_in_worker,
+            hosts.keys(),
+            hosts.values(),
+            repeat(outdir),
+            repeat(archive),
+        )
+
+
+def _base_dotplate(
+    cfg: Config,
+    templates: TemplateTable,
+    oids: dict[str, str] | None,
+    revision: RevisionFiles | None,
+) -> Dotplate:
+    # A `Dotplate` with its own Jinja environment that the per-host instances
+    # are derived from
+    dp = Dotplate(
+        cfg=cfg,
+        vars=cfg.vars.copy(),
+        suites=cfg.default_suites(),
+        dest=cfg.core.dest,
+        revision=revision,
+    )
+    dp._templates = templates
+    dp._oids = oids
+    return dp
+
+
+def _host_dotplate(
+    dotplate: Dotplate, local: LocalConfig, suites_enabled: dict[str, bool]
+) -> Dotplate:
+    dp = dotplate.with_local_config(local)
+    # Output goes to `outdir`, so there's nothing to keep track of:
+    dp.cfg.core.state_file = None
+    for name, enable in suites_enabled.items():
+        if name not in dp.cfg.suites:
+            continue
+        if enable:
+            dp.suites.add(name)
+        else:
+            dp.suites.discard(name)
+    return dp
+
+
+def render_host(
+    host: str, dotplate: Dotplate, outdir: Path, archive: ArchiveFormat | None
+) -> HostResult:
+    """Render & write out the active templates for a single host"""
+    if archive is None:
+        result = HostResult(host=host, path=outdir / host)
+        for f in _render_all(dotplate, result):
+            _write_file(f, result.path / f.template)
+            result.files += 1
+    else:
+        result = HostResult(host=host, path=outdir / f"{host}.{archive}")
+        templates = dotplate.templates()
+        with result.path.open("wb") as fp:
+            result.errors = dotplate.render_archive(fp, archive, templates)
+        result.files = len(templates) - len(result.errors)
+    return result
+
+
+def _render_all(dotplate: Dotplate, result: HostResult) -> Iterator[BaseRenderedFile]:
+    for t in dotplate.templates():
+        f = _try_render(dotplate, t)
+        if isinstance(f, RenderError):
+            result.errors.append(f)
+            continue
+        try:
+            yield f
+        finally:
+            f.discard()
+
+
+def _write_file(f: BaseRenderedFile, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as fp:
+        f.write_to(fp)
+    if f.executable:
+        set_executable_bit(path)
+    else:
+        unset_executable_bit(path)
+
+
+_worker_dotplate: Dotplate | None = None
+_worker_suites: dict[str, bool] = {}
+
+
+def _init_worker(
+    cfg: Config,
+    templates: TemplateTable,
+    oids: dict[str, str] | None,
+    revision: RevisionFiles | None,
+    suites_enabled: dict[str, bool],
+) -> None:
+    global _worker_dotplate, _worker_suites
+    _worker_suites = suites_enabled
+    _worker_dotplate = _base_dotplate(cfg, templates, oids, revision)
+
+
+def _render_host_in_worker(
+    host: str, local: LocalConfig, outdir: Path, archive: ArchiveFormat | None
+) -> HostResult:
+    assert _worker_dotplate is not None
+    dp = _host_dotplate(_worker_dotplate, local, _worker_suites)
+    return render_host(host, dp, outdir, archive)
@@ -0,0 +1,911 @@
+"""
+Minimal pure-Python access to Git repositories: enough to list the files in
+the index or in a commit and to read objects, without spawning any processes.
+`CatFileBatch` and `RevisionFiles` fall back to running Git where needed.
+
+Anything this module doesn't understand (SHA-256 repositories, split or sparse
+indices, reftables, etc.) results in a `GitUnsupported` exception, upon which
+callers should fall back to running Git itself.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+import mmap
+import os
+from pathlib import Path
+import struct
+import subprocess
+import threading
+from typing import Any
+import zlib
+
+OID_LEN = 20
+
+MODE_TREE = 0o040000
+MODE_GITLINK = 0o160000
+
+PACK_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+
+class GitUnsupported(Exception):
+    """Raised when a repository uses a feature that this module can't handle"""
+
+    pass
+
+
+#: Exceptions that indicate that a repository could not be read by this
+#: module and that callers should fall back to running Git
+READ_ERRORS = (
+    GitUnsupported,
+    OSError,
+    ValueError,
+    LookupError,
+    struct.error,
+    zlib.error,
+)
+
+
+@dataclass
+class IndexEntry:
+    path: str
+    mode: int
+    oid: str
+    stage: int
+    size: int
+    mtime_ns: int
+
+
+@dataclass
+class GitIndex:
+    """
+    The entries of a Git index.  The index of a large repository can have
+    hundreds of thousands of entries, so parsing it only extracts each
+    entry's path & position; the rest of an entry is decoded from the raw
+    index data on demand.
+    """
+
+    #: The entries' paths, undecoded, in index order (i.e., sorted bytewise)
+    paths: list[bytes]
+    #: The tree object ID for the whole index according to the cache-tree
+    #: extension, or `None` if the cache-tree is missing or invalidated
+    root_tree: str | None
+    _data: bytes = field(default=b"", repr=False)
+    #: The position of each entry in `_data`
+    _offsets: list[int] = field(default_factory=list, repr=False)
+    #: The indices of the entries that are unmerged or are submodules
+    _special: list[int] = field(default_factory=list, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def entry(self, i: int) -> IndexEntry:
+        pos = self._offsets[i]
+        (_, _, mtime_s, mtime_ns, _, _, mode, _, _, size) = struct.unpack_from(
+            ">10I", self._data, pos
+        )
+        (flags,) = struct.unpack_from(">H", self._data, pos + 60)
+        return IndexEntry(
+            path=os.fsdecode(self.paths[i]),
+            mode=mode,
+            oid=self._data[pos + 40 : pos + 40 + OID_LEN].hex(),
+            stage=(flags >> 12) & 3,
+            size=size,
+            mtime_ns=mtime_s * 1_000_000_000 + mtime_ns,
+        )
+
+    def span(self, prefix: bytes) -> range:
+        """
+        Return the range of indices of the entries whose paths start with
+        `prefix`, which must be empty or end with a slash
+        """
+        if not prefix:
+            return range(len(self.paths))
+        lo = bisect_left(self.paths, prefix)
+        # "0" is the character after "/":
+        hi = bisect_left(self.paths, prefix[:-1] + b"0", lo)
+        return range(lo, hi)
+
+    def lookup(self, path: bytes) -> IndexEntry | None:
+        """
+        Return the entry for the given path, or `None` if there is none.  For
+        unmerged paths, the entry with the highest stage is returned.
+        """
+        i = bisect_left(self.paths, path)
+        if i == len(self.paths) or self.paths[i] != path:
+            return None
+        while i + 1 < len(self.paths) and self.paths[i + 1] == path:
+            i += 1
+        return self.entry(i)
+
+    def files(self, prefix: bytes, merged_only: bool = False) -> dict[str, str]:
+        """
+        Return a mapping from the paths (relative to `prefix`) of the entries
+        under `prefix` to their object IDs.  Submodules are omitted, as are
+        unmerged entries if `merged_only` is true; otherwise, the entry with
+        the highest stage is used for unmerged paths.
+        """
+        r = self.span(prefix)
+        if not r:
+            return {}
+        # Decode all of the paths with a single call, stripping the prefix
+        # from each one along the way:
+        joined = b"\0".join(self.paths[r.start : r.stop])
+        if prefix:
+            joined = joined[len(prefix) :].replace(b"\0" + prefix, b"\0")
+        names = os.fsdecode(joined).split("\0")
+        data = self._data
+        oids = [
+            data[pos + 40 : pos + 40 + OID_LEN].hex()
+            for pos in self._offsets[r.start : r.stop]
+        ]
+        files = dict(zip(names, oids))
+        strip = len(os.fsdecode(prefix))
+        for i in self._special:
+            if i in r:
+                e = self.entry(i)
+                if e.mode == MODE_GITLINK or (merged_only and e.stage != 0):
+                    files.pop(e.path[strip:], None)
+        return files
+
+
+@dataclass
+class TreeEntry:
+    name: str
+    mode: int
+    oid: str
+
+
+@dataclass
+class GitRepo:
+    #: The repository's ``.git`` directory (the per-worktree directory for
+    #: linked worktrees)
+    gitdir: Path
+    #: The directory containing shared data (objects, refs); differs from
+    #: `gitdir` for linked worktrees
+    commondir: Path
+    worktree: Path
+    _packs: list[PackFile] | None = field(init=False, default=None, repr=False)
+    _object_dirs: list[Path] | None = field(init=False, default=None, repr=False)
+
+    @classmethod
+    def find(cls, path: Path) -> GitRepo | None:
+        """
+        Find the repository whose working tree contains `path`.  Returns
+        `None` if `path` is not in a working tree (including if it's inside a
+        ``.git`` directory).
+        """
+        if any(k in os.environ for k in ("GIT_DIR", "GIT_WORK_TREE", "GIT_INDEX_FILE")):
+            raise GitUnsupported("Git environment variables are set")
+        path = path.resolve()
+        for d in (path, *path.parents):
+            if d.name == ".git":
+                return None
+            dotgit = d / ".git"
+            if dotgit.is_dir():
+                gitdir = dotgit
+            elif dotgit.is_file():
+                line = dotgit.read_text(encoding="utf-8").strip()
+                if not line.startswith("gitdir:"):
+                    raise GitUnsupported(f"Cannot parse {dotgit}")
+                gitdir = d / line[len("gitdir:") :].strip()
+            else:
+                continue
+            try:
+                common = (gitdir / "commondir").read_text(encoding="utf-8").strip()
+            except FileNotFoundError:
+                commondir = gitdir
+            else:
+                commondir = gitdir / common
+            repo = cls(gitdir=gitdir, commondir=commondir, worktree=d)
+            repo._check_config()
+            return repo
+        return None
+
+    def _check_config(self) -> None:
+        try:
+            config = (self.commondir / "config").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return
+        config = config.lower()
+        for setting in ("objectformat", "refstorage", "bare = true"):
+            if setting in config:
+                raise GitUnsupported(f"Unsupported config setting: {setting}")
+
+    def read_index(self, stop: bytes | None = None) -> GitIndex:
+        """Read the index; see `parse_index()` for the meaning of `stop`"""
+        try:
+            data = (self.gitdir / "index").read_bytes()
+        except FileNotFoundError:
+            return GitIndex(paths=[], root_tree=None)
+        return parse_index(data, stop=stop)
+
+    def state_files(self) -> list[Path]:
+        """
+        Return the paths of the files that record what is committed & staged:
+        ``HEAD``, the index, ``packed-refs``, and the branch that ``HEAD``
+        currently points to (if any).  The files need not exist.
+        """
+        head = self.gitdir / "HEAD"
+        files = [head, self.gitdir / "index", self.commondir / "packed-refs"]
+        try:
+            value = head.read_text(encoding="utf-8").strip()
+        except OSError:
+            pass
+        else:
+            if value.startswith("ref:"):
+                files.append(self.commondir / value[len("ref:") :].strip())
+        return files
+
+    def resolve_ref(self, ref: str = "HEAD") -> str | None:
+        """
+        Return the object ID that the given ref (``HEAD``, a pseudo-ref like
+        ``ORIG_HEAD``, or a full ref name like ``refs/heads/main``) points to,
+        or `None` if it doesn't exist
+        """
+        for _ in range(10):
+            if ref == "HEAD" or not ref.startswith("refs/"):
+                base = self.gitdir
+            else:
+                base = self.commondir
+            try:
+                value = (base / ref).read_text(encoding="utf-8").strip()
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                return self._packed_ref(ref)
+            if value.startswith("ref:"):
+                ref = value[len("ref:") :].strip()
+            elif value:
+                # FETCH_HEAD and MERGE_HEAD can list several object IDs, each
+                # followed by a description; the first one is the one used.
+                return value.split()[0]
+            else:
+                return None
+        raise GitUnsupported("Too many levels of symbolic refs")
+
+    def resolve_revision(self, rev: str) -> str:
+        """
+        Resolve a revision given as a full object ID, ``HEAD``, an all-caps
+        pseudo-ref like ``ORIG_HEAD`` or ``FETCH_HEAD``, or a full or
+        abbreviated ref name to an object ID.  More complicated revision
+        syntax (``HEAD~2``, abbreviated object IDs, etc.) and revisions that
+        do not match any ref raise `GitUnsupported`, leaving it to
+        :command:`git` to either resolve them or report them as nonexistent.
+        """
+        if len(rev) == 2 * OID_LEN and all(c in "0123456789abcdef" for c in rev):
+            return rev
+        if any(c in rev for c in "~^:@{}") or rev.startswith("-") or ".." in rev:
+            raise GitUnsupported(f"Unsupported revision syntax: {rev!r}")
+        for ref in (
+            rev,
+            f"refs/{rev}",
+            f"refs/tags/{rev}",
+            f"refs/heads/{rev}",
+            f"refs/remotes/{rev}",
+            f"refs/remotes/{rev}/HEAD",
+        ):
+            if not (ref.startswith("refs/") or _is_pseudo_ref(ref)):
+                continue
+            if (oid := self.resolve_ref(ref)) is not None:
+                return oid
+        raise GitUnsupported(f"Could not resolve revision: {rev!r}")
+
+    def _packed_ref(self, ref: str) -> str | None:
+        try:
+            with (self.commondir / "packed-refs").open(encoding="utf-8") as fp:
+                for line in fp:
+                    if line.startswith(("#", "^")):
+                        continue
+                    oid, _, name = line.rstrip("\n").partition(" ")
+                    if name == ref:
+                        return oid
+        except FileNotFoundError:
+            pass
+        return None
+
+    def read_object(self, oid: str) -> tuple[str, bytes]:
+        """Return the type and contents of the given object"""
+        for d in self._get_object_dirs():
+            try:
+                raw = (d / oid[:2] / oid[2:]).read_bytes()
+            except FileNotFoundError:
+                continue
+            data = zlib.decompress(raw)
+            header, _, body = data.partition(b"\0")
+            objtype, _, _ = header.partition(b" ")
+            return (objtype.decode("ascii"), body)
+        binoid = bytes.fromhex(oid)
+        for pack in self._get_packs():
+            if (offset := pack.find(binoid)) is not None:
+                return pack.read_at(offset, self)
+        raise GitUnsupported(f"Object {oid} not found")
+
+    def read_typed(self, oid: str, objtype: str) -> bytes:
+        actual, body = self.read_object(oid)
+        if actual != objtype:
+            raise GitUnsupported(f"Expected {oid} to be a {objtype}, got {actual}")
+        return body
+
+    def commit_tree(self, oid: str) -> str:
+        """Return the ID of the tree of the given commit (or tag thereof)"""
+        for _ in range(10):
+            objtype, body = self.read_object(oid)
+            if objtype == "tag":
+                oid = body.split(b"\n", 1)[0].removeprefix(b"object ").decode()
+                continue
+            if objtype == "commit":
+                first = body.split(b"\n", 1)[0]
+                if not first.startswith(b"tree "):
+                    raise GitUnsupported(f"Malformed commit {oid}")
+                return first[len(b"tree ") :].decode("ascii")
+            if objtype == "tree":
+                return oid
+            raise GitUnsupported(f"Object {oid} is a {objtype}, not a commit")
+        raise GitUnsupported("Too many levels of tags")
+
+    def read_tree(self, oid: str) -> list[TreeEntry]:
+        return parse_tree(self.read_typed(oid, "tree"))
+
+    def subtree(self, oid: str, path: str) -> str | None:
+        """
+        Return the ID of the tree at forward-slash-separated `path` within
+        the given tree, or `None` if there is no such tree
+        """
+        for name in filter(None, path.split("/")):
+            for e in self.read_tree(oid):
+                if e.name == name and e.mode == MODE_TREE:
+                    oid = e.oid
+                    break
+            else:
+                return None
+        return oid
+
+    def tree_entry(self, oid: str, path: str) -> tuple[int, str] | None:
+        """
+        Return the mode & object ID of the non-tree entry at
+        forward-slash-separated `path` within the given tree, or `None` if
+        there is no such entry
+        """
+        (dirname, _, name) = path.rpartition("/")
+        tree = self.subtree(oid, dirname)
+        if tree is None:
+            return None
+        for e in self.read_tree(tree):
+            if e.name == name and e.mode != MODE_TREE:
+                return (e.mode, e.oid)
+        return None
+
+    def walk_tree(self, oid: str, prefix: str = "") -> Iterator[tuple[str, int, str]]:
+        """
+        Yield ``(path, mode, oid)`` for every non-tree entry in the given tree
+        and its subtrees, in Git's sort order
+        """
+        for e in self.read_tree(oid):
+            path = prefix + e.name
+            if e.mode == MODE_TREE:
+                yield from self.walk_tree(e.oid, path + "/")
+            else:
+                yield (path, e.mode, e.oid)
+
+    def _get_object_dirs(self) -> list[Path]:
+        if self._object_dirs is None:
+            objdir = self.commondir / "objects"
+            dirs = [objdir]
+            try:
+                alternates = (objdir / "info" / "alternates").read_text("utf-8")
+            except FileNotFoundError:
+                pass
+            else:
+                for line in alternates.splitlines():
+                    if line and not line.startswith("#"):
+                        dirs.append(objdir / line)
+            self._object_dirs = dirs
+        return self._object_dirs
+
+    def _get_packs(self) -> list[PackFile]:
+        if self._packs is None:
+            packs = []
+            for d in self._get_object_dirs():
+                packdir = d / "pack"
+                if packdir.is_dir():
+                    for idx in sorted(packdir.glob("pack-*.idx")):
+                        packs.append(PackFile(idx))
+            self._packs = packs
+        return self._packs
+
+
+class PackFile:
+    """A packfile and its version 2 index"""
+
+    def __init__(self, idxpath: Path) -> None:
+        self.idxpath = idxpath
+        self.packpath = idxpath.with_suffix(".pack")
+        self._idx: bytes | None = None
+        self._pack: mmap.mmap | None = None
+        self.count = 0
+
+    def _load(self) -> bytes:
+        if self._idx is None:
+            idx = self.idxpath.read_bytes()
+            if idx[:8] != b"\377tOc\0\0\0\2":
+                raise GitUnsupported(f"Unsupported pack index: {self.idxpath}")
+            self.count = struct.unpack_from(">I", idx, 8 + 255 * 4)[0]
+            self._idx = idx
+        return self._idx
+
+    def find(self, binoid: bytes) -> int | None:
+        idx = self._load()
+        first = binoid[0]
+        lo = struct.unpack_from(">I", idx, 8 + (first - 1) * 4)[0] if first else 0
+        hi = struct.unpack_from(">I", idx, 8 + first * 4)[0]
+        base = 8 + 256 * 4
+        oids = _OidTable(idx, base)
+        i = bisect_left(oids, binoid, lo, hi)
+        if i >= hi or oids[i] != binoid:
+            return None
+        offbase = base + self.count * (OID_LEN + 4)
+        offset = struct.unpack_from(">I", idx, offbase + i * 4)[0]
+        if offset & 0x80000000:
+            large = offbase + self.count * 4 + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack_from(">Q", idx, large)[0]
+        return int(offset)
+
+    def _get_pack(self) -> mmap.mmap:
+        if self._pack is None:
+            with self.packpath.open("rb") as fp:
+                self._pack = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._pack
+
+    def read_at(self, offset: int, repo: GitRepo) -> tuple[str, bytes]:
+        pack = self._get_pack()
+        pos = offset
+        c = pack[pos]
+        pos += 1
+        typenum = (c >> 4) & 7
+        size = c & 0x0F
+        shift = 4
+        while c & 0x80:
+            c = pack[pos]
+            pos += 1
+            size |= (c & 0x7F) << shift
+            shift += 7
+        if typenum in PACK_TYPES:
+            return (PACK_TYPES[typenum], _inflate(pack, pos, size))
+        elif typenum == OFS_DELTA:
+            c = pack[pos]
+            pos += 1
+            rel = c & 0x7F
+            while c & 0x80:
+                c = pack[pos]
+                pos += 1
+                rel = ((rel + 1) << 7) | (c & 0x7F)
+            (basetype, basedata) = self.read_at(offset - rel, repo)
+        elif typenum == REF_DELTA:
+            baseoid = pack[pos : pos + OID_LEN].hex()
+            pos += OID_LEN
+            (basetype, basedata) = repo.read_object(baseoid)
+        else:
+            raise GitUnsupported(f"Unknown pack object type {typenum}")
+        return (basetype, apply_delta(basedata, _inflate(pack, pos, size)))
+
+
+class _OidTable:
+    """A read-only sequence view of the object IDs in a pack index"""
+
+    def __init__(self, idx: bytes, base: int) -> None:
+        self.idx = idx
+        self.base = base
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.base + i * OID_LEN
+        return self.idx[start : start + OID_LEN]
+
+    def __len__(self) -> int:
+        return (len(self.idx) - self.base) // OID_LEN
+
+
+def _is_pseudo_ref(name: str) -> bool:
+    # Like Git, treat all-caps names (``HEAD``, ``ORIG_HEAD``, ``FETCH_HEAD``,
+    # etc.) as refs stored directly in the Git directory
+    return name[:1].isalpha() and all(c in "ABCDEFGHIJKLMNOPQRSTUVWXYZ_" for c in name)
+
+
+def _inflate(buf: mmap.mmap, pos: int, size: int) -> bytes:
+    d = zlib.decompressobj()
+    out = []
+    chunk = max(size, 4096)
+    while not d.eof:
+        data = buf[pos : pos + chunk]
+        if not data:
+            raise GitUnsupported("Truncated pack data")
+        out.append(d.decompress(data))
+        pos += chunk
+    return b"".join(out)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    pos = 0
+
+    def varint() -> int:
+        nonlocal pos
+        value = shift = 0
+        while True:
+            c = delta[pos]
+            pos += 1
+            value |= (c & 0x7F) << shift
+            shift += 7
+            if not c & 0x80:
+                return value
+
+    if varint() != len(base):
+        raise GitUnsupported("Delta base size mismatch")
+    target_size = varint()
+    out = bytearray()
+    while pos < len(delta):
+        c = delta[pos]
+        pos += 1
+        if c & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if c & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if c & (1 << (4 + i)):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out += base[offset : offset + size]
+        elif c:
+            out += delta[pos : pos + c]
+            pos += c
+        else:
+            raise GitUnsupported("Invalid delta opcode")
+    if len(out) != target_size:
+        raise GitUnsupported("Delta result size mismatch")
+    return bytes(out)
+
+
+def parse_tree(data: bytes) -> list[TreeEntry]:
+    entries = []
+    pos = 0
+    while pos < len(data):
+        sp = data.index(b" ", pos)
+        nul = data.index(b"\0", sp)
+        mode = int(data[pos:sp], 8)
+        name = os.fsdecode(data[sp + 1 : nul])
+        oid = data[nul + 1 : nul + 1 + OID_LEN].hex()
+        entries.append(TreeEntry(name=name, mode=mode, oid=oid))
+        pos = nul + 1 + OID_LEN
+    return entries
+
+
+def parse_index(data: bytes, stop: bytes | None = None) -> GitIndex:
+    """
+    Parse the contents of an index file.  If `stop` is given, parsing stops
+    after the first entry whose path sorts after `stop`, so that looking up
+    a few paths doesn't require going through every entry; the returned
+    index then only contains the entries up to that point, and its
+    `~GitIndex.root_tree` is `None`.
+    """
+    if data[:4] != b"DIRC":
+        raise GitUnsupported("Not a Git index file")
+    (version, count) = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        raise GitUnsupported(f"Unsupported index version {version}")
+    # This loop runs once for every file in the repository, so it only does
+    # what's needed to find each entry's path; see `GitIndex.entry()`.
+    paths: list[bytes] = []
+    offsets: list[int] = []
+    special: list[int] = []
+    pos = 12
+    prevpath = b""
+    for i in range(count):
+        offsets.append(pos)
+        flags = data[pos + 60] << 8 | data[pos + 61]
+        # The third byte of the mode is 0x81 or 0xA0 for regular files &
+        # symlinks, 0xE0 for submodules, and 0x40 for sparse directories:
+        if flags & 0x3000 or not 0x80 <= data[pos + 26] < 0xC0:
+            if data[pos + 26] >> 4 == MODE_TREE >> 12:
+                raise GitUnsupported("Sparse index")
+            special.append(i)
+        start = pos + 62
+        if version >= 3 and flags & 0x4000:
+            start += 2
+        if version == 4:
+            strip = 0
+            c = 0x80
+            first = True
+            while c & 0x80:
+                c = data[start]
+                start += 1
+                if first:
+                    strip = c & 0x7F
+                    first = False
+                else:
+                    strip = ((strip + 1) << 7) | (c & 0x7F)
+            nul = data.index(b"\0", start)
+            path = prevpath[: len(prevpath) - strip] + data[start:nul]
+            prevpath = path
+            pos = nul + 1
+        else:
+            namelen = flags & 0xFFF
+            if namelen == 0xFFF:
+                end = data.index(b"\0", start)
+            else:
+                end = start + namelen
+            path = data[start:end]
+            # Entries are padded with NULs to a multiple of eight bytes:
+            pos += (end - pos + 8) & ~7
+        paths.append(path)
+        if stop is not None and path > stop:
+            return GitIndex(
+                paths=paths,
+                root_tree=None,
+                _data=data,
+                _offsets=offsets,
+                _special=special,
+            )
+    root_tree = None
+    end = len(data) - OID_LEN
+    while pos + 8 <= end:
+        sig = data[pos : pos + 4]
+        (extlen,) = struct.unpack_from(">I", data, pos + 4)
+        ext = data[pos + 8 : pos + 8 + extlen]
+        pos += 8 + extlen
+        if sig == b"TREE":
+            root_tree = _root_cache_tree(ext)
+        elif sig in (b"link", b"sdir"):
+            raise GitUnsupported("Split or sparse index")
+    return GitIndex(
+        paths=paths,
+        root_tree=root_tree,
+        _data=data,
+        _offsets=offsets,
+        _special=special,
+    )
+
+
+def _root_cache_tree(ext: bytes) -> str | None:
+    nul = ext.find(b"\0")
+    nl = ext.find(b"\n", nul)
+    if nul != 0 or nl == -1:
+        return None
+    entry_count = int(ext[nul + 1 : nl].split(b" ")[0])
+    if entry_count < 0:
+        return None
+    return ext[nl + 1 : nl + 1 + OID_LEN].hex()
+
+
+def tracked_files(
+    repo: GitRepo,
+    dirpath: Path,
+    include_staged: bool = False,
+    paths: Iterable[str] | None = None,
+) -> dict[str, str] | None:
+    """
+    Return a mapping from the paths (relative to `dirpath` and
+    forward-slash-separated) of all files under `dirpath` that are committed
+    to :samp:`HEAD` (or, if `include_staged` is true, that are in the index)
+    to their blob object IDs.  Submodules are omitted.
+
+    If `paths` is given, only those paths (relative to `dirpath`) are looked
+    up, and the mapping only contains the ones that are tracked.  The index
+    is then only read as far as the last of the paths, and committed files
+    are looked up by descending through just the trees that contain them
+    rather than by walking the entire tree.
+
+    Returns `None` if nothing under `dirpath` is tracked by Git.
+    """
+    rel = dirpath.resolve().relative_to(repo.worktree.resolve()).as_posix()
+    prefix = "" if rel == "." else rel + "/"
+    bprefix = os.fsencode(prefix)
+    if paths is not None:
+        return _tracked_paths(repo, prefix, include_staged, list(paths))
+    index = repo.read_index()
+    if not index.span(bprefix):
+        return None
+    if include_staged:
+        return index.files(bprefix)
+    head = repo.resolve_ref("HEAD")
+    if head is None:
+        return {}
+    tree = repo.commit_tree(head)
+    if index.root_tree == tree:
+        # The index matches HEAD exactly, so there's no need to read any tree
+        # objects.
+        return index.files(bprefix, merged_only=True)
+    files = {}
+    if (subtree := repo.subtree(tree, prefix)) is not None:
+        for path, mode, oid in repo.walk_tree(subtree):
+            if mode != MODE_GITLINK:
+                files[path] = oid
+    return files
+
+
+def _tracked_paths(
+    repo: GitRepo, prefix: str, include_staged: bool, paths: list[str]
+) -> dict[str, str] | None:
+    """`tracked_files()` for an explicit list of paths"""
+    bprefix = os.fsencode(prefix)
+    bpaths = {p: bprefix + os.fsencode(p) for p in paths}
+    # Every entry up to the last requested path is needed, plus one more so
+    # that we can tell whether anything under `prefix` is tracked even if
+    # all such entries come after the requested paths:
+    index = repo.read_index(stop=max(bpaths.values(), default=bprefix))
+    if not index.span(bprefix):
+        return None
+    files: dict[str, str] = {}
+    if include_staged:
+        for p, bp in bpaths.items():
+            entry = index.lookup(bp)
+            if entry is not None and entry.mode != MODE_GITLINK:
+                files[p] = entry.oid
+        return files
+    head = repo.resolve_ref("HEAD")
+    if head is None:
+        return files
+    tree = repo.commit_tree(head)
+    for p in paths:
+        tentry = repo.tree_entry(tree, prefix + p)
+        if tentry is not None and tentry[0] != MODE_GITLINK:
+            files[p] = tentry[1]
+    return files
+
+
+class CatFileBatch:
+    """
+    Read objects from a repository via a single long-lived :command:`git
+    cat-file --batch` process
+    """
+
+    def __init__(self, dirpath: Path) -> None:
+        # Requests & responses must not be interleaved when rendering on
+        # multiple threads:
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=dirpath,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read_object(self, oid: str) -> tuple[str, bytes]:
+        assert self.proc.stdin is not None
+        assert self.proc.stdout is not None
+        with self.lock:
+            self.proc.stdin.write(oid.encode("ascii") + b"\n")
+            self.proc.stdin.flush()
+            header = self.proc.stdout.readline().decode("ascii").split()
+            if len(header) != 3:
+                raise GitUnsupported(f"Object {oid} not found")
+            (_, objtype, size) = header
+            data = self.proc.stdout.read(int(size) + 1)
+        return (objtype, data[:-1])
+
+    def close(self) -> None:
+        if self.proc.stdin is not None:
+            self.proc.stdin.close()
+        self.proc.wait()
+        if self.proc.stdout is not None:
+            self.proc.stdout.close()
+
+
+@dataclass
+class RevisionFiles:
+    """The files under a directory as of a given Git commit"""
+
+    #: The directory in the working tree whose contents are listed
+    dirpath: Path
+    #: The ID of the commit
+    commit: str
+    #: A mapping from paths of files under `dirpath` in `commit` (relative to
+    #: `dirpath` and forward-slash-separated) to their modes and blob IDs.
+    #: Submodules are omitted.
+    files: dict[str, tuple[int, str]]
+    _reader: GitRepo | CatFileBatch | None = field(
+        default=None, repr=False, compare=False
+    )
+
+    @classmethod
+    def load(cls, dirpath: Path, rev: str) -> RevisionFiles | None:
+        """
+        List the files under `dirpath` as of revision `rev` of the repository
+        containing `dirpath`.  Returns `None` if `dirpath` is not in a Git
+        repository or `rev` does not exist.
+
+        The repository is read directly where possible, falling back to
+        running :command:`git` otherwise.
+        """
+        try:
+            repo = GitRepo.find(dirpath)
+            if repo is None:
+                return None
+            commit = repo.resolve_revision(rev)
+            rel = dirpath.resolve().relative_to(repo.worktree.resolve()).as_posix()
+            tree = repo.subtree(repo.commit_tree(commit), "" if rel == "." else rel)
+            files = {}
+            if tree is not None:
+                for path, mode, oid in repo.walk_tree(tree):
+                    if mode != MODE_GITLINK:
+                        files[path] = (mode, oid)
+            return cls(dirpath=dirpath, commit=commit, files=files, _reader=repo)
+        except READ_ERRORS:
+            return cls._load_subprocess(dirpath, rev)
+
+    @classmethod
+    def _load_subprocess(cls, dirpath: Path, rev: str) -> RevisionFiles | None:
+        try:
+            r = subprocess.run(
+                ["git", "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"],
+                cwd=dirpath,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+            commit = r.stdout.strip()
+            listing = subprocess.run(
+                ["git", "ls-tree", "-r", "-z", commit],
+                cwd=dirpath,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            return None
+        files = {}
+        for line in os.fsdecode(listing.stdout).split("\0"):
+            if line:
+                meta, _, path = line.partition("\t")
+                (mode, _, oid) = meta.split()
+                if int(mode, 8) != MODE_GITLINK:
+                    files[path] = (int(mode, 8), oid)
+        return cls(
+            dirpath=dirpath, commit=commit, files=files, _reader=CatFileBatch(dirpath)
+        )
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Readers can't be pickled; a new one is created on demand after
+        # unpickling.
+        state = self.__dict__.copy()
+        state["_reader"] = None
+        return state
+
+    def read(self, path: str) -> bytes | None:
+        """
+        Return the contents of the file at `path` in the commit, or `None` if
+        there is no such file
+        """
+        try:
+            (_, oid) = self.files[path]
+        except KeyError:
+            return None
+        if self._reader is None:
+            try:
+                self._reader = GitRepo.find(self.dirpath)
+            except GitUnsupported:
+                pass
+            if self._reader is None:
+                self._reader = CatFileBatch(self.dirpath)
+        if isinstance(self._reader, GitRepo):
+            try:
+                return self._reader.read_typed(oid, "blob")
+            except READ_ERRORS:
+                self._reader = CatFileBatch(self.dirpath)
+        (objtype, data) = self._reader.read_object(oid)
+        if objtype != "blob":
+            raise GitUnsupported(f"Expected {oid} to be a blob, got {objtype}")
+        return data
+
+    def is_executable(self, path: str) -> bool:
+        (mode, _) = self.files[path]
+        return mode & 0o111 != 0
+
+    def close(self) -> None:
+        if isinstance(self._reader, CatFileBatch):
+            self._reader.close()
+        self._reader = None
@@ -0,0 +1,166 @@
+from __future__ import annotations
+from collections.abc import Callable
+import os
+from pathlib import Path
+import sys
+import threading
+from types import TracebackType
+from typing import TYPE_CHECKING, Literal
+
+if TYPE_CHECKING:
+    from .dotplate import BaseRenderedFile
+
+#: How hard to try to ensure that installed files survive a crash:
+#:
+#: ``"none"``
+#:     Leave it up to the OS when to write files to disk
+#: ``"syncfs"``
+#:     Flush the destination filesystem once after all files are installed
+#: ``"fsync"``
+#:     Flush each file and its directory as it is installed
+Durability = Literal["none", "syncfs", "fsync"]
+
+
+class Installer:
+    """
+    Installs rendered files atomically: each file is first written to a
+    temporary file in its destination directory, which is then renamed over
+    the destination path, so that an interrupted install never leaves a
+    destination missing or truncated.
+
+    If `transactional` is true, all files passed to `install()` are only
+    staged (written to their temporary files), and the renames are all
+    performed by `commit()`; if anything fails before then, `rollback()`
+    deletes the staged files, and no destination is touched.  Otherwise, each
+    file is put in place immediately.
+
+    `on_install` is called with each file once it is in place.
+
+    `install()` may be called from multiple threads at once; calls to
+    `on_install` are serialized, so it need not be thread-safe.
+
+    When used as a context manager, the installer commits on a normal exit and
+    rolls back if an exception is raised.
+    """
+
+    def __init__(
+        self,
+        durability: Durability = "none",
+        transactional: bool = False,
+        on_install: Callable[[BaseRenderedFile], None] | None = None,
+    ) -> None:
+        self.durability = durability
+        self.transactional = transactional
+        self.on_install = on_install
+        self._staged: list[tuple[BaseRenderedFile, Path | None]] = []
+        self._dirs: set[Path] = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> Installer:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def install(self, f: BaseRenderedFile) -> None:
+        diff = f.diff()
+        if not diff:
+            return
+        staged = f.stage(fsync=self.durability == "fsync") if diff.state else None
+        if self.transactional:
+            with self._lock:
+                self._staged.append((f, staged))
+        else:
+            self._put(f, staged)
+            if self.durability == "fsync":
+                fsync_dir(f.dest_path.parent)
+            if self.on_install is not None:
+                with self._lock:
+                    self.on_install(f)
+
+    def commit(self) -> None:
+        committed: list[BaseRenderedFile] = []
+        try:
+            for f, tmp in self._staged:
+                self._put(f, tmp)
+                committed.append(f)
+        except BaseException:
+            # Don't leave the remaining temporary files lying around
+            del self._staged[: len(committed)]
+            self.rollback()
+            raise
+        self._staged.clear()
+        if self.durability == "fsync" and self.transactional:
+            for d in self._dirs:
+                fsync_dir(d)
+        elif self.durability == "syncfs":
+            for d in filesystem_representatives(self._dirs):
+                sync_filesystem(d)
+        self._dirs.clear()
+        if self.transactional and self.on_install is not None:
+            for f in committed:
+                self.on_install(f)
+
+    def rollback(self) -> None:
+        for _, tmp in self._staged:
+            if tmp is not None:
+                tmp.unlink(missing_ok=True)
+        self._staged.clear()
+
+    def _put(self, f: BaseRenderedFile, staged: Path | None) -> None:
+        if staged is not None:
+            f.commit(staged)
+            with self._lock:
+                self._dirs.add(f.dest_path.parent)
+        else:
+            f.fix_executable_bit()
+
+
+def fsync_dir(dirpath: Path) -> None:
+    """Flush a directory's entries to disk (a no-op on Windows)"""
+    if os.name == "nt":
+        return
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def filesystem_representatives(dirs: set[Path]) -> list[Path]:
+    """Return one directory from `dirs` for each distinct filesystem"""
+    seen: dict[int, Path] = {}
+    for d in sorted(dirs):
+        try:
+            dev = d.stat().st_dev
+        except OSError:
+            continue
+        seen.setdefault(dev, d)
+    return list(seen.values())
+
+
+def sync_filesystem(dirpath: Path) -> None:
+    """
+    Flush the filesystem containing `dirpath` to disk, using :manpage:`syncfs`
+    where available and falling back to flushing all filesystems
+    """
+    if sys.platform.startswith("linux"):
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = os.open(dirpath, os.O_RDONLY)
+        try:
+            if libc.syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+    if hasattr(os, "sync"):
+        os.sync()
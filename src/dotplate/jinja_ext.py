@@ -1,19 +1,117 @@
 from __future__ import annotations
+import os
 import shlex
 import shutil
-from jinja2 import Environment, Undefined, pass_environment
+from jinja2 import Environment, Undefined
 from jinja2.ext import Extension
 
 
 class DotplateExt(Extension):
     def __init__(self, env: Environment) -> None:
-        env.globals["which"] = which
+        super().__init__(env)
+        self._index: ExecutableIndex | None = None
+        env.globals["which"] = self.which
         env.filters["shell_quote"] = shlex.quote
 
+    def which(self, *cmds: str) -> str | Undefined:
+        index = self.get_index()
+        for c in cmds:
+            if (path := index.which(c)) is not None:
+                return path
+        return self.environment.undefined("which() could not locate any commands")
 
-@pass_environment
-def which(env: Environment, *cmds: str) -> str | Undefined:
-    for c in cmds:
-        if (path := shutil.which(c)) is not None:
-            return path
-    return env.undefined("which() could not locate any commands")
+    def get_index(self) -> ExecutableIndex:
+        """
+        Return the index of executables on the current :envvar:`PATH`,
+        creating a new one if :envvar:`PATH` has changed since the last call
+        """
+        path = os.environ.get("PATH", os.defpath)
+        if self._index is None or self._index.path != path:
+            self._index = ExecutableIndex(path)
+        return self._index
+
+    def refresh_index(self) -> None:
+        """
+        Discard the index of executables if any of the directories that it
+        has listed have changed since, so that long-running processes notice
+        executables that have been installed or removed
+        """
+        if self._index is not None and not self._index.is_current():
+            self._index = None
+
+
+class ExecutableIndex:
+    """
+    Answers `shutil.which()`-style queries for a fixed search path by
+    dictionary lookups.  Each directory on the path is listed at most once,
+    the first time that a lookup needs to search it, and the results of all
+    lookups are memoized, so use `is_current()` to find out whether the
+    index has gone stale.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.dirs: list[str] = []
+        for d in path.split(os.pathsep):
+            # An empty entry means the current directory
+            d = d or os.curdir
+            if d not in self.dirs:
+                self.dirs.append(d)
+        self._listings: dict[str, frozenset[str]] = {}
+        #: The mtimes of the listed directories as of just before they were
+        #: listed, or `None` for directories that don't exist
+        self._mtimes: dict[str, int | None] = {}
+        #: Whether any lookups were left to `shutil.which()`, in which case
+        #: there's no telling what they depended on
+        self._unlisted = False
+        self._cache: dict[str, str | None] = {}
+
+    def is_current(self) -> bool:
+        """
+        Test whether none of the directories listed so far have changed since
+        they were listed
+        """
+        return not self._unlisted and all(
+            _mtime(d) == mtime for d, mtime in self._mtimes.items()
+        )
+
+    def which(self, cmd: str) -> str | None:
+        try:
+            return self._cache[cmd]
+        except KeyError:
+            pass
+        if os.name == "nt" or os.path.dirname(cmd):
+            # Leave PATHEXT handling & paths with directory components to
+            # `shutil`
+            found = shutil.which(cmd, path=self.path)
+            self._unlisted = True
+        else:
+            found = None
+            for d in self.dirs:
+                if cmd in self._listing(d):
+                    p = os.path.join(d, cmd)
+                    if os.access(p, os.X_OK) and not os.path.isdir(p):
+                        found = p
+                        break
+        self._cache[cmd] = found
+        return found
+
+    def _listing(self, d: str) -> frozenset[str]:
+        try:
+            return self._listings[d]
+        except KeyError:
+            pass
+        self._mtimes[d] = _mtime(d)
+        try:
+            names = frozenset(os.listdir(d))
+        except OSError:
+            names = frozenset()
+        self._listings[d] = names
+        return names
+
+
+def _mtime(d: str) -> int | None:
+    try:
+        return os.stat(d).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,318 @@
+"""
+Line-based diffing in the style of Git's patience & histogram algorithms,
+which run in roughly linear time on typical inputs rather than degrading
+quadratically like `difflib` on large files with many changes
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+
+#: Lines that occur more than this many times in a region are not used as
+#: anchors for splitting the region
+MAX_CHAIN = 64
+
+#: Regions in which no line can be used as an anchor are diffed with Myers'
+#: algorithm, but only if they differ by at most this many lines; otherwise,
+#: they are treated as wholly replaced
+MAX_EDITS = 2000
+
+#: A run of ``size`` equal lines starting at index ``a`` in the old sequence
+#: and index ``b`` in the new sequence
+Block = tuple[int, int, int]
+
+#: A ``(tag, alo, ahi, blo, bhi)`` tuple in the format of
+#: `difflib.SequenceMatcher.get_opcodes()`
+Opcode = tuple[str, int, int, int, int]
+
+
+def intern_lines(a: Sequence[str], b: Sequence[str]) -> tuple[list[int], list[int]]:
+    """
+    Replace each line in `a` & `b` with an integer that is the same for
+    equal lines, so that lines can be compared & hashed cheaply
+    """
+    ids: dict[str, int] = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return (a_ids, b_ids)
+
+
+def matching_blocks(a: Sequence[str], b: Sequence[str]) -> list[Block]:
+    """
+    Return the runs of lines that `a` & `b` have in common, in order, with
+    adjacent runs merged
+    """
+    (ai, bi) = intern_lines(a, b)
+    found: list[Block] = []
+    # Regions are processed with an explicit stack rather than by recursion
+    # so that large inputs don't hit the recursion limit:
+    stack = [(0, len(ai), 0, len(bi))]
+    while stack:
+        (alo, ahi, blo, bhi) = stack.pop()
+        start = (alo, blo)
+        while alo < ahi and blo < bhi and ai[alo] == bi[blo]:
+            alo += 1
+            blo += 1
+        if alo > start[0]:
+            found.append((start[0], start[1], alo - start[0]))
+        end = (ahi, bhi)
+        while alo < ahi and blo < bhi and ai[ahi - 1] == bi[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end[0]:
+            found.append((ahi, bhi, end[0] - ahi))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_anchors(ai, bi, alo, ahi, blo, bhi)
+        if not anchors:
+            if (anchor := _find_anchor(ai, bi, alo, ahi, blo, bhi)) is not None:
+                anchors = [anchor]
+            else:
+                # Every line in the region is either unmatched or too common
+                # to anchor on, so fall back to Myers' algorithm, as Git does
+                found.extend(_myers_blocks(ai, bi, alo, ahi, blo, bhi))
+                continue
+        (i, j) = (alo, blo)
+        for anchor in anchors:
+            found.append(anchor)
+            stack.append((i, anchor[0], j, anchor[1]))
+            i = anchor[0] + anchor[2]
+            j = anchor[1] + anchor[2]
+        stack.append((i, ahi, j, bhi))
+    found.sort()
+    blocks: list[Block] = []
+    for i, j, size in found:
+        if blocks:
+            (pi, pj, psize) = blocks[-1]
+            if pi + psize == i and pj + psize == j:
+                blocks[-1] = (pi, pj, psize + size)
+                continue
+        blocks.append((i, j, size))
+    return blocks
+
+
+def _unique_anchors(
+    a: list[int], b: list[int], alo: int, ahi: int, blo: int, bhi: int
+) -> list[Block]:
+    """
+    Find the lines that occur exactly once in each of the given regions of
+    `a` & `b`, and return the longest sequence of them that appear in the
+    same order in both regions (as in patience diff)
+    """
+    a_pos: dict[int, int] = {}
+    for i in range(alo, ahi):
+        # -1 marks lines that occur more than once
+        a_pos[a[i]] = -1 if a[i] in a_pos else i
+    b_pos: dict[int, int] = {}
+    for j in range(blo, bhi):
+        if a_pos.get(b[j], -1) != -1:
+            b_pos[b[j]] = -1 if b[j] in b_pos else j
+    pairs = sorted((a_pos[line], j) for line, j in b_pos.items() if j != -1)
+    if not pairs:
+        return []
+    # Patience sorting: tails[k] is the index in `pairs` of the smallest
+    # `b` position that ends an increasing run of length k+1
+    tails: list[int] = []
+    tail_js: list[int] = []
+    prev: list[int] = []
+    for n, (_, j) in enumerate(pairs):
+        k = bisect_left(tail_js, j)
+        prev.append(tails[k - 1] if k else -1)
+        if k == len(tails):
+            tails.append(n)
+            tail_js.append(j)
+        else:
+            tails[k] = n
+            tail_js[k] = j
+    anchors: list[Block] = []
+    n = tails[-1]
+    while n != -1:
+        anchors.append((pairs[n][0], pairs[n][1], 1))
+        n = prev[n]
+    anchors.reverse()
+    return anchors
+
+
+def _find_anchor(
+    a: list[int], b: list[int], alo: int, ahi: int, blo: int, bhi: int
+) -> Block | None:
+    """
+    Find the longest run of equal lines in the given regions of `a` & `b`
+    that contains a line occurring in `a`'s region as few times as possible
+    """
+    occurrences: dict[int, list[int]] = {}
+    for i in range(alo, ahi):
+        occurrences.setdefault(a[i], []).append(i)
+    best: Block | None = None
+    best_count = MAX_CHAIN + 1
+    j = blo
+    while j < bhi:
+        positions = occurrences.get(b[j])
+        if positions is None or len(positions) > best_count:
+            j += 1
+            continue
+        next_j = j + 1
+        for i in positions:
+            (si, sj) = (i, j)
+            while si > alo and sj > blo and a[si - 1] == b[sj - 1]:
+                si -= 1
+                sj -= 1
+            (ei, ej) = (i + 1, j + 1)
+            while ei < ahi and ej < bhi and a[ei] == b[ej]:
+                ei += 1
+                ej += 1
+            if best is None or len(positions) < best_count or ei - si > best[2]:
+                best = (si, sj, ei - si)
+                best_count = len(positions)
+            next_j = max(next_j, ej)
+        j = next_j
+    return best
+
+
+def _myers_blocks(
+    a: list[int], b: list[int], alo: int, ahi: int, blo: int, bhi: int
+) -> list[Block]:
+    """
+    Find the runs of equal lines in the given regions of `a` & `b` using
+    Myers' O(ND) algorithm.  If the regions differ by more than `MAX_EDITS`
+    lines, give up and return no matches.
+    """
+    (n, m) = (ahi - alo, bhi - blo)
+    # trace[d][k] is the furthest x reached on diagonal k = x - y with d
+    # edits
+    trace: list[dict[int, int]] = []
+    v = {1: 0}
+    for d in range(min(n + m, MAX_EDITS) + 1):
+        vd: dict[int, int] = {}
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vd[k] = x
+            if x >= n and y >= m:
+                trace.append(vd)
+                return _myers_backtrack(trace, alo, blo, n, m)
+        trace.append(vd)
+        v = vd
+    return []
+
+
+def _myers_backtrack(
+    trace: list[dict[int, int]], alo: int, blo: int, x: int, y: int
+) -> list[Block]:
+    blocks: list[Block] = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d - 1]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+            mid_x = v[prev_k]
+        else:
+            prev_k = k - 1
+            mid_x = v[prev_k] + 1
+        if x > mid_x:
+            blocks.append((alo + mid_x, blo + mid_x - k, x - mid_x))
+        x = v[prev_k]
+        y = x - prev_k
+    if x > 0:
+        blocks.append((alo, blo, x))
+    return blocks
+
+
+def get_opcodes(a: Sequence[str], b: Sequence[str]) -> list[Opcode]:
+    """Describe how to turn `a` into `b` in the manner of `difflib`"""
+    opcodes: list[Opcode] = []
+    i = j = 0
+    for ai, bj, size in [*matching_blocks(a, b), (len(a), len(b), 0)]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        if size:
+            opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i = ai + size
+        j = bj + size
+    return opcodes
+
+
+def count_changes(a: Sequence[str], b: Sequence[str]) -> tuple[int, int]:
+    """
+    Return the number of lines added & removed in turning `a` into `b`
+    without building any hunks
+    """
+    common = sum(size for _, _, size in matching_blocks(a, b))
+    return (len(b) - common, len(a) - common)
+
+
+def grouped_opcodes(opcodes: list[Opcode], n: int = 3) -> Iterator[list[Opcode]]:
+    """
+    Group `opcodes` into hunks with up to `n` lines of context, in the manner
+    of `difflib.SequenceMatcher.get_grouped_opcodes()`
+    """
+    if not opcodes:
+        opcodes = [("equal", 0, 1, 0, 1)]
+    if opcodes[0][0] == "equal":
+        (tag, i1, i2, j1, j2) = opcodes[0]
+        opcodes[0] = (tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2)
+    if opcodes[-1][0] == "equal":
+        (tag, i1, i2, j1, j2) = opcodes[-1]
+        opcodes[-1] = (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n))
+    nn = n + n
+    group: list[Opcode] = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            (i1, j1) = (max(i1, i2 - n), max(j1, j2 - n))
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def unified_diff(
+    a: Sequence[str], b: Sequence[str], fromfile: str, tofile: str, n: int = 3
+) -> Iterator[str]:
+    """
+    Compare two sequences of lines (with line endings attached) and yield the
+    lines of a unified diff between them, formatted the same way as by
+    `difflib.unified_diff()`
+    """
+    started = False
+    for group in grouped_opcodes(get_opcodes(a, b), n):
+        if not started:
+            started = True
+            yield f"--- {fromfile}\n"
+            yield f"+++ {tofile}\n"
+        (first, last) = (group[0], group[-1])
+        old = _format_range(first[1], last[2])
+        new = _format_range(first[3], last[4])
+        yield f"@@ -{old} +{new} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    yield " " + line
+                continue
+            if tag in {"replace", "delete"}:
+                for line in a[i1:i2]:
+                    yield "-" + line
+            if tag in {"replace", "insert"}:
+                for line in b[j1:j2]:
+                    yield "+" + line
+
+
+def _format_range(start: int, stop: int) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
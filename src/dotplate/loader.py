@@ -0,0 +1,29 @@
+from __future__ import annotations
+from collections.abc import Callable
+from jinja2 import BaseLoader, Environment, TemplateNotFound
+from jinja2.loaders import split_template_path
+from .git import RevisionFiles
+
+
+class GitRevisionLoader(BaseLoader):
+    """
+    A Jinja loader that loads templates from the source directory as of a
+    given Git commit rather than from the working tree
+    """
+
+    def __init__(self, revision: RevisionFiles) -> None:
+        self.revision = revision
+
+    def get_source(
+        self, _environment: Environment, template: str
+    ) -> tuple[str, str | None, Callable[[], bool] | None]:
+        path = "/".join(split_template_path(template))
+        data = self.revision.read(path)
+        if data is None:
+            raise TemplateNotFound(template)
+        # Objects in a commit never change, so the template is always up to
+        # date.
+        return (data.decode("utf-8"), f"{self.revision.commit}:{path}", lambda: True)
+
+    def list_templates(self) -> list[str]:
+        return sorted(self.revision.files)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass, field
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+STATE_VERSION = 1
+
+
+@dataclass
+class StateEntry:
+    """
+    A record of a template that was rendered & found to match (or was
+    installed at) a destination path
+    """
+
+    template: str
+    #: Fingerprint of the run-wide context the template was rendered with
+    context: str
+    #: Mapping from the template and every template it (transitively)
+    #: references to the SHA256 of that template's source, or `None` if the
+    #: referenced template did not exist
+    sources: dict[str, str | None]
+    #: Whether the template had its executable bit set
+    executable: bool
+    #: `stat` details of the destination file after installation
+    size: int
+    mtime_ns: int
+    #: SHA256 of the installed file's contents
+    sha256: str
+
+
+@dataclass
+class StateManifest:
+    """
+    A manifest of installed templates, keyed by destination path, used to skip
+    re-rendering templates that are provably unchanged since the last run.
+    Entries may be set & discarded from multiple threads at once.
+    """
+
+    path: Path
+    entries: dict[str, StateEntry] = field(default_factory=dict)
+    dirty: bool = False
+    _lock: threading.Lock = field(
+        init=False, default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @classmethod
+    def load(cls, path: Path) -> StateManifest:
+        try:
+            with path.open("r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") != STATE_VERSION:
+                raise ValueError("Unsupported state version")
+            entries = {k: StateEntry(**v) for k, v in data["entries"].items()}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            # A missing, outdated, or corrupt manifest just means that
+            # nothing can be skipped.
+            return cls(path=path)
+        return cls(path=path, entries=entries)
+
+    def get(self, dest_path: Path) -> StateEntry | None:
+        return self.entries.get(str(dest_path))
+
+    def set(self, dest_path: Path, entry: StateEntry) -> None:
+        with self._lock:
+            self.entries[str(dest_path)] = entry
+            self.dirty = True
+
+    def discard(self, dest_path: Path) -> None:
+        with self._lock:
+            if self.entries.pop(str(dest_path), None) is not None:
+                self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        with self._lock:
+            data = {
+                "version": STATE_VERSION,
+                "entries": {k: asdict(v) for k, v in sorted(self.entries.items())},
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(data, fp, indent=1)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+
+def file_sha256(p: Path) -> str | None:
+    """Return the SHA256 of the file at `p`, or `None` if it does not exist"""
+    h = sha256()
+    try:
+        with p.open("rb") as fp:
+            while chunk := fp.read(65536):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
@@ -0,0 +1,134 @@
+"""
+Lightweight per-phase and per-template timing, used by the ``--profile``
+command-line option
+"""
+
+from __future__ import annotations
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+import json
+import threading
+from time import perf_counter
+from typing import Any
+
+#: The phases in the order in which they're reported
+PHASES = [
+    "config",
+    "discovery",
+    "state",
+    "compile",
+    "render",
+    "diff",
+    "install",
+]
+
+
+class Profiler:
+    """
+    Accumulates the time spent in each phase, overall and per template.  When
+    rendering with multiple worker processes or threads, the workers' timings
+    are summed, so the phase totals can exceed the wall-clock total.  Phases
+    may be timed from multiple threads at once.
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.started = perf_counter()
+        self.phases: defaultdict[str, float] = defaultdict(float)
+        self.templates: defaultdict[str, defaultdict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, template: str | None = None) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                self.phases[name] += elapsed
+                if template is not None:
+                    self.templates[template][name] += elapsed
+
+    def take(self) -> dict[str, Any]:
+        """
+        Return the timings recorded so far as a picklable `dict` (for passing
+        from worker processes to the parent) and reset them
+        """
+        with self._lock:
+            data = {
+                "phases": dict(self.phases),
+                "templates": {t: dict(ph) for t, ph in self.templates.items()},
+            }
+            self.phases.clear()
+            self.templates.clear()
+        return data
+
+    def merge(self, data: dict[str, Any]) -> None:
+        """Add in timings returned by `take()` on another `Profiler`"""
+        with self._lock:
+            for name, secs in data["phases"].items():
+                self.phases[name] += secs
+            for template, phases in data["templates"].items():
+                for name, secs in phases.items():
+                    self.templates[template][name] += secs
+
+    def slowest(self, n: int = 10) -> list[tuple[str, float]]:
+        totals = [(t, sum(ph.values())) for t, ph in self.templates.items()]
+        totals.sort(key=lambda tt: tt[1], reverse=True)
+        return totals[:n]
+
+    def _phase_order(self) -> list[str]:
+        return [p for p in PHASES if p in self.phases] + sorted(
+            set(self.phases) - set(PHASES)
+        )
+
+    def report_json(self, top: int = 10) -> str:
+        data = {
+            "total": perf_counter() - self.started,
+            "phases": {p: self.phases[p] for p in self._phase_order()},
+            "slowest": [
+                {"template": t, "total": secs, "phases": dict(self.templates[t])}
+                for t, secs in self.slowest(top)
+            ],
+            "templates": {t: dict(ph) for t, ph in sorted(self.templates.items())},
+        }
+        return json.dumps(data, indent=2)
+
+    def report_text(self, top: int = 10) -> str:
+        lines = ["Time per phase:"]
+        for p in self._phase_order():
+            lines.append(f"  {p:<10} {self.phases[p]:9.4f}s")
+        lines.append(f"  {'total':<10} {perf_counter() - self.started:9.4f}s")
+        if slowest := self.slowest(top):
+            lines.append(f"Slowest templates (of {len(self.templates)}):")
+            for t, secs in slowest:
+                breakdown = ", ".join(
+                    f"{p} {s:.4f}s" for p, s in self.templates[t].items()
+                )
+                lines.append(f"  {secs:9.4f}s  {t}  ({breakdown})")
+        return "\n".join(lines)
+
+
+class NullProfiler:
+    """A stand-in for `Profiler` that records nothing, at minimal cost"""
+
+    enabled = False
+
+    _null = nullcontext()
+
+    def phase(
+        self, _name: str, _template: str | None = None
+    ) -> AbstractContextManager[None]:
+        return self._null
+
+    def merge(self, _data: dict[str, Any]) -> None:
+        pass
+
+
+#: The profiler used when profiling is disabled
+NULL_PROFILER = NullProfiler()
@@ -1,73 +1,205 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
+from collections.abc import Callable, Iterable, Iterator
+import errno
+from functools import cache
+import os
 from pathlib import Path
+import re
+import shutil
 import stat
 import subprocess
+import sys
+from typing import Any, BinaryIO, NoReturn
 from iterpath import iterpath
 from linesep import split_terminated
+from .git import MODE_GITLINK, READ_ERRORS, GitRepo, tracked_files
 
 
-@dataclass
-class SuiteSet:
-    suites: set[str] = field(default_factory=set)
+class FrozenDict(dict):
+    """
+    A `dict` that cannot be modified.  As it's still a `dict`, it works
+    anywhere that a `dict` does (e.g., with Jinja's ``tojson`` filter).
+    """
+
+    def _readonly(self, *_args: Any, **_kwargs: Any) -> NoReturn:
+        raise TypeError("Cannot modify read-only dict")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self) -> tuple[type[FrozenDict], tuple[dict]]:
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """A `list` that cannot be modified"""
+
+    def _readonly(self, *_args: Any, **_kwargs: Any) -> NoReturn:
+        raise TypeError("Cannot modify read-only list")
 
-    def is_file_active(self, enabled_suites: set[str]) -> bool:
-        return not self.suites or bool(self.suites & enabled_suites)
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
 
+    def __reduce__(self) -> tuple[type[FrozenList], tuple[list]]:
+        return (type(self), (list(self),))
 
-def listdir(dirpath: Path) -> list[str]:
+
+def freeze(obj: Any) -> Any:
+    """
+    Return a deep copy of `obj` in which all dicts, lists, and sets have been
+    replaced by read-only equivalents
+    """
+    if isinstance(obj, FrozenDict | FrozenList | frozenset):
+        return obj
+    elif isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    elif isinstance(obj, list | tuple):
+        return FrozenList(freeze(v) for v in obj)
+    elif isinstance(obj, set):
+        return frozenset(freeze(v) for v in obj)
+    else:
+        return obj
+
+
+def listdir(dirpath: Path, include_staged: bool = False) -> list[str]:
     """
     List the files in `dirpath`, relative to `dirpath` and
     forward-slash-separated.  If `dirpath` is in a Git repository, only files
-    known to Git are returned.
+    known to Git are returned; see `git_files()`.
     """
-    if in_git(dirpath):
-        # TODO: Try to include files staged but not yet committed
-        # (Merge a variant of `git diff --cached --name-status`?)
-        r = subprocess.run(
-            ["git", "ls-tree", "-r", "--name-only", "-z", "HEAD"],
-            cwd=dirpath,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            text=True,
-        )
-        return split_terminated(r.stdout, "\0")
+    files = git_files(dirpath, include_staged=include_staged)
+    if files is not None:
+        return sorted(files)
     else:
-        with iterpath(dirpath, dirs=False, return_relative=True, sort=True) as ip:
-            return [p.as_posix() for p in ip]
+        return walkdir(dirpath)
+
+
+def walkdir(dirpath: Path) -> list[str]:
+    """
+    List all files in `dirpath`, relative to `dirpath` and
+    forward-slash-separated, in sorted order
+    """
+    with iterpath(dirpath, dirs=False, return_relative=True, sort=True) as ip:
+        return [p.as_posix() for p in ip]
 
 
-def in_git(dirpath: Path) -> bool:
-    """Test whether `dirpath` is under Git revision control"""
+def is_normal_relpath(p: str) -> bool:
+    """
+    Test whether `p` is a relative, forward-slash-separated path in the
+    normalized form used for template names, i.e., without any empty, ``.``,
+    or ``..`` components
+    """
+    return not any(part in ("", ".", "..") for part in p.split("/")) and (
+        os.sep == "/" or os.sep not in p
+    )
+
+
+def find_files(dirpath: Path, paths: Iterable[str]) -> list[str]:
+    """
+    Return, in sorted order, those of the given relative,
+    forward-slash-separated `paths` that `walkdir(dirpath)` would list,
+    without listing anything else.  This only needs to examine each path's
+    parent directories, so its cost doesn't depend on the size of `dirpath`.
+    """
+    found = []
+    for p in paths:
+        if not is_normal_relpath(p):
+            continue
+        parts = p.split("/")
+        # `walkdir()` doesn't descend into symlinks to directories, but it
+        # does list them (and all other non-directories) as files:
+        cur = dirpath
+        for part in parts[:-1]:
+            cur /= part
+            try:
+                if not stat.S_ISDIR(cur.lstat().st_mode):
+                    break
+            except OSError:
+                break
+        else:
+            try:
+                if not stat.S_ISDIR((cur / parts[-1]).lstat().st_mode):
+                    found.append(p)
+            except OSError:
+                pass
+    found.sort()
+    return found
+
+
+def git_files(
+    dirpath: Path, include_staged: bool = False, paths: list[str] | None = None
+) -> dict[str, str] | None:
+    """
+    If `dirpath` is tracked by Git, return a `dict` mapping the paths
+    (relative to `dirpath` and forward-slash-separated) of the files under it
+    that are committed to :samp:`HEAD` to their blob object IDs.  If
+    `include_staged` is true, files that are staged but not yet committed are
+    included as well (and files staged for deletion are excluded), with the
+    IDs of the staged blobs.  Submodules are omitted.  If `paths` is given,
+    only those paths are looked up, and only the tracked ones are included.
+
+    If `dirpath` is not tracked by Git, return `None`.
+
+    The Git index & object database are read directly where possible; if the
+    repository uses a feature that dotplate doesn't understand, this falls
+    back to running a single :command:`git` command.
+    """
+    try:
+        repo = GitRepo.find(dirpath)
+        if repo is None:
+            return None
+        return tracked_files(
+            repo, dirpath, include_staged=include_staged, paths=paths
+        )
+    except READ_ERRORS:
+        files = _git_files_subprocess(dirpath, include_staged)
+        if files is not None and paths is not None:
+            files = {p: files[p] for p in paths if p in files}
+        return files
+
+
+def git_state_files(dirpath: Path) -> list[Path]:
+    """
+    If `dirpath` is tracked by Git, return the paths of the files in its
+    repository that are modified whenever something is committed, checked
+    out, staged, or unstaged, and so which must be watched in order to know
+    when the result of `git_files()` may have changed.  Otherwise, return an
+    empty list.
+    """
+    try:
+        repo = GitRepo.find(dirpath)
+    except READ_ERRORS:
+        return []
+    return [] if repo is None else repo.state_files()
+
+
+def _git_files_subprocess(dirpath: Path, include_staged: bool) -> dict[str, str] | None:
+    if include_staged:
+        # Output lines are of the form "<mode> <oid> <stage>\t<path>"
+        cmd = ["git", "ls-files", "--stage", "-z"]
+        oid_field = 1
+    else:
+        # Output lines are of the form "<mode> <type> <oid>\t<path>"
+        cmd = ["git", "ls-tree", "-r", "-z", "HEAD"]
+        oid_field = 2
     try:
         r = subprocess.run(
-            ["git", "rev-parse", "--is-inside-work-tree"],
+            cmd,
             cwd=dirpath,
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
-            text=True,
         )
-        if r.stdout.strip() == "false":
-            # We are inside a .git directory
-            return False
-    except FileNotFoundError:
-        # Git not installed; assume this isn't a Git repository
-        return False
-    except subprocess.CalledProcessError:
-        return False
-    # Check whether `path` is tracked by Git (Note that we can't rely
-    # on this check alone, as it succeeds when inside a .git/ directory)
-    return (
-        subprocess.run(
-            ["git", "ls-files", "--error-unmatch", "."],
-            cwd=dirpath,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        ).returncode
-        == 0
-    )
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        # Either Git isn't installed or this isn't a Git repository
+        return None
+    files = {}
+    for line in split_terminated(os.fsdecode(r.stdout), "\0"):
+        meta, _, path = line.partition("\t")
+        fields = meta.split()
+        if int(fields[0], 8) != MODE_GITLINK:
+            files[path] = fields[oid_field]
+    return files or None
 
 
 def is_executable(p: Path) -> bool:
@@ -87,6 +219,366 @@ def unset_executable_bit(p: Path) -> None:
 
 
 def backup(p: Path, ext: str) -> None:
-    if p.exists():
-        target = p.with_name(p.name + ext)
-        p.replace(target)
+    """
+    Back up the file at `p` (if it exists) to a path with `ext` appended to
+    its name, leaving `p` itself in place so that it can be atomically
+    replaced
+    """
+    if not p.exists() and not p.is_symlink():
+        return
+    target = p.with_name(p.name + ext)
+    tmp = p.with_name(f".{p.name}{ext}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(p, tmp, follow_symlinks=False)
+    except OSError:
+        # Hard links aren't supported everywhere
+        shutil.copy2(p, tmp, follow_symlinks=False)
+    tmp.replace(target)
+
+
+def user_cache_dir() -> Path:
+    """Return the directory in which dotplate should store cached data"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or "~/AppData/Local"
+    elif sys.platform == "darwin":
+        base = "~/Library/Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return Path(base).expanduser() / "dotplate"
+
+
+def streams_equal(fp1: BinaryIO, fp2: BinaryIO, chunk_size: int = 65536) -> bool:
+    """Compare two binary streams chunk by chunk"""
+    while True:
+        b1 = fp1.read(chunk_size)
+        b2 = fp2.read(chunk_size)
+        if b1 != b2:
+            return False
+        if not b1:
+            return True
+
+
+@cache
+def default_file_mode() -> int:
+    """
+    Return the permissions that a newly-created file would have under the
+    current umask
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate a glob pattern matched against forward-slash-separated relative
+    paths into a regular expression.  ``*`` and ``?`` do not match slashes,
+    ``[...]`` matches a single character from a set, and ``**`` matches any
+    number of directories, so that ``**/*.png`` matches PNG files at any
+    depth and ``fonts/**`` matches everything under :file:`fonts/`.  A
+    wildcard character can be matched literally by putting it in brackets,
+    e.g., ``[[]`` matches a literal ``[``.
+    """
+    parts: list[str] = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            chars = pattern[i + 1 : end]
+            negate = chars.startswith("!")
+            if negate:
+                chars = chars[1:]
+            for c in "\\^[":
+                chars = chars.replace(c, "\\" + c)
+            parts.append(f"[{'^/' if negate else ''}{chars}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+def glob_matcher(patterns: list[str]) -> Callable[[str], bool]:
+    """
+    Return a function that tests whether a relative path matches any of the
+    given glob patterns (see `glob_to_regex()`), with all of the patterns
+    compiled into a single regular expression
+    """
+    if not patterns:
+        return lambda _: False
+    rgx = re.compile("|".join(f"(?:{glob_to_regex(p)})" for p in patterns))
+    return lambda path: rgx.fullmatch(path) is not None
+
+
+def is_glob(entry: str) -> bool:
+    """
+    Test whether a suite file list entry is a pattern (a glob or a directory
+    prefix ending in a slash) rather than an exact path
+    """
+    return entry.endswith("/") or any(c in entry for c in "*?[")
+
+
+class SuiteMatcher:
+    """
+    Determines which suites each template belongs to, given a mapping from
+    suite names to lists of exact paths, glob patterns (see `glob_to_regex()`),
+    and directory prefixes ending in a slash.  Sets of suites are represented
+    as bitmasks, with the suites assigned bits in the order of the mapping;
+    see `bits`.
+
+    Exact paths are looked up in a `dict`.  Glob patterns are added to the
+    `dict` as well so that they also match the path they spell out
+    literally, letting paths that happen to contain wildcard characters (like
+    ``foo[1].conf``) be listed as-is.  Patterns are grouped by the directory
+    prefix before their first wildcard, and the patterns in each group are
+    compiled into a single regular expression containing an optional
+    lookahead for each suite, so that one match finds every suite with a
+    pattern in the group that matches.  Looking up a template thus
+    only involves matching against the groups for the directories that
+    contain it, regardless of how many patterns there are in total.
+    """
+
+    def __init__(self, suite_files: dict[str, list[str]]) -> None:
+        #: Mapping from suite names to their bits
+        self.bits: dict[str, int] = {
+            name: 1 << i for i, name in enumerate(suite_files)
+        }
+        self.exact: dict[str, int] = {}
+        grouped: dict[str, dict[str, list[str]]] = {}
+        for name, files in suite_files.items():
+            for entry in files:
+                if not entry.endswith("/"):
+                    self.exact[entry] = self.exact.get(entry, 0) | self.bits[name]
+                if is_glob(entry):
+                    if entry.endswith("/"):
+                        entry += "**"
+                    prefix = _literal_dir_prefix(entry)
+                    grouped.setdefault(prefix, {}).setdefault(name, []).append(
+                        glob_to_regex(entry)
+                    )
+        #: Mapping from directory prefixes (with trailing slashes, or the
+        #: empty string for the top level) to compiled regexes & the bits of
+        #: the suites corresponding to their groups
+        self.groups: dict[str, tuple[re.Pattern[str], list[int]]] = {}
+        for prefix, suites in grouped.items():
+            rgx = "".join(
+                f"(?:(?=(?:{'|'.join(rxs)})\\Z)())?" for rxs in suites.values()
+            )
+            self.groups[prefix] = (
+                re.compile(rgx),
+                [self.bits[name] for name in suites],
+            )
+
+    def __getitem__(self, path: str) -> int:
+        """Return the bitmask of the suites that `path` belongs to"""
+        mask = self.exact.get(path, 0)
+        if self.groups:
+            i = 0
+            while i != -1:
+                if (group := self.groups.get(path[:i])) is not None:
+                    (rgx, bits) = group
+                    # Every part of the regex is optional, so it always
+                    # matches; a suite's group is only set if its lookahead
+                    # succeeded.
+                    if (m := rgx.match(path)) is not None:
+                        for bit, g in zip(bits, m.groups(), strict=True):
+                            if g is not None:
+                                mask |= bit
+                i = path.find("/", i) + 1 or -1
+        return mask
+
+
+def _literal_dir_prefix(pattern: str) -> str:
+    """
+    Return the leading directory components of `pattern` (with a trailing
+    slash) that do not contain any wildcards
+    """
+    m = re.search(r"[*?\[]", pattern)
+    head = pattern if m is None else pattern[: m.start()]
+    return head[: head.rfind("/") + 1]
+
+
+class TemplateTable:
+    """
+    A compact table of the templates in a source directory and the suites
+    they belong to, meant to stay small & fast with very many templates.
+    Paths are interned and kept in sorted order, each template's suites are
+    stored as a bitmask (see `SuiteMatcher`), and a `dict` maps each path to
+    its row.  A template with no suites is always active; otherwise, it's
+    active if its mask has a bit in common with the mask of enabled suites
+    (see `suite_mask()`).
+    """
+
+    __slots__ = ("paths", "masks", "index", "bits")
+
+    def __init__(self, paths: Iterable[str], matcher: SuiteMatcher) -> None:
+        #: The template paths, in sorted order
+        self.paths: list[str] = sorted(map(sys.intern, paths))
+        # Templates with the same suites share a single mask object:
+        canon: dict[int, int] = {}
+        #: The suite bitmask for each path
+        self.masks: list[int] = [
+            canon.setdefault(m, m) for m in map(matcher.__getitem__, self.paths)
+        ]
+        #: Mapping from paths to their indices in `paths` & `masks`
+        self.index: dict[str, int] = {p: i for i, p in enumerate(self.paths)}
+        #: Mapping from suite names to their bits
+        self.bits: dict[str, int] = matcher.bits
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __contains__(self, path: object) -> bool:
+        return path in self.index
+
+    def suite_mask(self, suites: Iterable[str]) -> int:
+        """
+        Return the bitmask for the given suite names, ignoring any that are
+        not defined
+        """
+        mask = 0
+        for name in suites:
+            mask |= self.bits.get(name, 0)
+        return mask
+
+    def is_active(self, path: str, enabled: int) -> bool:
+        """
+        Test whether the template at `path` is active when the suites in the
+        mask `enabled` are enabled.
+
+        :raises KeyError: if there is no such template
+        """
+        mask = self.masks[self.index[path]]
+        return not mask or bool(mask & enabled)
+
+    def active(self, enabled: int) -> list[str]:
+        """
+        Return the paths of the templates that are active when the suites in
+        the mask `enabled` are enabled, in sorted order
+        """
+        return [
+            p for p, mask in zip(self.paths, self.masks) if not mask or mask & enabled
+        ]
+
+
+#: How many bytes to ask the kernel to copy at a time
+COPY_CHUNK_SIZE = 1 << 30
+
+#: The ``FICLONE`` ioctl on Linux
+FICLONE = 0x40049409
+
+#: Errors indicating that a method of copying isn't supported for the given
+#: files (including by a seccomp filter), as opposed to an actual I/O error
+_UNSUPPORTED_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EXDEV,
+}
+
+
+class _KernelCopyUnsupported(Exception):
+    pass
+
+
+def copy_fd(src: int, dst: int) -> None:
+    """
+    Copy the rest of the file open on file descriptor `src` to file
+    descriptor `dst`, letting the kernel do the copying when possible.  In
+    order of preference, the file is cloned (reflinked) on filesystems that
+    support it, copied with :func:`os.copy_file_range`, or copied with
+    :func:`os.sendfile`; failing all that, it's read & written in chunks.
+    Cloning & :func:`os.copy_file_range` are only tried when `dst` is a
+    regular file, so that `dst` can also be, e.g., a pipe.
+    """
+    copiers: tuple[Callable[[int, int], None], ...] = (_sendfile,)
+    if stat.S_ISREG(os.fstat(dst).st_mode):
+        if _try_reflink(src, dst):
+            return
+        copiers = (_copy_file_range, _sendfile)
+    for copier in copiers:
+        try:
+            copier(src, dst)
+        except _KernelCopyUnsupported:
+            continue
+        return
+    with open(src, "rb", closefd=False) as fsrc, open(dst, "wb", closefd=False) as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _try_reflink(src: int, dst: int) -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    # Clones always replace the whole destination with the whole source, so
+    # only use one if copying from the start to the start:
+    try:
+        if os.lseek(src, 0, os.SEEK_CUR) != 0 or os.lseek(dst, 0, os.SEEK_CUR) != 0:
+            return False
+    except OSError as e:
+        if e.errno in (errno.ESPIPE, errno.EINVAL):
+            # Not seekable, and so not cloneable
+            return False
+        raise
+    try:
+        fcntl.ioctl(dst, FICLONE, src)
+    except OSError:
+        return False
+    os.lseek(src, 0, os.SEEK_END)
+    os.lseek(dst, 0, os.SEEK_END)
+    return True
+
+
+def _copy_file_range(src: int, dst: int) -> None:
+    if not hasattr(os, "copy_file_range"):
+        raise _KernelCopyUnsupported()
+    copied = 0
+    while True:
+        try:
+            n = os.copy_file_range(src, dst, COPY_CHUNK_SIZE)
+        except OSError as e:
+            if copied == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                raise _KernelCopyUnsupported()
+            raise
+        if n == 0:
+            return
+        copied += n
+
+
+def _sendfile(src: int, dst: int) -> None:
+    if not hasattr(os, "sendfile") or sys.platform == "darwin":
+        # macOS only supports sending to sockets
+        raise _KernelCopyUnsupported()
+    offset = os.lseek(src, 0, os.SEEK_CUR)
+    start = offset
+    while True:
+        try:
+            n = os.sendfile(dst, src, offset, COPY_CHUNK_SIZE)
+        except OSError as e:
+            if offset == start and e.errno in _UNSUPPORTED_ERRNOS:
+                raise _KernelCopyUnsupported()
+            raise
+        if n == 0:
+            break
+        offset += n
+    os.lseek(src, offset, os.SEEK_SET)
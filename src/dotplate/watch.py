@@ -0,0 +1,489 @@
+"""
+Watching the source directory & config files for changes, and re-rendering
+just the templates affected by each change
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Iterator
+import ctypes
+import errno
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import time
+from types import TracebackType
+from .dotplate import BaseRenderedFile, Dotplate
+from .errors import RenderError, TemplateNotFound
+from .util import git_state_files
+
+# Constants from <sys/inotify.h>:
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def abspath(p: str | Path) -> Path:
+    return Path(os.path.abspath(p))
+
+
+def walk_dirs(root: Path) -> Iterator[Path]:
+    """Yield `root` and all directories under it, skipping :file:`.git`"""
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        yield Path(dirpath)
+
+
+def walk_files(root: Path) -> Iterator[Path]:
+    """Yield all files under `root`, skipping :file:`.git`"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".git"]
+        for f in filenames:
+            yield Path(dirpath, f)
+
+
+class Watcher(ABC):
+    """
+    Watches a directory tree (excluding any :file:`.git` directories) plus a
+    set of individual files for changes.  All reported paths are absolute.
+    """
+
+    def __init__(self, tree: Path) -> None:
+        self.tree = abspath(tree)
+        self.files: set[Path] = set()
+
+    def __enter__(self) -> Watcher:
+        return self
+
+    def __exit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    @abstractmethod
+    def add_file(self, path: Path) -> None:
+        """Start watching the given file, which need not exist yet"""
+        ...
+
+    @abstractmethod
+    def wait(self, timeout: float | None = None) -> set[Path] | None:
+        """
+        Wait up to `timeout` seconds (default: forever) for changes and return
+        the paths of the files that were created, modified, or deleted.  An
+        empty set is returned on timeout.  `None` is returned if the watcher
+        may have missed some changes, in which case everything should be
+        assumed to have changed.
+        """
+        ...
+
+    def close(self) -> None:  # noqa: B027
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    A `Watcher` that periodically compares the :func:`os.stat` details of
+    every watched file against those from the previous check
+    """
+
+    def __init__(
+        self, tree: Path, files: Iterable[Path] = (), interval: float = 0.5
+    ) -> None:
+        super().__init__(tree)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        for f in files:
+            self.add_file(f)
+
+    def add_file(self, path: Path) -> None:
+        path = abspath(path)
+        self.files.add(path)
+        if (st := _stamp(path)) is not None:
+            self._snapshot[path] = st
+
+    def _take_snapshot(self) -> dict[Path, tuple[int, ...]]:
+        snapshot = {}
+        for p in [*walk_files(self.tree), *self.files]:
+            if (st := _stamp(p)) is not None:
+                snapshot[p] = st
+        return snapshot
+
+    def wait(self, timeout: float | None = None) -> set[Path] | None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = max(0, min(delay, deadline - time.monotonic()))
+            time.sleep(delay)
+            old = self._snapshot
+            self._snapshot = new = self._take_snapshot()
+            changed = {p for p in old.keys() | new.keys() if old.get(p) != new.get(p)}
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def _stamp(p: Path) -> tuple[int, ...] | None:
+    try:
+        st = p.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_mode, st.st_ino)
+
+
+class InotifyWatcher(Watcher):
+    """
+    A `Watcher` that uses Linux's inotify API, via :mod:`ctypes`.  Every
+    directory in the tree gets its own watch, and individual files are
+    watched via their parent directories so that files replaced by renaming
+    (as many editors do) are still noticed.
+
+    :raises OSError: if inotify is not available or too many watches are in
+        use
+    """
+
+    def __init__(
+        self, tree: Path, files: Iterable[Path] = (), settle: float = 0.02
+    ) -> None:
+        super().__init__(tree)
+        #: After the first event is received, keep collecting events until
+        #: none arrive for this many seconds, so that multi-step saves are
+        #: reported as a single change
+        self.settle = settle
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise _errno_error()
+        # Mapping from watch descriptors to watched directories:
+        self._wds: dict[int, Path] = {}
+        # Watch descriptors for directories in the tree:
+        self._tree_wds: set[int] = set()
+        # Names of individually-watched files, keyed by the descriptor for
+        # their parent directory:
+        self._filenames: defaultdict[int, set[str]] = defaultdict(set)
+        try:
+            for d in walk_dirs(self.tree):
+                self._add_dir(d, in_tree=True)
+            for f in files:
+                self.add_file(f)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_dir(self, path: Path, in_tree: bool) -> int | None:
+        wd: int = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), WATCH_MASK
+        )
+        if wd < 0:
+            e = _errno_error()
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                # Removed before we got to it
+                return None
+            raise e
+        self._wds[wd] = path
+        if in_tree:
+            self._tree_wds.add(wd)
+        return wd
+
+    def add_file(self, path: Path) -> None:
+        path = abspath(path)
+        self.files.add(path)
+        if (wd := self._add_dir(path.parent, in_tree=False)) is not None:
+            self._filenames[wd].add(path.name)
+
+    def _forget(self, wd: int) -> None:
+        self._wds.pop(wd, None)
+        self._tree_wds.discard(wd)
+        self._filenames.pop(wd, None)
+
+    def _unwatch_under(self, path: Path) -> None:
+        for wd, d in list(self._wds.items()):
+            if wd in self._tree_wds and d.is_relative_to(path):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._forget(wd)
+
+    def _read_events(self) -> Iterator[tuple[int, int, str]]:
+        data = os.read(self._fd, 65536)
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+            pos += length
+            yield (wd, mask, name)
+
+    def wait(self, timeout: float | None = None) -> set[Path] | None:
+        changed: set[Path] = set()
+        overflow = False
+        delay = timeout
+        while select.select([self._fd], [], [], delay)[0]:
+            for wd, mask, name in self._read_events():
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & IN_IGNORED:
+                    self._forget(wd)
+                elif (d := self._wds.get(wd)) is None or not name:
+                    continue
+                elif wd not in self._tree_wds:
+                    if name in self._filenames.get(wd, ()):
+                        changed.add(d / name)
+                elif name == ".git":
+                    continue
+                elif not mask & IN_ISDIR:
+                    changed.add(d / name)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been created in the new directory before
+                    # we started watching it, so report everything in it
+                    for sub in walk_dirs(d / name):
+                        self._add_dir(sub, in_tree=True)
+                    changed.update(walk_files(d / name))
+                elif mask & IN_MOVED_FROM:
+                    # We don't know what was in the directory, and its
+                    # watches would report the wrong paths from now on
+                    self._unwatch_under(d / name)
+                    overflow = True
+                # Deleted directories need no handling, as their contents
+                # were reported as deleted first
+            delay = self.settle
+        return None if overflow else changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _errno_error() -> OSError:
+    e = ctypes.get_errno()
+    return OSError(e, os.strerror(e))
+
+
+def make_watcher(
+    tree: Path, files: Iterable[Path] = (), poll: bool = False, interval: float = 0.5
+) -> Watcher:
+    """
+    Return an `InotifyWatcher` if possible; otherwise, or if `poll` is true,
+    return a `PollingWatcher` that checks for changes every `interval`
+    seconds
+    """
+    files = list(files)
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(tree, files)
+        except OSError:
+            pass
+    return PollingWatcher(tree, files, interval=interval)
+
+
+class WatchSession:
+    """
+    Keeps a `Dotplate` instance (and thus its Jinja environment) warm between
+    changes to the source directory & config files, re-rendering & diffing
+    (or installing) just the templates affected by each change.
+
+    A change to a template affects that template plus every template that
+    (transitively) includes, imports, or extends it, as recorded in
+    `Dotplate.dependency_graph`.  The changed template is dropped from the
+    Jinja environment's cache so that it is recompiled even if
+    ``jinja.auto_reload`` is off.  A change to a config file causes it to be
+    reloaded with `reload`, after which everything is processed again.  If
+    the source directory is tracked by Git, changes to the repository's
+    ``HEAD``, index, or refs (from commits, checkouts, ``git add``, etc.)
+    cause the templates to be rediscovered, and any templates that became
+    active or inactive as a result are processed along with everything that
+    depends on them.
+    """
+
+    def __init__(
+        self,
+        dotplate: Dotplate,
+        reload: Callable[[], Dotplate],
+        config_files: Iterable[Path],
+        install: bool = False,
+        on_result: Callable[[BaseRenderedFile], None] | None = None,
+        on_error: Callable[[str], None] | None = None,
+    ) -> None:
+        self.dotplate = dotplate
+        self.reload = reload
+        self.install = install
+        #: Called with each rendered file that differs from its destination
+        #: (before it is installed) or, in install mode, that was installed
+        self.on_result = on_result
+        #: Called with the message for each rendering or config error
+        self.on_error = on_error
+        self._config_files = {abspath(p) for p in config_files}
+
+    def config_files(self) -> set[Path]:
+        files = set(self._config_files)
+        if (local := self.dotplate.cfg.core.local_config) is not None:
+            files.add(abspath(local))
+        return files
+
+    def git_files(self) -> set[Path]:
+        """
+        Return the files in the source directory's Git repository (if any)
+        that record which files are tracked
+        """
+        if self.dotplate.revision is not None:
+            return set()
+        return {abspath(p) for p in git_state_files(self.dotplate.src)}
+
+    def watched_files(self) -> set[Path]:
+        """
+        Return the individual files outside of the source tree that need to
+        be watched
+        """
+        return self.config_files() | self.git_files()
+
+    def run(self, watcher: Watcher) -> None:
+        """Process all active templates and then every change forever"""
+        self.start()
+        while True:
+            self.handle(watcher.wait())
+            for p in self.watched_files() - watcher.files:
+                watcher.add_file(p)
+
+    def start(self) -> None:
+        """Process all active templates, as the ``diff`` or ``install`` would"""
+        templates = self.dotplate.templates()
+        # Parse everything now so that later changes are handled quickly:
+        self.dotplate.dependency_graph.build()
+        self.sync(templates, skip_unchanged=True)
+
+    def handle(self, changes: set[Path] | None) -> None:
+        """
+        Process the changes reported by `Watcher.wait()`, where `None` means
+        that anything may have changed
+        """
+        templates = self.refresh(changes)
+        if templates is None:
+            self.start()
+        elif templates:
+            self.sync(templates)
+
+    def refresh(self, changes: set[Path] | None) -> list[str] | None:
+        """
+        Bring the `Dotplate` instance up to date with the changes reported by
+        `Watcher.wait()` without rendering anything, and return the active
+        templates that are affected.  If the config was reloaded, so that
+        everything is affected, return `None`.
+        """
+        if changes is None or changes & self.config_files():
+            return None if self.reload_config() else []
+        return self.affected(changes)
+
+    def reload_config(self) -> bool:
+        """Reload the config, returning `False` if it's invalid"""
+        try:
+            dotplate = self.reload()
+        except Exception as e:
+            # Probably a half-finished edit; keep using the old config until
+            # it's fixed
+            self._error(f"Failed to reload config: {type(e).__name__}: {e}")
+            return False
+        self.dotplate = dotplate
+        return True
+
+    def affected(self, changes: set[Path]) -> list[str]:
+        """
+        Return the active templates affected by changes to the given paths,
+        in sorted order
+        """
+        src = abspath(self.dotplate.src)
+        dest = abspath(self.dotplate.dest)
+        changed: set[str] = set()
+        retracked: set[str] = set()
+        if changes & (git_files := self.git_files()):
+            before = set(self.dotplate.templates())
+            self.dotplate.rediscover()
+            retracked = before ^ set(self.dotplate.templates())
+            changes = changes - git_files
+        rediscover = False
+        for p in changes:
+            if not p.is_relative_to(src) or p.is_relative_to(dest) or p.is_dir():
+                continue
+            name = p.relative_to(src).as_posix()
+            try:
+                self.dotplate.is_active(name)
+            except TemplateNotFound:
+                known = False
+            else:
+                known = True
+            if known != p.exists():
+                rediscover = True
+            changed.add(name)
+        if not changed and not retracked:
+            return []
+        if rediscover:
+            self.dotplate.rediscover()
+        self.dotplate.forget_compiled(changed | retracked)
+        graph = self.dotplate.dependency_graph
+        for name in changed:
+            graph.forget(name)
+        changed |= retracked
+        affected = changed | graph.dependents(changed)
+        return [t for t in self.dotplate.templates() if t in affected]
+
+    def sync(self, templates: list[str], skip_unchanged: bool = False) -> None:
+        """Render & diff (or install) the given templates"""
+        dp = self.dotplate
+        dp.refresh_executables()
+        try:
+            if self.install:
+                with dp.installer(on_install=self.on_result) as installer:
+                    for f in dp.render_many(templates, skip_unchanged=skip_unchanged):
+                        if isinstance(f, RenderError):
+                            self._error(str(f))
+                            continue
+                        try:
+                            if f.diff():
+                                with dp.profiler.phase("install", f.template):
+                                    installer.install(f)
+                            else:
+                                dp.record_state(f)
+                        finally:
+                            f.discard()
+            else:
+                for f in dp.render_many(templates, skip_unchanged=skip_unchanged):
+                    if isinstance(f, RenderError):
+                        self._error(str(f))
+                        continue
+                    try:
+                        if f.diff() and self.on_result is not None:
+                            self.on_result(f)
+                    finally:
+                        f.discard()
+        finally:
+            dp.save_state()
+
+    def _error(self, msg: str) -> None:
+        if self.on_error is not None:
+            self.on_error(msg)
@@ -3,8 +3,10 @@ from dataclasses import dataclass
 import json
 from pathlib import Path
 import shutil
+import subprocess
 import pytest
 from pytest_mock import MockerFixture
+from dotplate.jinja_ext import ExecutableIndex
 
 DATA_DIR = Path(__file__).with_name("data")
 
@@ -58,5 +60,31 @@ def casedirs(
     shutil.copytree(casedir / "src", src, dirs_exist_ok=True)
     if (specfile := (casedir / "which-mock.json")).exists():
         spec = json.loads(specfile.read_text(encoding="utf-8"))
-        mocker.patch("shutil.which", side_effect=spec.__getitem__)
+        mocker.patch.object(
+            ExecutableIndex,
+            "which",
+            autospec=True,
+            side_effect=lambda _self, cmd: spec[cmd],
+        )
     return CaseDirs(src=src, dest=casedir / "dest")
+
+
+def git(repo: Path, *args: str, stdin: str | None = None) -> str:
+    r = subprocess.run(
+        [
+            "git",
+            "-c",
+            "user.name=Dotplate Tests",
+            "-c",
+            "user.email=tests@example.nil",
+            "-c",
+            "init.defaultBranch=main",
+            *args,
+        ],
+        cwd=repo,
+        check=True,
+        input=stdin,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return r.stdout.strip()
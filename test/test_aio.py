@@ -0,0 +1,138 @@
+from __future__ import annotations
+import asyncio
+from contextlib import aclosing
+from pathlib import Path
+from jinja2 import UndefinedError
+import pytest
+from dotplate import Dotplate, RenderError, StreamedFile
+from dotplate.__main__ import main
+from dotplate.timing import Profiler
+
+
+@pytest.fixture
+def srcdir(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text(
+        "[core]\n"
+        'dest = "../dest"\n'
+        'state-file = "../state.json"\n'
+        "[vars]\n"
+        'name = "World"\n',
+        encoding="utf-8",
+    )
+    (src / "_greet").write_text("Hello, {{ dotplate.vars.name }}!", encoding="utf-8")
+    for i in range(20):
+        (src / f"file{i:02d}.txt").write_text(
+            f'{{% include "_greet" %}} #{i}\n', encoding="utf-8"
+        )
+    (src / "bin").mkdir()
+    (src / "bin" / "run").write_text("#!/bin/sh\n", encoding="utf-8")
+    (src / "bin" / "run").chmod(0o755)
+    return src
+
+
+async def collect(
+    dp: Dotplate, skip_unchanged: bool = False, stream: bool = False
+) -> list[str]:
+    results: list[str] = []
+    async for f in dp.arender_many(
+        concurrency=4, skip_unchanged=skip_unchanged, stream=stream
+    ):
+        assert not isinstance(f, RenderError)
+        assert f.diff()
+        results.append(f.template)
+        f.discard()
+    return results
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_arender_many_order(srcdir: Path, stream: bool) -> None:
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert asyncio.run(collect(dp, stream=stream)) == dp.templates()
+
+
+def test_ainstall(srcdir: Path) -> None:
+    dest = srcdir.parent / "dest"
+    dest.mkdir()
+    (dest / "file03.txt").write_text("Old\n", encoding="utf-8")
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    asyncio.run(dp.ainstall(concurrency=4))
+    assert (dest / "file03.txt").read_text(encoding="utf-8") == "Hello, World! #3\n"
+    assert (dest / "file03.txt.dotplate.bak").read_text(encoding="utf-8") == "Old\n"
+    assert (dest / "file19.txt").read_text(encoding="utf-8") == "Hello, World! #19\n"
+    assert (dest / "bin" / "run").stat().st_mode & 0o111 == 0o111
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert asyncio.run(collect(dp, skip_unchanged=True)) == []
+
+
+def test_ainstall_shared_state(srcdir: Path) -> None:
+    # The worker threads record timings, state entries, and template
+    # references in structures shared between them.
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    dp.profiler = profiler = Profiler()
+    asyncio.run(dp.ainstall(concurrency=8))
+    templates = dp.templates()
+    assert sorted(profiler.templates) == templates
+    assert all("install" in phases for phases in profiler.templates.values())
+    assert dp.state is not None
+    assert len(dp.state.entries) == len(templates)
+    assert dp.dependents("_greet") == [t for t in templates if t.startswith("file")]
+
+
+@pytest.mark.parametrize("transactional", [False, True])
+def test_ainstall_error(srcdir: Path, transactional: bool) -> None:
+    (srcdir / "file10.txt").write_text("{{ nope() }}\n", encoding="utf-8")
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    with pytest.raises(UndefinedError):
+        asyncio.run(dp.ainstall(concurrency=4, transactional=transactional))
+    assert not (srcdir.parent / "dest").exists()
+
+
+def test_arender_many_stop_early(srcdir: Path) -> None:
+    dest = srcdir.parent / "dest"
+    dest.mkdir()
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    seen: list[StreamedFile] = []
+
+    async def first() -> None:
+        async with aclosing(dp.arender_many(concurrency=2, stream=True)) as files:
+            async for f in files:
+                assert isinstance(f, StreamedFile)
+                seen.append(f)
+                break
+
+    asyncio.run(first())
+    assert len(seen) == 1
+    assert seen[0].path.parent == dest
+    seen[0].discard()
+    # The temporary files for the other templates were cleaned up:
+    assert list(dest.iterdir()) == []
+
+
+def test_cli_concurrency(srcdir: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    cfg = str(srcdir / "dotplate.toml")
+    assert main(["-c", cfg, "--no-daemon", "diff", "--name-only"]) == 0
+    expected = capsys.readouterr().out
+    argv = ["-c", cfg, "--no-daemon", "diff", "--name-only", "--concurrency", "3"]
+    assert main(argv) == 0
+    assert capsys.readouterr().out == expected
+    argv = ["-c", cfg, "--no-daemon", "install", "--yes", "--concurrency", "3"]
+    assert main(argv) == 0
+    dest = srcdir / ".." / "dest"
+    assert sorted(capsys.readouterr().out.splitlines()) == sorted(
+        f"Installed {t} at {dest / t}" for t in expected.splitlines()
+    )
+    argv = ["-c", cfg, "--no-daemon", "diff", "--concurrency", "3"]
+    assert main(argv) == 0
+    assert capsys.readouterr().out == ""
+
+
+def test_cli_jobs_and_concurrency(
+    srcdir: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    cfg = str(srcdir / "dotplate.toml")
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-c", cfg, "diff", "-j", "2", "--concurrency", "3"])
+    assert excinfo.value.code == 2
+    assert "not allowed with argument" in capsys.readouterr().err
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+from dotplate import Dotplate
+from dotplate.bccache import DotplateBytecodeCache
+
+
+def cache_files(cachedir: Path) -> list[Path]:
+    return sorted(cachedir.glob("__dotplate_*.cache"))
+
+
+def write_config(src: Path, jinja_settings: str = "") -> Path:
+    cfgpath = src / "dotplate.toml"
+    cfgpath.write_text(
+        "[core]\n"
+        'dest = "dest"\n'
+        "\n"
+        "[jinja]\n"
+        f"{jinja_settings}"
+        "\n"
+        "[jinja.bytecode-cache]\n"
+        'directory = "cache"\n',
+        encoding="utf-8",
+    )
+    return cfgpath
+
+
+def test_bytecode_cache_reuse(tmp_path: Path) -> None:
+    (tmp_path / "foo.txt").write_text("Hello, {{ 'world' }}!\n", encoding="utf-8")
+    cfgpath = write_config(tmp_path)
+    dp = Dotplate.from_config_file(cfgpath)
+    assert dp.render("foo.txt").content == "Hello, world!\n"
+    (entry,) = cache_files(tmp_path / "cache")
+    # Make the cache entry look old so that reuse can be detected:
+    os.utime(entry, ns=(0, 0))
+    dp = Dotplate.from_config_file(cfgpath)
+    assert dp.render("foo.txt").content == "Hello, world!\n"
+    assert cache_files(tmp_path / "cache") == [entry]
+    assert entry.stat().st_mtime_ns != 0
+
+
+def test_bytecode_cache_settings_change(tmp_path: Path) -> None:
+    (tmp_path / "foo.txt").write_text("Hello, {{ 'world' }}!\n", encoding="utf-8")
+    cfgpath = write_config(tmp_path)
+    dp = Dotplate.from_config_file(cfgpath)
+    assert dp.render("foo.txt").content == "Hello, world!\n"
+    assert len(cache_files(tmp_path / "cache")) == 1
+    write_config(tmp_path, 'variable-start-string = "<<"\n')
+    dp = Dotplate.from_config_file(cfgpath)
+    assert dp.render("foo.txt").content == "Hello, {{ 'world' }}!\n"
+    assert len(cache_files(tmp_path / "cache")) == 2
+
+
+def test_prune_lru(tmp_path: Path) -> None:
+    for i in range(5):
+        p = tmp_path / f"__dotplate_{i}.cache"
+        p.write_bytes(b"x" * 10)
+        os.utime(p, ns=(i * 10**9, i * 10**9))
+    (tmp_path / "unrelated.txt").write_bytes(b"x" * 100)
+    DotplateBytecodeCache(tmp_path, salt="", max_size=25)
+    assert [p.name for p in cache_files(tmp_path)] == [
+        "__dotplate_3.cache",
+        "__dotplate_4.cache",
+    ]
+    assert (tmp_path / "unrelated.txt").exists()
+
+
+def test_prune_clear(tmp_path: Path) -> None:
+    for i in range(5):
+        (tmp_path / f"__dotplate_{i}.cache").write_bytes(b"x" * 10)
+    DotplateBytecodeCache(tmp_path, salt="", max_size=25, eviction="clear")
+    assert cache_files(tmp_path) == []
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+from conftest import CaseDirs
+import pytest
+from pytest_mock import MockerFixture
+from dotplate import Config
+from dotplate.cfgcache import CACHE_ENVVAR
+
+
+def bump(p: Path, text: str) -> None:
+    st = p.stat()
+    p.write_text(text)
+    # Make sure the change is visible even on filesystems with coarse
+    # timestamps:
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.usecase("multisuite")
+def test_config_cache(
+    mocker: MockerFixture, tmp_home: Path, casedirs: CaseDirs
+) -> None:
+    cfgfile = casedirs.src / "dotplate.toml"
+    localfile = tmp_home / "local.toml"
+    cfgfile.write_text(
+        "[core]\n"
+        'dest = "~"\n'
+        f"local-config = {str(localfile)!r}\n"
+        "\n"
+        "[suites.bar]\n"
+        'files = ["bar.txt"]\n'
+        "\n"
+        "[vars]\n"
+        "foo = 1\n"
+    )
+    spy = mocker.spy(Config, "from_file")
+    cfg1 = Config.load(cfgfile, use_cache=True)
+    assert spy.call_count == 1
+    assert cfg1.vars == {"foo": 1}
+    assert cfg1._exclude_config_path == "dotplate.toml"
+    cfg2 = Config.load(cfgfile, use_cache=True)
+    assert spy.call_count == 1
+    assert cfg2 == cfg1
+    assert cfg2 is not cfg1
+    assert cfg2._exclude_config_path == "dotplate.toml"
+    # Creating the local config invalidates the cache:
+    localfile.write_text("[local]\nenabled-suites = ['bar']\n\n[vars]\nfoo = 2\n")
+    cfg3 = Config.load(cfgfile, use_cache=True)
+    assert spy.call_count == 2
+    assert cfg3.default_suites() == {"bar"}
+    assert cfg3.vars == {"foo": 2}
+    assert Config.load(cfgfile, use_cache=True) == cfg3
+    assert spy.call_count == 2
+    # As does modifying the main config:
+    bump(cfgfile, cfgfile.read_text().replace("foo = 1", "foo = 1\nbar = 3"))
+    cfg4 = Config.load(cfgfile, use_cache=True)
+    assert spy.call_count == 3
+    assert cfg4.vars == {"foo": 2, "bar": 3}
+    # Without the cache, the file is always read:
+    Config.load(cfgfile)
+    assert spy.call_count == 4
+
+
+@pytest.mark.usecase("multisuite")
+def test_config_cache_envvar(
+    monkeypatch: pytest.MonkeyPatch,
+    mocker: MockerFixture,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.setenv(CACHE_ENVVAR, "1")
+    cfgfile = casedirs.src / "dotplate.toml"
+    spy = mocker.spy(Config, "from_file")
+    Config.load(cfgfile)
+    Config.load(cfgfile)
+    assert spy.call_count == 1
+    assert list((tmp_home / ".cache" / "dotplate" / "config").iterdir())
+
+
+@pytest.mark.usecase("multisuite")
+@pytest.mark.usefixtures("tmp_home")
+def test_config_cache_corrupt(mocker: MockerFixture, casedirs: CaseDirs) -> None:
+    cfgfile = casedirs.src / "dotplate.toml"
+    cfg = Config.load(cfgfile, use_cache=True)
+    (cachefile,) = (Path.home() / ".cache" / "dotplate" / "config").iterdir()
+    cachefile.write_bytes(b"garbage")
+    spy = mocker.spy(Config, "from_file")
+    assert Config.load(cfgfile, use_cache=True) == cfg
+    assert spy.call_count == 1
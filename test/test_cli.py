@@ -1,9 +1,16 @@
 from __future__ import annotations
+import io
+import json
 from operator import attrgetter
 from pathlib import Path
+import tarfile
+import zipfile
 from conftest import CaseDirs
 import pytest
-from dotplate.__main__ import main
+from pytest_mock import MockerFixture
+import dotplate.dotplate
+from dotplate import DiffStat
+from dotplate.__main__ import main, print_stat
 from dotplate.util import is_executable
 
 DATA_DIR = Path(__file__).with_name("data")
@@ -40,6 +47,128 @@ def test_install(
     assert_dirtrees_eq(tmp_home, casedirs.dest)
 
 
+@pytest.mark.parametrize("casedirs", ["multisuite", "script", "simple"], indirect=True)
+def test_install_jobs(
+    monkeypatch: pytest.MonkeyPatch, tmp_home: Path, casedirs: CaseDirs
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["install", "--yes", "--jobs", "2"]) == 0
+    assert_dirtrees_eq(tmp_home, casedirs.dest)
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+@pytest.mark.parametrize("casedirs", ["multisuite", "script", "simple"], indirect=True)
+def test_install_stream(
+    monkeypatch: pytest.MonkeyPatch, tmp_home: Path, casedirs: CaseDirs, jobs: str
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["install", "--yes", "--stream", "--jobs", jobs]) == 0
+    assert_dirtrees_eq(tmp_home, casedirs.dest)
+    assert main(["diff", "--stream", "--jobs", jobs]) == 0
+    assert_dirtrees_eq(tmp_home, casedirs.dest)
+
+
+@pytest.mark.parametrize("casedirs", ["multisuite", "script", "simple"], indirect=True)
+def test_render_archive_tar(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    tmp_path: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    archive = tmp_path / "out.tar"
+    assert main(["render", "--archive", "tar", "-o", str(archive)]) == 0
+    assert list(tmp_home.iterdir()) == []
+    extracted = tmp_path / "extracted"
+    with tarfile.open(archive) as tar:
+        tar.extractall(extracted, filter="data")
+    assert_dirtrees_eq(extracted, casedirs.dest)
+
+
+@pytest.mark.usecase("simple")
+def test_render_archive_zip_stdout(
+    capsysbinary: pytest.CaptureFixture[bytes],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["render", "--archive", "zip", ".profile", "nonexistent"]) == 1
+    out, err = capsysbinary.readouterr()
+    with zipfile.ZipFile(io.BytesIO(out)) as zf:
+        assert zf.namelist() == [".profile"]
+        assert zf.read(".profile") == (casedirs.dest / ".profile").read_bytes()
+    assert err == (
+        b"Error rendering nonexistent: TemplateNotFound:"
+        b" Template not found: nonexistent\n"
+    )
+    assert list(tmp_home.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [["render"], ["render", "a", "b"], ["render", "-o", "out.tar", "a"]],
+)
+def test_render_bad_args(argv: list[str]) -> None:
+    with pytest.raises(SystemExit) as excinfo:
+        main(argv)
+    assert excinfo.value.code == 2
+
+
+@pytest.mark.usecase("simple")
+def test_diff_error(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["diff", "nonexistent", ".profile"]) == 1
+    out, err = capsys.readouterr()
+    assert out == (
+        f"--- {tmp_home / '.profile'}\n"
+        "+++ .profile\n"
+        "@@ -0,0 +1,2 @@\n"
+        '+export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
+        "+export EDITOR=vim\n"
+    )
+    assert err == (
+        "Error rendering nonexistent: TemplateNotFound:"
+        " Template not found: nonexistent\n"
+    )
+
+
+@pytest.mark.usecase("multisuite")
+def test_diff_stat(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    (tmp_home / "base.txt").write_text("This file is sometimes here.\nExtra\n")
+    (tmp_home / "foobar.txt").write_text(
+        (casedirs.dest / "foobar.txt").read_text(encoding="utf-8")
+    )
+    assert main(["diff", "--stat"]) == 0
+    assert capsys.readouterr().out == (
+        " base.txt | 3 +--\n"
+        " foo.txt  | 1 +\n"
+        " 2 files changed, 2 insertions(+), 2 deletions(-)\n"
+    )
+    assert main(["diff", "--name-only"]) == 0
+    assert capsys.readouterr().out == "base.txt\nfoo.txt\n"
+
+
+def test_print_stat_scaled(capsys: pytest.CaptureFixture[str]) -> None:
+    print_stat([("big", DiffStat(added=300, removed=100)), ("small", DiffStat(1, 0))])
+    assert capsys.readouterr().out == (
+        f" big   | 400 {'+' * 37}{'-' * 13}\n"
+        " small |   1 +\n"
+        " 2 files changed, 301 insertions(+), 100 deletions(-)\n"
+    )
+
+
 @pytest.mark.usecase("suited")
 def test_install_suite_enabled(
     monkeypatch: pytest.MonkeyPatch, tmp_home: Path, casedirs: CaseDirs
@@ -97,3 +226,55 @@ def test_install_multisuite(
     monkeypatch.chdir(casedirs.src)
     assert main([*args, "install", "--yes"]) == 0
     assert_dirtrees_eq(tmp_home, casedirs.dest.with_name(destdir))
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+@pytest.mark.usecase("multisuite")
+def test_install_profile(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+    jobs: str,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["--profile", "install", "--yes", "--jobs", jobs]) == 0
+    assert_dirtrees_eq(tmp_home, casedirs.dest)
+    err = capsys.readouterr().err
+    assert err.startswith("Time per phase:\n  config ")
+    for phase in ["discovery", "compile", "render", "diff", "install", "total"]:
+        assert f"\n  {phase} " in err
+    assert "\nSlowest templates (of 3):\n" in err
+    for template in ["base.txt", "foo.txt", "foobar.txt"]:
+        assert f"s  {template}  (compile " in err
+
+
+@pytest.mark.usecase("multisuite")
+@pytest.mark.usefixtures("tmp_home")
+def test_diff_profile_json(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["--profile", "--profile-format=json", "diff"]) == 0
+    data = json.loads(capsys.readouterr().err)
+    assert list(data["phases"]) == ["config", "discovery", "compile", "render", "diff"]
+    assert sorted(data["templates"]) == ["base.txt", "foo.txt", "foobar.txt"]
+    assert [s["template"] for s in data["slowest"]] == sorted(
+        data["templates"],
+        key=lambda t: sum(data["templates"][t].values()),
+        reverse=True,
+    )
+    assert data["total"] > 0
+
+
+@pytest.mark.usecase("simple")
+def test_render_named_skips_discovery(
+    casedirs: CaseDirs, capsys: pytest.CaptureFixture[str], mocker: MockerFixture
+) -> None:
+    spy = mocker.spy(dotplate.dotplate, "walkdir")
+    cfg = str(casedirs.src / "dotplate.toml")
+    assert main(["-c", cfg, "--no-daemon", "render", ".profile"]) == 0
+    assert capsys.readouterr().out != ""
+    spy.assert_not_called()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+from collections.abc import Iterator
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import shutil
+import socket
+import threading
+from conftest import git
+import pytest
+from pytest_mock import MockerFixture
+from dotplate.__main__ import build_parser, load_dotplate, main, run_in_daemon, setup
+from dotplate.daemon import (
+    PROTOCOL_VERSION,
+    Daemon,
+    _recv,
+    _send,
+    request,
+    socket_path,
+)
+from dotplate import __version__
+from dotplate.errors import DaemonRunning
+from dotplate.watch import WatchSession, make_watcher
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="Unix sockets not available"
+)
+
+
+@dataclass
+class Tree:
+    src: Path
+    dest: Path
+    server: Daemon
+
+    def write_config(self, greeting: str, verbatim: str | None = None) -> None:
+        (self.src / "dotplate.toml").write_text(
+            "[core]\n"
+            f'dest = "{self.dest.as_posix()}"\n'
+            + ("" if verbatim is None else f'verbatim = ["{verbatim}"]\n')
+            + "[vars]\n"
+            f'greeting = "{greeting}"\n'
+        )
+
+
+@pytest.fixture()
+def tree(
+    request: pytest.FixtureRequest, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Tree]:
+    # Parametrize indirectly with `True` to make the source directory a Git
+    # repository
+    use_git = getattr(request, "param", False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+    src = tmp_path / "src"
+    src.mkdir()
+    monkeypatch.chdir(src)
+    (src / "hello.txt").write_text("{{ dotplate.vars.greeting }}, world")
+    parser = build_parser()
+    ns = parser.parse_args(["daemon"])
+    t = Tree(src=src, dest=tmp_path / "dest", server=None)  # type: ignore[arg-type]
+    t.write_config("Hello")
+    if use_git:
+        git(src, "init", "-q")
+        git(src, "add", ".")
+        git(src, "commit", "-q", "-m", "Initial")
+    session = WatchSession(
+        setup(parser, ns), reload=lambda: load_dotplate(ns), config_files=[ns.config]
+    )
+    path = socket_path(ns.config)
+    with make_watcher(src, session.watched_files()) as watcher:
+        t.server = Daemon(session, watcher, path, run=run_in_daemon)
+        t.server.listen()
+
+        def serve() -> None:
+            try:
+                t.server.serve_forever()
+            except OSError:
+                # Raised when the socket is shut down at the end of the test
+                pass
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        yield t
+        sock = t.server._sock
+        assert sock is not None
+        sock.shutdown(socket.SHUT_RDWR)
+        thread.join(5)
+        t.server.close()
+
+
+def test_daemon_serves(
+    tree: Tree, mocker: MockerFixture, capsys: pytest.CaptureFixture[str]
+) -> None:
+    spy = mocker.spy(Daemon, "handle")
+    assert main(["list"]) == 0
+    assert main(["render", "hello.txt"]) == 0
+    assert main(["diff"]) == 0
+    assert capsys.readouterr().out == (
+        "hello.txt\n"
+        "Hello, world\n"
+        f"--- {tree.dest / 'hello.txt'}\n"
+        "+++ hello.txt\n"
+        "@@ -0,0 +1 @@\n"
+        "+Hello, world\n"
+    )
+    assert main(["install", "--yes"]) == 0
+    assert capsys.readouterr().out == (
+        f"Installed hello.txt at {tree.dest / 'hello.txt'}\n"
+    )
+    assert (tree.dest / "hello.txt").read_text() == "Hello, world\n"
+    assert spy.call_count == 4
+
+
+def test_daemon_reloads(tree: Tree, capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["render", "hello.txt"]) == 0
+    assert capsys.readouterr().out == "Hello, world\n"
+    tree.write_config("Goodbye")
+    assert main(["render", "hello.txt"]) == 0
+    assert capsys.readouterr().out == "Goodbye, world\n"
+    (tree.src / "hello.txt").write_text("{{ dotplate.vars.greeting }}, moon")
+    (tree.src / "new.txt").write_text("New")
+    assert main(["render", "hello.txt"]) == 0
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == "Goodbye, moon\nhello.txt\nnew.txt\n"
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="Git not installed")
+@pytest.mark.parametrize("tree", [True], ids=["git"], indirect=True)
+def test_daemon_git_commit(tree: Tree, capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == "hello.txt\n"
+    (tree.src / "new.txt").write_text("New")
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == "hello.txt\n"
+    git(tree.src, "add", "new.txt")
+    git(tree.src, "commit", "-q", "-m", "Add new.txt")
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == "hello.txt\nnew.txt\n"
+
+
+def test_daemon_verbatim_render(
+    tree: Tree, mocker: MockerFixture, capsysbinary: pytest.CaptureFixture[bytes]
+) -> None:
+    data = bytes(range(256))
+    (tree.src / "logo.bin").write_bytes(data)
+    tree.write_config("Hello", verbatim="*.bin")
+    spy = mocker.spy(Daemon, "handle")
+    assert main(["render", "logo.bin"]) == 0
+    assert capsysbinary.readouterr().out == data
+    # The daemon was asked but handed the command back to the client:
+    assert spy.call_count == 1
+    assert main(["render", "hello.txt"]) == 0
+    assert capsysbinary.readouterr().out == b"Hello, world\n"
+    assert spy.call_count == 2
+
+
+def test_daemon_errors(tree: Tree, capsys: pytest.CaptureFixture[str]) -> None:
+    assert main(["render", "nonexistent.txt"]) == 1
+    assert capsys.readouterr().err == (
+        "dotplate daemon: TemplateNotFound: Template not found: nonexistent.txt\n"
+    )
+    r = request(tree.server.path, ["watch"])
+    assert r is not None
+    assert r.rc == 2
+    assert "command cannot be run by the daemon" in r.stderr
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Requires executable bits")
+def test_daemon_sees_new_executables(
+    tree: Tree, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    bindir = tree.src.parent / "bin"
+    bindir.mkdir()
+    monkeypatch.setenv("PATH", str(bindir))
+    (tree.src / "tool.txt").write_text("{{ which('tool') is defined }}")
+    assert main(["render", "tool.txt"]) == 0
+    assert capsys.readouterr().out == "False\n"
+    (bindir / "tool").write_text("#!/bin/sh\n")
+    (bindir / "tool").chmod(0o755)
+    assert main(["render", "tool.txt"]) == 0
+    assert capsys.readouterr().out == "True\n"
+
+
+def test_daemon_refuses_other_path(tree: Tree, mocker: MockerFixture) -> None:
+    spy = mocker.spy(Daemon, "handle")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(tree.server.path))
+        _send(
+            sock,
+            {
+                "protocol": PROTOCOL_VERSION,
+                "version": __version__,
+                "argv": ["list"],
+                "path": "/some/other/bin",
+            },
+        )
+        sock.shutdown(socket.SHUT_WR)
+        assert _recv(sock) == {"error": "Incompatible client"}
+    assert spy.call_count == 0
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--no-daemon", "list"],
+        ["--dest", "elsewhere", "list"],
+        ["-s", "suite", "list"],
+        ["--profile", "list"],
+        ["install"],
+    ],
+)
+def test_daemon_not_used(
+    tree: Tree, mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, argv: list[str]
+) -> None:
+    spy = mocker.spy(Daemon, "handle")
+    monkeypatch.setattr("builtins.input", lambda _: "n")
+    assert main(argv) == 0
+    assert spy.call_count == 0
+    assert tree.server.path.exists()
+
+
+def test_daemon_already_running(tree: Tree) -> None:
+    server = tree.server
+    other = Daemon(server.session, server.watcher, server.path, run_in_daemon)
+    with pytest.raises(DaemonRunning):
+        other.listen()
+
+
+def test_stale_socket(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dotplate.toml").write_text('[core]\nsrc = "src"\ndest = "dest"\n')
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "foo.txt").write_text("Foo")
+    path = socket_path(Path("dotplate.toml"))
+    path.parent.mkdir(parents=True)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(path))
+    assert main(["list"]) == 0
+    assert capsys.readouterr().out == "foo.txt\n"
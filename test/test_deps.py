@@ -0,0 +1,148 @@
+from __future__ import annotations
+from pathlib import Path
+from jinja2 import DictLoader, Environment
+import pytest
+from dotplate import Dotplate
+from dotplate.__main__ import main
+from dotplate.deps import DependencyGraph, TemplateRefs, find_references
+
+
+@pytest.mark.parametrize(
+    "source,refs",
+    [
+        ("No references", TemplateRefs()),
+        (
+            '{% extends "base" %}{% import "macros" as m %}'
+            '{% from "more" import x %}{% include "part" %}',
+            TemplateRefs(names=frozenset(["base", "macros", "more", "part"])),
+        ),
+        (
+            '{% include ["a", "b"] %}{% include ["c", var] %}',
+            TemplateRefs(names=frozenset(["a", "b", "c"]), dynamic=True),
+        ),
+        (
+            '{% include "x" if flag else "y" %}',
+            TemplateRefs(names=frozenset(["x", "y"])),
+        ),
+        (
+            '{% include "colors/" ~ theme ~ ".conf" %}',
+            TemplateRefs(patterns=frozenset(["colors/*.conf"])),
+        ),
+        (
+            '{% include "fixed/" ~ "name" %}{% include "a[1]/" + x %}',
+            TemplateRefs(
+                names=frozenset(["fixed/name"]), patterns=frozenset(["a[[]1]/*"])
+            ),
+        ),
+        ("{% include var %}", TemplateRefs(dynamic=True)),
+        (
+            '{% include "x" %}{{ which("vim", "vi") }}',
+            TemplateRefs(names=frozenset(["x"]), impure=True),
+        ),
+        ("{% set which = 1 %}{% for which in x %}{% endfor %}", TemplateRefs()),
+    ],
+)
+def test_find_references(source: str, refs: TemplateRefs) -> None:
+    env = Environment()
+    assert find_references(env.parse(source)) == refs
+
+
+def make_graph(templates: dict[str, str]) -> DependencyGraph:
+    return DependencyGraph(Environment(loader=DictLoader(templates)), templates)
+
+
+def test_graph() -> None:
+    graph = make_graph(
+        {
+            "base": "{% block body %}{% endblock %}",
+            "colors/dark.conf": "Dark",
+            "colors/light.conf": 'Light {% include "part" %}',
+            "part": "Part",
+            "page": '{% extends "base" %}{% block body %}{% include "part" %}'
+            "{% endblock %}",
+            "themed": '{% include "colors/" ~ theme ~ ".conf" %}',
+            "dynamic": "{% include var %}",
+            "broken": "{% include",
+            "missing": '{% include "nonexistent" %}',
+        }
+    )
+    assert graph.dependencies("page") == {"base", "part"}
+    assert graph.dependencies("themed") == {
+        "colors/dark.conf",
+        "colors/light.conf",
+        "part",
+    }
+    assert graph.dependencies("missing") == {"nonexistent"}
+    assert graph.dependents("part") == {
+        "page",
+        "colors/light.conf",
+        "themed",
+        "dynamic",
+        "broken",
+    }
+    assert graph.dependents("base") == {"page", "dynamic", "broken"}
+    assert graph.dependents("nonexistent") == {"missing", "dynamic", "broken"}
+    assert graph.has_exact_dependencies("page")
+    assert not graph.has_exact_dependencies("themed")
+    assert not graph.has_exact_dependencies("broken")
+
+
+def test_graph_forget() -> None:
+    templates = {"a": '{% include "b" %}', "b": "B", "c": "C"}
+    graph = make_graph(templates)
+    assert graph.dependents("b") == {"a"}
+    templates["a"] = '{% include "c" %}'
+    assert graph.dependents("b") == {"a"}
+    graph.forget("a")
+    assert graph.dependents("b") == set()
+    assert graph.dependents("c") == {"a"}
+
+
+def test_graph_set_templates() -> None:
+    templates = {"a": '{% include "p/" ~ x %}', "p/1": "1"}
+    graph = make_graph(templates)
+    assert graph.dependencies("a") == {"p/1"}
+    templates["p/2"] = "2"
+    graph.set_templates(templates)
+    assert graph.dependencies("a") == {"p/1", "p/2"}
+    assert graph.dependents("p/2") == {"a"}
+
+
+def make_tree(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text(
+        f'[core]\ndest = "{(tmp_path / "dest").as_posix()}"\n'
+    )
+    (src / "_partial").write_text("Partial")
+    (src / "_chain").write_text('{% include "_partial" %}')
+    (src / "a.txt").write_text('{% include "_chain" %}')
+    (src / "b.txt").write_text("B")
+    return src / "dotplate.toml"
+
+
+def test_dotplate_dependents(tmp_path: Path) -> None:
+    dp = Dotplate.from_config_file(make_tree(tmp_path))
+    assert dp.dependents("_partial") == ["_chain", "a.txt"]
+    assert dp.dependents("b.txt") == []
+    assert dp.dependencies("a.txt") == ["_chain", "_partial"]
+    (tmp_path / "src" / "c.txt").write_text('{% include "_partial" %}')
+    dp.rediscover()
+    assert dp.dependents("_partial") == ["_chain", "a.txt", "c.txt"]
+
+
+def test_dotplate_undecodable(tmp_path: Path) -> None:
+    cfgfile = make_tree(tmp_path)
+    (tmp_path / "src" / "logo.bin").write_bytes(bytes(range(256)))
+    dp = Dotplate.from_config_file(cfgfile)
+    dp.dependency_graph.build()
+    assert dp.dependencies("logo.bin") == []
+    assert dp.dependents("_partial") == ["_chain", "a.txt"]
+
+
+def test_cli_deps(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    cfgfile = make_tree(tmp_path)
+    assert main(["-c", str(cfgfile), "deps", "_partial"]) == 0
+    assert capsys.readouterr().out == "_chain\na.txt\n"
+    assert main(["-c", str(cfgfile), "deps", "--dependencies", "a.txt"]) == 0
+    assert capsys.readouterr().out == "_chain\n_partial\n"
@@ -4,7 +4,8 @@ from pathlib import Path
 import shutil
 from conftest import CaseDirs
 import pytest
-from dotplate import DiffState, Dotplate, XBitDiff
+from dotplate import Diff, DiffStat, DiffState, Dotplate, RenderedFile, XBitDiff
+from dotplate.dotplate import DiffDetail
 from dotplate.util import set_executable_bit, unset_executable_bit
 
 unix_only = pytest.mark.skipif(
@@ -20,6 +21,7 @@ def test_simple_nodiff(tmp_home: Path, casedirs: CaseDirs) -> None:
     diff = rf.diff()
     assert not bool(diff)
     assert diff.delta == ""
+    assert diff.stat == DiffStat(added=0, removed=0)
     assert diff.state is DiffState.NODIFF
     assert diff.xbit_diff is XBitDiff.NOCHANGE
 
@@ -41,10 +43,38 @@ def test_simple_changed(tmp_home: Path, casedirs: CaseDirs) -> None:
         '+export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
         " export EDITOR=vim\n"
     )
+    assert diff.stat == DiffStat(added=1, removed=1)
     assert diff.state is DiffState.CHANGED
     assert diff.xbit_diff is XBitDiff.NOCHANGE
 
 
+@pytest.mark.skipif(
+    os.linesep != "\n", reason="Rendered files already use CRLF line endings"
+)
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.usecase("simple")
+def test_simple_line_endings(
+    tmp_home: Path, casedirs: CaseDirs, stream: bool
+) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    content = (casedirs.dest / ".profile").read_bytes()
+    (tmp_home / ".profile").write_bytes(content.replace(b"\n", b"\r\n"))
+    rf = dp.render_file(".profile", stream=stream)
+    diff = rf.diff()
+    assert diff.state is DiffState.CHANGED
+    assert diff.delta == (
+        f"--- {tmp_home / '.profile'}\n"
+        "+++ .profile\n"
+        "@@ -1,2 +1,2 @@\n"
+        '-export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\r\n'
+        "-export EDITOR=vim\r\n"
+        '+export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
+        "+export EDITOR=vim\n"
+    )
+    assert diff.stat == DiffStat(added=2, removed=2)
+    rf.discard()
+
+
 @pytest.mark.usecase("simple")
 def test_simple_missing(tmp_home: Path, casedirs: CaseDirs) -> None:
     dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
@@ -58,10 +88,33 @@ def test_simple_missing(tmp_home: Path, casedirs: CaseDirs) -> None:
         '+export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
         "+export EDITOR=vim\n"
     )
+    assert diff.stat == DiffStat(added=2, removed=0)
     assert diff.state is DiffState.MISSING
     assert diff.xbit_diff is XBitDiff.MISSING_UNSET
 
 
+@pytest.mark.usecase("simple")
+def test_simple_changed_same_size(tmp_home: Path, casedirs: CaseDirs) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    (tmp_home / ".profile").write_text(
+        'export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\nexport EDITOR=vi\n\n'
+    )
+    rf = dp.render(".profile")
+    diff = rf.diff()
+    assert bool(diff)
+    assert diff.state is DiffState.CHANGED
+    assert "delta" not in vars(diff)
+    assert diff.delta == (
+        f"--- {tmp_home / '.profile'}\n"
+        "+++ .profile\n"
+        "@@ -1,3 +1,2 @@\n"
+        ' export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
+        "-export EDITOR=vi\n"
+        "-\n"
+        "+export EDITOR=vim\n"
+    )
+
+
 @unix_only
 @pytest.mark.usecase("simple")
 def test_simple_xbit_added(tmp_home: Path, casedirs: CaseDirs) -> None:
@@ -177,3 +230,91 @@ def test_script_missing(tmp_home: Path, casedirs: CaseDirs) -> None:
     )
     assert diff.state is DiffState.MISSING
     assert diff.xbit_diff is XBitDiff.MISSING_SET
+
+
+@pytest.mark.usecase("simple")
+def test_simple_streamed_changed(tmp_home: Path, casedirs: CaseDirs) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    (tmp_home / ".profile").write_text(
+        'export PATH="$PATH:$HOME/local/bin"\nexport EDITOR=vim\n'
+    )
+    sf = dp.render_stream(".profile")
+    assert sf.path.parent == tmp_home
+    diff = sf.diff()
+    assert diff.state is DiffState.CHANGED
+    assert diff.delta == (
+        f"--- {tmp_home / '.profile'}\n"
+        "+++ .profile\n"
+        "@@ -1,2 +1,2 @@\n"
+        '-export PATH="$PATH:$HOME/local/bin"\n'
+        '+export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
+        " export EDITOR=vim\n"
+    )
+    sf.install()
+    sf.discard()
+    assert sorted(p.name for p in tmp_home.iterdir()) == [
+        ".profile",
+        ".profile.dotplate.bak",
+    ]
+    assert (tmp_home / ".profile").read_bytes() == (
+        casedirs.dest / ".profile"
+    ).read_bytes()
+
+
+@pytest.mark.usecase("simple")
+def test_simple_streamed_nodiff(tmp_home: Path, casedirs: CaseDirs) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    shutil.copyfile(casedirs.dest / ".profile", tmp_home / ".profile")
+    sf = dp.render_stream(".profile")
+    diff = sf.diff()
+    assert not bool(diff)
+    assert diff.delta == ""
+    sf.discard()
+    assert [p.name for p in tmp_home.iterdir()] == [".profile"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.parametrize("detail", ["delta", "stat"])
+def test_render_many_detail(tmp_path: Path, jobs: int, detail: DiffDetail) -> None:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text('[core]\ndest = "../dest"\n')
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        (src / name).write_text("new\n")
+        (dest / name).write_text("old\n")
+    dp = Dotplate.from_config_file(src / "dotplate.toml")
+    files = list(dp.render_many(jobs=jobs, detail=detail))
+    # The details were computed while diffing, so they don't change along
+    # with the destination:
+    shutil.rmtree(dest)
+    for f in files:
+        assert isinstance(f, RenderedFile)
+        d = f.diff()
+        match detail:
+            case "delta":
+                assert d.delta == (
+                    f"--- {f.dest_path}\n"
+                    f"+++ {f.template}\n"
+                    "@@ -1 +1 @@\n"
+                    "-old\n"
+                    "+new\n"
+                )
+            case "stat":
+                assert d.stat == DiffStat(added=1, removed=1)
+
+
+def test_diff_given_details() -> None:
+    d = Diff(
+        state=DiffState.CHANGED,
+        xbit_diff=XBitDiff.NOCHANGE,
+        delta="-old\n+new\n",
+        stat=DiffStat(added=1, removed=1),
+    )
+    assert d
+    assert d.delta == "-old\n+new\n"
+    assert d.stat == DiffStat(added=1, removed=1)
+    d = Diff(state=DiffState.CHANGED, xbit_diff=XBitDiff.NOCHANGE)
+    with pytest.raises(ValueError):
+        d.delta
@@ -1,7 +1,10 @@
 from __future__ import annotations
+from pathlib import Path
 from conftest import CaseDirs
 import pytest
-from dotplate import Dotplate
+from pytest_mock import MockerFixture
+import dotplate.dotplate
+from dotplate import Dotplate, RenderedFile, RenderError, TemplateNotFound
 
 
 @pytest.mark.usecase("simple")
@@ -25,3 +28,131 @@ def test_suited_templates(casedirs: CaseDirs) -> None:
     assert dp.templates() == [".profile"]
     dp.suites.add("vim")
     assert dp.templates() == [".profile", ".vimrc"]
+
+
+def test_suite_globs(tmp_path: Path) -> None:
+    (tmp_path / "dotplate.toml").write_text(
+        "[core]\n"
+        'dest = "dest"\n'
+        "[suites.vim]\n"
+        'files = [".vim/", ".vimrc"]\n'
+        "[suites.scripts]\n"
+        'files = ["bin/*.sh"]\n',
+        encoding="utf-8",
+    )
+    for p in [".vimrc", ".vim/ftplugin/python.vim", "bin/x.sh", "bin/x.py", ".profile"]:
+        (tmp_path / p).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / p).write_text("", encoding="utf-8")
+    dp = Dotplate.from_config_file(tmp_path / "dotplate.toml")
+    assert dp.templates() == [".profile", "bin/x.py"]
+    dp.suites.add("vim")
+    assert dp.templates() == [
+        ".profile",
+        ".vim/ftplugin/python.vim",
+        ".vimrc",
+        "bin/x.py",
+    ]
+    dp.suites = {"scripts"}
+    assert dp.templates() == [".profile", "bin/x.py", "bin/x.sh"]
+
+
+def test_discover_named(tmp_path: Path, mocker: MockerFixture) -> None:
+    (tmp_path / "dotplate.toml").write_text('[core]\ndest = "dest"\n')
+    (tmp_path / "a.txt").write_text("A\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.txt").write_text("B\n")
+    (tmp_path / "link").symlink_to("sub")
+    names = [
+        "a.txt",
+        "sub/b.txt",
+        "link",
+        "link/b.txt",
+        "sub",
+        "dotplate.toml",
+        "../a.txt",
+        "./a.txt",
+        "missing.txt",
+    ]
+    dp = Dotplate.from_config_file(tmp_path / "dotplate.toml")
+    spy = mocker.spy(dotplate.dotplate, "walkdir")
+    dp.discover_named(names)
+    found = []
+    for n in names:
+        try:
+            dp.is_active(n)
+        except TemplateNotFound:
+            continue
+        found.append(n)
+    assert found == ["a.txt", "sub/b.txt", "link"]
+    assert dp.render("a.txt").content == "A\n"
+    spy.assert_not_called()
+    # The same files are found by a full discovery:
+    assert dp.templates() == ["a.txt", "link", "sub/b.txt"]
+    spy.assert_called_once()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+@pytest.mark.usecase("multisuite")
+def test_render_many(casedirs: CaseDirs, jobs: int) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    results = list(
+        dp.render_many(["foobar.txt", "bar.txt", "base.txt", "nope.txt"], jobs=jobs)
+    )
+    assert len(results) == 4
+    assert isinstance(results[0], RenderedFile)
+    assert results[0].template == "foobar.txt"
+    assert results[1] == RenderError(
+        template="bar.txt",
+        message="InactiveTemplate: Template is not active: bar.txt",
+    )
+    assert isinstance(results[2], RenderedFile)
+    assert results[2].template == "base.txt"
+    assert results[3] == RenderError(
+        template="nope.txt",
+        message="TemplateNotFound: Template not found: nope.txt",
+    )
+
+
+@pytest.mark.usecase("simple")
+def test_shared_context(casedirs: CaseDirs) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    ctx1 = dp.get_context(".profile", casedirs.dest / ".profile")["dotplate"]
+    ctx2 = dp.get_context("other", casedirs.dest / "other")["dotplate"]
+    assert ctx1["template"] == ".profile"
+    assert ctx2["template"] == "other"
+    assert ctx1["vars"] is ctx2["vars"]
+    assert ctx1["vars"] == dp.vars
+    with pytest.raises(TypeError):
+        ctx1["vars"]["editor"] = "emacs"
+    with pytest.raises(TypeError):
+        ctx1["vars"]["additional_paths"].append("/bin")
+    with pytest.raises(TypeError):
+        ctx1["template"] = "foo"
+    dp.vars["editor"] = "emacs"
+    ctx3 = dp.get_context(".profile", casedirs.dest / ".profile")["dotplate"]
+    assert ctx3["vars"]["editor"] == "emacs"
+    assert ctx1["vars"]["editor"] == "vim"
+
+
+@pytest.mark.usecase("simple")
+def test_template_cannot_mutate_context(casedirs: CaseDirs) -> None:
+    (casedirs.src / "mutate.txt").write_text(
+        "{{ dotplate.vars.additional_paths.append('/oops') }}"
+    )
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    with pytest.raises(TypeError):
+        dp.render("mutate.txt")
+    assert dp.render(".profile").content == (
+        'export PATH="$PATH:$HOME/local/bin:$HOME/.cargo/bin"\n'
+        "export EDITOR=vim\n"
+    )
+
+
+@pytest.mark.usecase("suited")
+def test_shared_context_suites(casedirs: CaseDirs) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    ctx = dp.get_context(".vimrc", casedirs.dest / ".vimrc")["dotplate"]
+    assert not ctx["suites"]["vim"]["enabled"]
+    dp.suites.add("vim")
+    ctx = dp.get_context(".vimrc", casedirs.dest / ".vimrc")["dotplate"]
+    assert ctx["suites"]["vim"]["enabled"]
@@ -0,0 +1,186 @@
+from __future__ import annotations
+import io
+from pathlib import Path
+import tarfile
+import zipfile
+import pytest
+from pytest_mock import MockerFixture
+from dotplate import Dotplate
+from dotplate.__main__ import main
+from dotplate.archive import open_archive
+from dotplate.config import Config
+from dotplate.fleet import load_hosts, render_fleet
+
+
+class Unseekable(io.BytesIO):
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, *_args: object) -> int:
+        raise io.UnsupportedOperation("seek")
+
+    def tell(self) -> int:
+        raise io.UnsupportedOperation("tell")
+
+
+def make_tree(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text(
+        "[core]\n"
+        f'dest = "{(tmp_path / "dest").as_posix()}"\n'
+        "[vars]\n"
+        'name = "nobody"\n'
+        "[suites.work]\n"
+        'files = ["work.txt"]\n'
+    )
+    (src / "_macros").write_text("{% macro hi(who) %}Hi, {{ who }}{% endmacro %}")
+    (src / "hello.txt").write_text(
+        '{% import "_macros" as m %}{{ m.hi(dotplate.vars.name) }}'
+        " at {{ dotplate.dest_path }}"
+    )
+    (src / "work.txt").write_text("Work")
+    (src / "bin").mkdir()
+    (src / "bin" / "run").write_text("#!/bin/sh")
+    (src / "bin" / "run").chmod(0o755)
+    hosts = tmp_path / "hosts"
+    hosts.mkdir()
+    (hosts / "alpha.toml").write_text(
+        '[local]\ndest = "/home/alpha"\nenabled-suites = ["work"]\n'
+        '[vars]\nname = "Alpha"\n'
+    )
+    (hosts / "beta.toml").write_text('[local]\n[vars]\nname = "Beta"\n')
+    return src / "dotplate.toml"
+
+
+@pytest.mark.parametrize("fmt", ["tar", "zip"])
+def test_archive_unseekable(tmp_path: Path, fmt: str) -> None:
+    cfgfile = make_tree(tmp_path)
+    dp = Dotplate.from_config_file(cfgfile)
+    fp = Unseekable()
+    with open_archive(fp, fmt) as writer:  # type: ignore[arg-type]
+        for t in dp.templates():
+            writer.add_file(dp.render(t), t)
+    data = io.BytesIO(fp.getvalue())
+    if fmt == "tar":
+        with tarfile.open(fileobj=data) as tar:
+            assert tar.getnames() == ["_macros", "bin/run", "hello.txt"]
+            assert tar.getmember("bin/run").mode & 0o111 == 0o111
+            assert tar.getmember("hello.txt").mode & 0o111 == 0
+            member = tar.extractfile("bin/run")
+            assert member is not None
+            assert member.read() == b"#!/bin/sh\n"
+    else:
+        with zipfile.ZipFile(data) as zf:
+            assert zf.namelist() == ["_macros", "bin/run", "hello.txt"]
+            assert (zf.getinfo("bin/run").external_attr >> 16) & 0o111 == 0o111
+            assert (zf.getinfo("hello.txt").external_attr >> 16) & 0o111 == 0
+            assert zf.read("bin/run") == b"#!/bin/sh\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_render_fleet(tmp_path: Path, mocker: MockerFixture, jobs: int) -> None:
+    cfgfile = make_tree(tmp_path)
+    dp = Dotplate.from_config(Config.from_file(cfgfile))
+    hosts = load_hosts(sorted((tmp_path / "hosts").iterdir()))
+    spy = mocker.spy(Dotplate, "_discover_templates")
+    out = tmp_path / "out"
+    results = list(render_fleet(dp, hosts, out, jobs=jobs))
+    assert [(r.host, r.path, r.files, r.errors) for r in results] == [
+        ("alpha", out / "alpha", 4, []),
+        ("beta", out / "beta", 3, []),
+    ]
+    assert spy.call_count == 1
+    assert (out / "alpha" / "hello.txt").read_text() == (
+        f"Hi, Alpha at {Path('/home/alpha', 'hello.txt')}\n"
+    )
+    assert (out / "alpha" / "work.txt").read_text() == "Work\n"
+    assert (out / "beta" / "hello.txt").read_text() == (
+        f"Hi, Beta at {tmp_path / 'dest' / 'hello.txt'}\n"
+    )
+    assert not (out / "beta" / "work.txt").exists()
+    assert (out / "beta" / "bin" / "run").stat().st_mode & 0o111 == 0o111
+    assert not (tmp_path / "dest").exists()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_render_fleet_small_cache(tmp_path: Path, jobs: int) -> None:
+    cfgfile = make_tree(tmp_path)
+    cfg = Config.from_file(cfgfile)
+    cfg.jinja.cache_size = 1
+    dp = Dotplate.from_config(cfg)
+    env = dp.jinja_env
+    hosts = load_hosts(sorted((tmp_path / "hosts").iterdir()))
+    results = list(render_fleet(dp, hosts, tmp_path / "out", jobs=jobs))
+    assert [(r.host, r.files, r.errors) for r in results] == [
+        ("alpha", 4, []),
+        ("beta", 3, []),
+    ]
+    # The caller's config and environment are left alone:
+    assert dp.cfg.jinja.cache_size == 1
+    assert dp.jinja_env is env
+    assert getattr(env.cache, "capacity", None) == 1
+
+
+@pytest.mark.parametrize(
+    "option,alpha_files,beta_files",
+    [("--enable-suite", 4, 4), ("--disable-suite", 3, 3)],
+)
+def test_cli_fleet_suites(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    option: str,
+    alpha_files: int,
+    beta_files: int,
+) -> None:
+    cfgfile = make_tree(tmp_path)
+    out = tmp_path / "out"
+    hosts = tmp_path / "hosts"
+    argv = ["-c", str(cfgfile), option, "work", "fleet", "-o", str(out), "-j", "2"]
+    argv += [str(hosts / "alpha.toml"), str(hosts / "beta.toml")]
+    assert main(argv) == 0
+    assert capsys.readouterr().out == (
+        f"Rendered {alpha_files} files for alpha at {out / 'alpha'}\n"
+        f"Rendered {beta_files} files for beta at {out / 'beta'}\n"
+    )
+    assert (out / "alpha" / "work.txt").exists() == (option == "--enable-suite")
+    assert (out / "beta" / "work.txt").exists() == (option == "--enable-suite")
+
+
+def test_load_hosts_duplicate(tmp_path: Path) -> None:
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a" / "host.toml").write_text("[local]\n")
+    (tmp_path / "b" / "host.toml").write_text("[local]\n")
+    with pytest.raises(ValueError) as excinfo:
+        load_hosts([tmp_path / "a" / "host.toml", tmp_path / "b" / "host.toml"])
+    assert str(excinfo.value) == "Multiple local configs for host 'host'"
+
+
+def test_cli_fleet_archive(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    cfgfile = make_tree(tmp_path)
+    (tmp_path / "src" / "broken.txt").write_text("{{ nope() }}")
+    out = tmp_path / "out"
+    hosts = tmp_path / "hosts"
+    argv = ["-c", str(cfgfile), "fleet", "-o", str(out), "--archive", "zip"]
+    argv += [str(hosts / "alpha.toml"), str(hosts / "beta.toml")]
+    assert main(argv) == 1
+    captured = capsys.readouterr()
+    assert captured.out == (
+        f"Rendered 4 files for alpha at {out / 'alpha.zip'}\n"
+        f"Rendered 3 files for beta at {out / 'beta.zip'}\n"
+    )
+    assert captured.err.startswith("alpha: Error rendering broken.txt: ")
+    with zipfile.ZipFile(out / "beta.zip") as zf:
+        assert zf.namelist() == ["_macros", "bin/run", "hello.txt"]
+
+
+def test_cli_fleet_dest(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    cfgfile = make_tree(tmp_path)
+    argv = ["-c", str(cfgfile), "-d", str(tmp_path), "fleet", "-o", "out", "x.toml"]
+    with pytest.raises(SystemExit) as excinfo:
+        main(argv)
+    assert excinfo.value.code == 2
+    assert "--dest and --local-config cannot be used with fleet" in (
+        capsys.readouterr().err
+    )
@@ -0,0 +1,330 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import shutil
+import subprocess
+from conftest import git
+import pytest
+from pytest_mock import MockerFixture
+import dotplate.git
+from dotplate import Config, Dotplate, RevisionNotFound, TemplateNotFound
+from dotplate.__main__ import main
+from dotplate.git import CatFileBatch, GitRepo, GitUnsupported, RevisionFiles
+from dotplate.util import _git_files_subprocess, git_files, is_executable, listdir
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("git") is None, reason="Git not installed"
+)
+
+
+@pytest.fixture()
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    (repo / "README.txt").write_text("Not a template\n")
+    src = repo / "src"
+    (src / ".config" / "foo").mkdir(parents=True)
+    (src / ".config" / "foo" / "bar.toml").write_text("bar = 42\n")
+    (src / ".profile").write_text("export EDITOR=vim\n")
+    (src / "old.txt").write_text("Soon to be gone\n")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "Initial commit")
+    for i in range(3):
+        (src / ".profile").write_text(f"export EDITOR=vim\nexport N={i}\n")
+        git(repo, "commit", "-q", "-a", "-m", f"Commit {i}")
+    return repo
+
+
+def expected(src: Path, staged: bool) -> dict[str, str]:
+    if staged:
+        out = git(src, "ls-files", "--stage")
+        return {
+            line.split("\t")[1]: line.split()[1] for line in out.splitlines()
+        }
+    else:
+        out = git(src, "ls-tree", "-r", "HEAD")
+        return {
+            line.split("\t")[1]: line.split()[2] for line in out.splitlines()
+        }
+
+
+def stage_changes(repo: Path) -> None:
+    src = repo / "src"
+    (src / "new.txt").write_text("Brand new\n")
+    git(repo, "add", "src/new.txt")
+    git(repo, "rm", "-q", "src/old.txt")
+    (src / "untracked.txt").write_text("Not added\n")
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_git_files(repo: Path, staged: bool) -> None:
+    src = repo / "src"
+    stage_changes(repo)
+    files = git_files(src, include_staged=staged)
+    assert files == expected(src, staged)
+    assert files == _git_files_subprocess(src, staged)
+    assert ("new.txt" in files) is staged
+    assert ("old.txt" in files) is not staged
+    assert "untracked.txt" not in files
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_git_files_packed(repo: Path, staged: bool) -> None:
+    git(repo, "gc", "-q", "--aggressive")
+    git(repo, "update-index", "--index-version", "4")
+    assert not list((repo / ".git" / "objects").glob("??/*"))
+    src = repo / "src"
+    stage_changes(repo)
+    assert git_files(src, include_staged=staged) == expected(src, staged)
+
+
+def test_git_files_cache_tree_shortcut(repo: Path, mocker: MockerFixture) -> None:
+    spy = mocker.spy(GitRepo, "walk_tree")
+    assert git_files(repo / "src") == expected(repo / "src", False)
+    spy.assert_not_called()
+    stage_changes(repo)
+    assert git_files(repo / "src") == expected(repo / "src", False)
+    spy.assert_called()
+
+
+def test_git_files_worktree(repo: Path, tmp_path: Path) -> None:
+    git(repo, "worktree", "add", "-q", str(tmp_path / "wt"))
+    src = tmp_path / "wt" / "src"
+    assert git_files(src) == expected(src, False)
+
+
+def test_git_files_skips_submodules(repo: Path) -> None:
+    oid = git(repo, "rev-parse", "HEAD")
+    git(repo, "update-index", "--add", "--cacheinfo", f"160000,{oid},src/sub")
+    git(repo, "commit", "-q", "-m", "Add submodule")
+    files = git_files(repo / "src")
+    assert files is not None
+    assert "sub" not in files
+    assert files == _git_files_subprocess(repo / "src", False)
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_git_files_unusual_entries(repo: Path, staged: bool) -> None:
+    oids = [
+        git(repo, "hash-object", "-w", "--stdin", stdin=f"Version {i}\n")
+        for i in range(3)
+    ]
+    # Paths whose length doesn't fit in an index entry's flags are stored
+    # with a length of 0xFFF:
+    longpath = "src/" + "/".join(["x" * 99] * 42)
+    git(
+        repo,
+        "update-index",
+        "--index-info",
+        stdin=f"100644 {oids[0]} 0\t{longpath}\n"
+        + "".join(
+            f"100644 {oid} {i}\tsrc/conflict.txt\n" for i, oid in enumerate(oids, 1)
+        ),
+    )
+    src = repo / "src"
+    files = git_files(src, include_staged=staged)
+    assert files is not None
+    assert files == _git_files_subprocess(src, staged)
+    assert (longpath[4:] in files) is staged
+    assert files.get("conflict.txt") == (oids[2] if staged else None)
+
+
+def test_git_files_fallback(repo: Path, mocker: MockerFixture) -> None:
+    mocker.patch.object(GitRepo, "read_index", side_effect=GitUnsupported("Nope"))
+    spy = mocker.spy(subprocess, "run")
+    assert git_files(repo / "src") == expected(repo / "src", False)
+    # One call from git_files(), one from expected()
+    assert spy.call_count == 2
+
+
+def test_not_git(repo: Path, tmp_path: Path) -> None:
+    (tmp_path / "plain").mkdir()
+    (tmp_path / "plain" / "foo.txt").touch()
+    assert git_files(tmp_path / "plain") is None
+    assert listdir(tmp_path / "plain") == ["foo.txt"]
+    assert git_files(repo / ".git") is None
+    (repo / "untracked").mkdir()
+    (repo / "untracked" / "foo.txt").touch()
+    assert git_files(repo / "untracked") is None
+    assert listdir(repo / "untracked") == ["foo.txt"]
+
+
+def test_dotplate_git_templates(repo: Path, tmp_path: Path) -> None:
+    stage_changes(repo)
+    cfgfile = repo / "src" / "dotplate.toml"
+    cfgfile.write_text(f"[core]\ndest = {str(tmp_path / 'dest')!r}\n")
+    git(repo, "add", "src/dotplate.toml")
+    dp = Dotplate.from_config_file(cfgfile)
+    assert dp.templates() == [".config/foo/bar.toml", ".profile", "old.txt"]
+    assert dp.template_oid(".profile") == git(repo, "rev-parse", "HEAD:src/.profile")
+    cfgfile.write_text(
+        f"[core]\ndest = {str(tmp_path / 'dest')!r}\ninclude-staged = true\n"
+    )
+    dp = Dotplate.from_config_file(cfgfile)
+    assert dp.templates() == [".config/foo/bar.toml", ".profile", "new.txt"]
+    assert dp.template_oid("new.txt") == git(repo, "rev-parse", ":src/new.txt")
+
+
+@pytest.fixture()
+def revrepo(repo: Path, tmp_path: Path) -> Path:
+    src = repo / "src"
+    (src / "dotplate.toml").write_text(
+        f"[core]\ndest = {str(tmp_path / 'dest')!r}\n"
+    )
+    (src / "_greeting").write_text("Hello, {{ name }}!")
+    (src / "script").write_text(
+        '#!/bin/sh\necho "{% set name = "v1" %}{% include "_greeting" %}"'
+    )
+    (src / "script").chmod(0o755)
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "Add script")
+    (src / "_greeting").write_text("Goodbye, {{ name }}!")
+    (src / "script").chmod(0o644)
+    git(repo, "commit", "-q", "-a", "-m", "Update script")
+    (src / "_greeting").write_text("Uncommitted, {{ name }}!")
+    git(repo, "tag", "first", "HEAD~1")
+    return repo
+
+
+@pytest.mark.parametrize("rev", ["first", "HEAD~1", "refs/tags/first"])
+def test_render_rev(
+    revrepo: Path, capsys: pytest.CaptureFixture[str], rev: str
+) -> None:
+    cfgfile = str(revrepo / "src" / "dotplate.toml")
+    assert main(["-c", cfgfile, "--rev", rev, "render", "script"]) == 0
+    assert capsys.readouterr().out == '#!/bin/sh\necho "Hello, v1!"\n'
+    assert main(["-c", cfgfile, "render", "script"]) == 0
+    assert capsys.readouterr().out == '#!/bin/sh\necho "Uncommitted, v1!"\n'
+
+
+@pytest.mark.parametrize("rev", ["ORIG_HEAD", "FETCH_HEAD"])
+def test_render_pseudo_ref(
+    revrepo: Path, capsys: pytest.CaptureFixture[str], mocker: MockerFixture, rev: str
+) -> None:
+    oid = git(revrepo, "rev-parse", "first")
+    if rev == "FETCH_HEAD":
+        gitdir = revrepo / git(revrepo, "rev-parse", "--git-dir")
+        (gitdir / "FETCH_HEAD").write_text(
+            f"{oid}\t\tbranch 'main' of https://example.com/repo\n"
+            f"{git(revrepo, 'rev-parse', 'HEAD')}\tnot-for-merge\ttag 'v2'\n"
+        )
+    else:
+        git(revrepo, "update-ref", rev, oid)
+    fallback = mocker.spy(RevisionFiles, "_load_subprocess")
+    cfgfile = str(revrepo / "src" / "dotplate.toml")
+    assert main(["-c", cfgfile, "--rev", rev, "render", "script"]) == 0
+    assert capsys.readouterr().out == '#!/bin/sh\necho "Hello, v1!"\n'
+    fallback.assert_not_called()
+
+
+def test_install_rev(revrepo: Path, tmp_path: Path) -> None:
+    cfgfile = str(revrepo / "src" / "dotplate.toml")
+    assert main(["-c", cfgfile, "--rev", "first", "install", "--yes"]) == 0
+    dest = tmp_path / "dest"
+    assert (dest / "script").read_text() == '#!/bin/sh\necho "Hello, v1!"\n'
+    if os.name == "posix":
+        assert is_executable(dest / "script")
+    assert main(["-c", cfgfile, "--rev", "main", "install", "--yes"]) == 0
+    assert (dest / "script").read_text() == '#!/bin/sh\necho "Goodbye, v1!"\n'
+    if os.name == "posix":
+        assert not is_executable(dest / "script")
+
+
+def test_revision_files_fallback(revrepo: Path, mocker: MockerFixture) -> None:
+    src = revrepo / "src"
+    pure = RevisionFiles.load(src, "first")
+    assert pure is not None
+    mocker.patch.object(GitRepo, "find", side_effect=GitUnsupported("Nope"))
+    fallback = RevisionFiles.load(src, "first")
+    assert fallback is not None
+    try:
+        assert isinstance(fallback._reader, CatFileBatch)
+        assert fallback.commit == pure.commit
+        assert fallback.files == pure.files
+        for path in fallback.files:
+            assert fallback.read(path) == pure.read(path)
+        assert fallback.read("nonexistent") is None
+    finally:
+        fallback.close()
+
+
+def test_bad_rev(
+    revrepo: Path, capsys: pytest.CaptureFixture[str], mocker: MockerFixture
+) -> None:
+    # Revisions not found by the pure-Python reader are left to `git` to
+    # report
+    fallback = mocker.spy(RevisionFiles, "_load_subprocess")
+    cfgfile = str(revrepo / "src" / "dotplate.toml")
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-c", cfgfile, "--rev", "nonexistent", "list"])
+    assert excinfo.value.code == 2
+    fallback.assert_called_once()
+    assert "Git revision not found: nonexistent" in capsys.readouterr().err
+    with pytest.raises(RevisionNotFound):
+        Dotplate.from_config(Config.from_file(cfgfile), rev="nonexistent")
+
+
+NAMED = [".profile", ".config/foo/bar.toml", "new.txt", "old.txt", "untracked.txt"]
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_git_files_named(repo: Path, staged: bool, mocker: MockerFixture) -> None:
+    src = repo / "src"
+    stage_changes(repo)
+    spy = mocker.spy(GitRepo, "walk_tree")
+    files = git_files(src, include_staged=staged, paths=[*NAMED, ".config/foo"])
+    assert files == {p: oid for p, oid in expected(src, staged).items() if p in NAMED}
+    spy.assert_not_called()
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_git_files_named_partial_index(
+    repo: Path, staged: bool, mocker: MockerFixture
+) -> None:
+    src = repo / "src"
+    (src / "zz").mkdir()
+    for i in range(50):
+        (src / "zz" / f"file{i:02d}.txt").write_text(f"File {i}\n")
+    git(repo, "add", "src/zz")
+    git(repo, "commit", "-q", "-m", "Add more files")
+    stage_changes(repo)
+    total = len(git(repo, "ls-files").splitlines())
+    spy = mocker.spy(dotplate.git, "parse_index")
+    files = git_files(src, include_staged=staged, paths=NAMED)
+    assert files == {p: oid for p, oid in expected(src, staged).items() if p in NAMED}
+    # "+" sorts before everything that is tracked:
+    assert git_files(src, include_staged=staged, paths=["+early.txt"]) == {}
+    assert spy.call_count == 2
+    for r in spy.spy_return_list:
+        assert len(r) < total
+
+
+def test_git_files_named_fallback(repo: Path, mocker: MockerFixture) -> None:
+    mocker.patch.object(GitRepo, "read_index", side_effect=GitUnsupported("Nope"))
+    src = repo / "src"
+    assert git_files(src, paths=NAMED) == {
+        p: oid for p, oid in expected(src, False).items() if p in NAMED
+    }
+
+
+def test_dotplate_discover_named(
+    repo: Path, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    stage_changes(repo)
+    cfgfile = repo / "src" / "dotplate.toml"
+    cfgfile.write_text(f"[core]\ndest = {str(tmp_path / 'dest')!r}\n")
+    git(repo, "add", "src/dotplate.toml")
+    dp = Dotplate.from_config_file(cfgfile)
+    spy = mocker.spy(GitRepo, "walk_tree")
+    dp.discover_named([".profile", "untracked.txt", "new.txt", "./.profile"])
+    assert dp.is_active(".profile")
+    assert dp.template_oid(".profile") == git(repo, "rev-parse", "HEAD:src/.profile")
+    for name in ["untracked.txt", "new.txt", "./.profile"]:
+        with pytest.raises(TemplateNotFound):
+            dp.is_active(name)
+    spy.assert_not_called()
+    # Anything else causes a full discovery:
+    assert dp.is_active("old.txt")
+    spy.assert_called()
+    assert dp.templates() == [".config/foo/bar.toml", ".profile", "old.txt"]
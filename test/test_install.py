@@ -0,0 +1,93 @@
+from __future__ import annotations
+from pathlib import Path
+from conftest import CaseDirs
+import pytest
+from pytest_mock import MockerFixture
+from dotplate import Dotplate, InactiveTemplate, RenderedFile, RenderError
+from dotplate.__main__ import main
+from dotplate.install import Installer
+
+
+def mkfile(dest: Path, content: str, template: str = "foo.txt") -> RenderedFile:
+    return RenderedFile(
+        content=content,
+        template=template,
+        dest_path=dest / template,
+        backup_ext=".bak",
+    )
+
+
+@pytest.mark.parametrize("durability", ["none", "syncfs", "fsync"])
+def test_install_replaces_atomically(tmp_path: Path, durability: str) -> None:
+    (tmp_path / "foo.txt").write_text("Old\n")
+    f = mkfile(tmp_path, "New\n")
+    f.install(durability=durability)  # type: ignore[arg-type]
+    assert (tmp_path / "foo.txt").read_text() == "New\n"
+    assert (tmp_path / "foo.txt.bak").read_text() == "Old\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["foo.txt", "foo.txt.bak"]
+
+
+def test_transaction_stages_until_commit(tmp_path: Path) -> None:
+    installed: list[str] = []
+    with Installer(
+        transactional=True, on_install=lambda f: installed.append(f.template)
+    ) as installer:
+        installer.install(mkfile(tmp_path, "Foo\n", "foo.txt"))
+        installer.install(mkfile(tmp_path, "Bar\n", "sub/bar.txt"))
+        assert not (tmp_path / "foo.txt").exists()
+        assert not (tmp_path / "sub" / "bar.txt").exists()
+        assert installed == []
+    assert (tmp_path / "foo.txt").read_text() == "Foo\n"
+    assert (tmp_path / "sub" / "bar.txt").read_text() == "Bar\n"
+    assert installed == ["foo.txt", "sub/bar.txt"]
+
+
+def test_transaction_rollback(tmp_path: Path) -> None:
+    (tmp_path / "foo.txt").write_text("Old\n")
+    with pytest.raises(RuntimeError):
+        with Installer(transactional=True) as installer:
+            installer.install(mkfile(tmp_path, "New\n", "foo.txt"))
+            installer.install(mkfile(tmp_path, "Bar\n", "bar.txt"))
+            raise RuntimeError("Oops")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["foo.txt"]
+    assert (tmp_path / "foo.txt").read_text() == "Old\n"
+
+
+@pytest.mark.parametrize(
+    "jobs,exc_type", [(1, InactiveTemplate), (2, RenderError)]
+)
+@pytest.mark.usecase("multisuite")
+def test_dotplate_install_render_error(
+    mocker: MockerFixture,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+    jobs: int,
+    exc_type: type[Exception],
+) -> None:
+    dp = Dotplate.from_config_file(casedirs.src / "dotplate.toml")
+    spy = mocker.spy(Installer, "install")
+    with pytest.raises(exc_type) as excinfo:
+        dp.install(["base.txt", "bar.txt"], jobs=jobs)
+    assert str(excinfo.value).endswith("Template is not active: bar.txt")
+    spy.assert_not_called()
+    assert list(tmp_home.iterdir()) == []
+
+
+@pytest.mark.usecase("multisuite")
+def test_cli_install_transaction(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_home: Path,
+    casedirs: CaseDirs,
+) -> None:
+    monkeypatch.chdir(casedirs.src)
+    assert main(["install", "--yes", "--transaction", "--durability=syncfs"]) == 0
+    assert capsys.readouterr().out == "".join(
+        f"Installed {name} at {tmp_home / name}\n"
+        for name in ["base.txt", "foo.txt", "foobar.txt"]
+    )
+    assert sorted(p.name for p in tmp_home.iterdir()) == [
+        "base.txt",
+        "foo.txt",
+        "foobar.txt",
+    ]
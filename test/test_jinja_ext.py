@@ -0,0 +1,84 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import shutil
+import pytest
+from pytest_mock import MockerFixture
+from dotplate import Config
+from dotplate.jinja_ext import DotplateExt, ExecutableIndex
+
+pytestmark = pytest.mark.skipif(
+    os.name != "posix", reason="Windows doesn't support executability"
+)
+
+
+def mkexe(p: Path) -> None:
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text("#!/bin/sh\n")
+    p.chmod(0o755)
+
+
+@pytest.fixture()
+def search_path(tmp_path: Path) -> str:
+    mkexe(tmp_path / "bin1" / "foo")
+    (tmp_path / "bin1" / "bar").write_text("Not executable\n")
+    (tmp_path / "bin1" / "baz").mkdir()
+    mkexe(tmp_path / "bin2" / "foo")
+    mkexe(tmp_path / "bin2" / "bar")
+    mkexe(tmp_path / "bin2" / "baz")
+    return os.pathsep.join(
+        str(tmp_path / d) for d in ["bin1", "nonexistent", "bin2", "bin1"]
+    )
+
+
+@pytest.mark.parametrize("cmd", ["foo", "bar", "baz", "quux"])
+def test_index_matches_shutil(search_path: str, cmd: str) -> None:
+    index = ExecutableIndex(search_path)
+    assert index.which(cmd) == shutil.which(cmd, path=search_path)
+
+
+def test_index_lists_each_dir_once(search_path: str, mocker: MockerFixture) -> None:
+    spy = mocker.spy(os, "listdir")
+    index = ExecutableIndex(search_path)
+    for _ in range(3):
+        for cmd in ["foo", "bar", "baz", "quux"]:
+            index.which(cmd)
+    assert spy.call_count == 3
+
+
+def test_ext_invalidates_on_path_change(
+    monkeypatch: pytest.MonkeyPatch, search_path: str, tmp_path: Path
+) -> None:
+    monkeypatch.setenv("PATH", search_path)
+    env = Config.model_validate({"core": {"dest": "~"}}).make_jinja_env()
+    ext = env.extensions[DotplateExt.identifier]
+    assert isinstance(ext, DotplateExt)
+    tmpl = env.from_string("{{ which('nope', 'bar') }}")
+    assert tmpl.render() == str(tmp_path / "bin2" / "bar")
+    index = ext.get_index()
+    assert tmpl.render() == str(tmp_path / "bin2" / "bar")
+    assert ext.get_index() is index
+    monkeypatch.setenv("PATH", str(tmp_path / "bin1"))
+    assert env.from_string("{{ which('bar') is defined }}").render() == "False"
+    assert ext.get_index() is not index
+
+
+def test_ext_invalidates_on_dir_change(
+    monkeypatch: pytest.MonkeyPatch, search_path: str, tmp_path: Path
+) -> None:
+    monkeypatch.setenv("PATH", search_path)
+    env = Config.model_validate({"core": {"dest": "~"}}).make_jinja_env()
+    ext = env.extensions[DotplateExt.identifier]
+    assert isinstance(ext, DotplateExt)
+    tmpl = env.from_string("{{ which('quux') is defined }}")
+    assert tmpl.render() == "False"
+    index = ext.get_index()
+    assert index.is_current()
+    ext.refresh_index()
+    assert ext.get_index() is index
+    mkexe(tmp_path / "bin2" / "quux")
+    assert not index.is_current()
+    assert tmpl.render() == "False"
+    ext.refresh_index()
+    assert tmpl.render() == "True"
+    assert ext.get_index() is not index
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import difflib
+import random
+import pytest
+from dotplate.linediff import count_changes, get_opcodes, unified_diff
+
+
+def apply_opcodes(a: list[str], b: list[str]) -> list[str]:
+    out: list[str] = []
+    for tag, i1, i2, j1, j2 in get_opcodes(a, b):
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            out.extend(a[i1:i2])
+        else:
+            out.extend(b[j1:j2])
+    return out
+
+
+def lines(s: str) -> list[str]:
+    return s.splitlines(True)
+
+
+@pytest.mark.parametrize(
+    "a,b",
+    [
+        ("", ""),
+        ("", "a\nb\n"),
+        ("a\nb\n", ""),
+        ("a\nb\nc\n", "a\nb\nc\n"),
+        ("a\nb\nc\n", "a\nB\nc\n"),
+        ("1\n2\n3\n4\n5\n6\n7\n8\n9\n10\n", "1\n2\nx\n4\n5\n6\n7\n8\n9\ny\n"),
+        ("1\n2\n3\n4\n5\n6\n7\n8\n9\n10\n11\n", "0\n1\n2\n3\n4\n5\n6\n7\n8\n9\n"),
+        ("no newline", "no newline\nadded\n"),
+    ],
+)
+def test_unified_diff_matches_difflib(a: str, b: str) -> None:
+    expected = difflib.unified_diff(lines(a), lines(b), fromfile="old", tofile="new")
+    assert list(unified_diff(lines(a), lines(b), "old", "new")) == list(expected)
+
+
+def test_moved_block() -> None:
+    # Patience-style matching keeps the unique lines together rather than
+    # matching up the repeated braces
+    a = lines("f() {\n  one\n}\n\ng() {\n  two\n}\n")
+    b = lines("g() {\n  two\n}\n\nf() {\n  one\n}\n")
+    assert apply_opcodes(a, b) == b
+    assert count_changes(a, b) == (4, 4)
+
+
+def test_random() -> None:
+    rng = random.Random(42)
+    for _ in range(500):
+        alphabet = "abcdefghij"[: rng.randint(1, 10)]
+        a = [rng.choice(alphabet) + "\n" for _ in range(rng.randint(0, 30))]
+        b = [rng.choice(alphabet) + "\n" for _ in range(rng.randint(0, 30))]
+        assert apply_opcodes(a, b) == b
+        (added, removed) = count_changes(a, b)
+        assert len(a) - removed == len(b) - added
+        assert (added == removed == 0) == (a == b)
+        assert bool(list(unified_diff(a, b, "a", "b"))) == (a != b)
+
+
+def test_repetitive() -> None:
+    # Every line is too common to anchor on, so Myers' algorithm is used
+    a = ["{\n", "}\n"] * 500
+    b = ["{\n", "x\n", "}\n"] * 500
+    assert apply_opcodes(a, b) == b
+    assert count_changes(a, b) == (500, 0)
+
+
+def test_large() -> None:
+    rng = random.Random(0)
+    a = [f"line {rng.randrange(10000)}\n" for _ in range(50000)]
+    b = list(a)
+    for _ in range(500):
+        b[rng.randrange(len(b))] = "changed\n"
+    assert apply_opcodes(a, b) == b
+    (added, removed) = count_changes(a, b)
+    assert added == removed <= 500
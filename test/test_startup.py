@@ -0,0 +1,111 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import subprocess
+import sys
+from conftest import CaseDirs
+import pytest
+
+#: Code importing the third-party & standard library modules that
+#: `dotplate.__main__` cannot do without, used as a baseline for its import
+#: time.  Defining a model makes pydantic load the internals that it only
+#: imports on first use.
+EAGER_IMPORTS = """
+import argparse, iterpath, linesep, pydantic
+from pydantic.functional_validators import AfterValidator
+class _Model(pydantic.BaseModel):
+    x: int = 0
+"""
+
+#: Upper bound, as a fraction of the import time of `EAGER_IMPORTS`, on the
+#: time that importing `dotplate.__main__` spends importing other modules
+#: outside of dotplate itself.  This is normally a few percent; deferred
+#: imports becoming eager push it over the bound (e.g.,
+#: ``concurrent.futures.process`` adds about 7%, and ``jinja2`` about 15%).
+IMPORT_BUDGET_RATIO = float(os.environ.get("DOTPLATE_IMPORT_BUDGET_RATIO", "0.1"))
+
+#: Modules that must not be imported unless a template is actually rendered,
+#: diffed, or installed
+HEAVY_MODULES = ["concurrent.futures.process", "difflib", "jinja2", "readline"]
+
+#: Modules that must not be imported by just importing the `dotplate` package
+PACKAGE_EXCLUDED_MODULES = [*HEAVY_MODULES, "dotplate.config", "pydantic"]
+
+
+def run_python(code: str, cwd: Path | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def loaded_heavy_modules(modules: list[str] = HEAVY_MODULES) -> str:
+    return (
+        "import sys;"
+        f" print(sorted(m for m in {modules!r} if m in sys.modules))"
+    )
+
+
+def import_times(code: str) -> dict[str, int]:
+    """
+    Run `code` under ``python -X importtime`` and return a `dict` mapping the
+    names of the modules it imported to their self import times in
+    microseconds
+    """
+    r = run_python(code)
+    times = {}
+    for line in r.stderr.splitlines():
+        # Lines are of the form "import time: <self> | <cumulative> | <name>"
+        fields = line.split("|")
+        if len(fields) == 3 and fields[0].startswith("import time:"):
+            selftime = fields[0][len("import time:") :].strip()
+            if selftime.isdigit():
+                times[fields[2].strip()] = int(selftime)
+    return times
+
+
+def test_import_budget() -> None:
+    # Compare against a baseline measured on the same machine at the same
+    # time instead of against a fixed wall-clock limit, and take the best of
+    # a few runs to smooth out noise.
+    baseline = float("inf")
+    extra = float("inf")
+    for _ in range(3):
+        eager = import_times(EAGER_IMPORTS)
+        baseline = min(baseline, sum(eager.values()))
+        extra = min(
+            extra,
+            sum(
+                t
+                for mod, t in import_times("import dotplate.__main__").items()
+                if mod not in eager and mod.split(".")[0] != "dotplate"
+            ),
+        )
+    assert extra <= baseline * IMPORT_BUDGET_RATIO
+
+
+def test_package_import_is_lazy() -> None:
+    r = run_python(f"import dotplate; {loaded_heavy_modules(PACKAGE_EXCLUDED_MODULES)}")
+    assert r.stdout.strip() == "[]"
+
+
+def test_import_is_lazy() -> None:
+    r = run_python(f"import dotplate, dotplate.__main__; {loaded_heavy_modules()}")
+    assert r.stdout.strip() == "[]"
+
+
+@pytest.mark.usecase("multisuite")
+@pytest.mark.usefixtures("tmp_home")
+def test_list_is_lazy(casedirs: CaseDirs) -> None:
+    r = run_python(
+        "from dotplate.__main__ import main; main(['list']);"
+        f" {loaded_heavy_modules()}",
+        cwd=casedirs.src,
+    )
+    *listing, heavy = r.stdout.splitlines()
+    assert listing == ["base.txt", "foo.txt", "foobar.txt"]
+    assert heavy == "[]"
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import pytest
+from dotplate import Dotplate, RenderedFile
+from dotplate.__main__ import main
+
+
+@pytest.fixture
+def srcdir(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text(
+        "[core]\n"
+        'dest = "../dest"\n'
+        'state-file = "../state.json"\n'
+        "\n"
+        "[vars]\n"
+        'name = "world"\n',
+        encoding="utf-8",
+    )
+    (src / "greeting.txt").write_text(
+        '{% include "_partial" %}, {{ dotplate.vars.name }}!\n', encoding="utf-8"
+    )
+    (src / "_partial").write_text("Hello", encoding="utf-8")
+    (src / "dynamic.txt").write_text(
+        "{% include dotplate.vars.name ~ '.txt' ignore missing %}\n",
+        encoding="utf-8",
+    )
+    return src
+
+
+def rendered(dp: Dotplate) -> list[str]:
+    files = list(dp.render_many(skip_unchanged=True))
+    assert all(isinstance(f, RenderedFile) for f in files)
+    return [f.template for f in files]
+
+
+def test_skip_unchanged(srcdir: Path) -> None:
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert rendered(dp) == ["_partial", "dynamic.txt", "greeting.txt"]
+    dp.install()
+    assert (srcdir.parent / "state.json").exists()
+    assert (srcdir.parent / "dest" / "greeting.txt").read_text(
+        encoding="utf-8"
+    ) == "Hello, world!\n"
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    # Templates with dynamic references are never skipped:
+    assert rendered(dp) == ["dynamic.txt"]
+    assert dp.is_unchanged("greeting.txt")
+    assert not dp.is_unchanged("dynamic.txt")
+
+
+def test_partial_changed(srcdir: Path) -> None:
+    Dotplate.from_config_file(srcdir / "dotplate.toml").install()
+    (srcdir / "_partial").write_text("Goodbye", encoding="utf-8")
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert rendered(dp) == ["_partial", "dynamic.txt", "greeting.txt"]
+
+
+def test_vars_changed(srcdir: Path) -> None:
+    Dotplate.from_config_file(srcdir / "dotplate.toml").install()
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    dp.vars["name"] = "everyone"
+    assert rendered(dp) == ["_partial", "dynamic.txt", "greeting.txt"]
+
+
+def test_dest_changed(srcdir: Path) -> None:
+    Dotplate.from_config_file(srcdir / "dotplate.toml").install()
+    (srcdir.parent / "dest" / "greeting.txt").write_text(
+        "Hi, world!\n", encoding="utf-8"
+    )
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert rendered(dp) == ["dynamic.txt", "greeting.txt"]
+
+
+def test_cli_full(
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+    srcdir: Path,
+) -> None:
+    monkeypatch.chdir(srcdir)
+    assert main(["install", "--yes"]) == 0
+    capsys.readouterr()
+    (srcdir.parent / "dest" / "greeting.txt").unlink()
+    (srcdir.parent / "dest" / "_partial").write_text("Hello\n", encoding="utf-8")
+    # The missing file is noticed, while the rewritten-but-identical file is
+    # recognized via its hash:
+    assert main(["install", "--yes"]) == 0
+    assert capsys.readouterr().out == (
+        f"Installed greeting.txt at {Path('..', 'dest', 'greeting.txt')}\n"
+    )
+    # Modify an installed file in a way that the stat-based check can't
+    # notice:
+    dest = srcdir.parent / "dest" / "_partial"
+    st = dest.stat()
+    dest.write_text("Howdy\n", encoding="utf-8")
+    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert main(["diff"]) == 0
+    assert capsys.readouterr().out == ""
+    assert main(["diff", "--full"]) == 0
+    assert "+Hello" in capsys.readouterr().out
+
+
+def test_which_never_skipped(
+    monkeypatch: pytest.MonkeyPatch, srcdir: Path, tmp_path: Path
+) -> None:
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    monkeypatch.setenv("PATH", str(bindir))
+    (srcdir / "_tool").write_text('{{ which("tool") is defined }}', encoding="utf-8")
+    (srcdir / "tool.txt").write_text('{% include "_tool" %}\n', encoding="utf-8")
+    Dotplate.from_config_file(srcdir / "dotplate.toml").install()
+    dest = srcdir.parent / "dest" / "tool.txt"
+    assert dest.read_text(encoding="utf-8") == "False\n"
+    (bindir / "tool").write_text("#!/bin/sh\n", encoding="utf-8")
+    (bindir / "tool").chmod(0o755)
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert rendered(dp) == ["_tool", "dynamic.txt", "tool.txt"]
+    assert not dp.is_unchanged("tool.txt")
+    dp.install()
+    assert dest.read_text(encoding="utf-8") == "True\n"
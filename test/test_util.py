@@ -1,8 +1,20 @@
 from __future__ import annotations
 import os
 from pathlib import Path
+import threading
+from typing import NoReturn
 import pytest
-from dotplate.util import is_executable, set_executable_bit, unset_executable_bit
+from dotplate import util
+from dotplate.util import (
+    SuiteMatcher,
+    TemplateTable,
+    _KernelCopyUnsupported,
+    copy_fd,
+    glob_matcher,
+    is_executable,
+    set_executable_bit,
+    unset_executable_bit,
+)
 
 
 @pytest.mark.skipif(os.name != "posix", reason="Windows doesn't support executability")
@@ -14,3 +26,145 @@ def test_executable_bit(tmp_path: Path) -> None:
     assert is_executable(p)
     unset_executable_bit(p)
     assert not is_executable(p)
+
+
+@pytest.mark.parametrize(
+    "pattern,path,matched",
+    [
+        ("*.png", "logo.png", True),
+        ("*.png", "images/logo.png", False),
+        ("**/*.png", "logo.png", True),
+        ("**/*.png", "images/icons/logo.png", True),
+        ("fonts/**", "fonts/a/b.ttf", True),
+        ("fonts/**", "fonts", False),
+        ("bin/?", "bin/x", True),
+        ("bin/?", "bin/xy", False),
+        ("[ab].txt", "a.txt", True),
+        ("[!ab].txt", "c.txt", True),
+        ("[!ab].txt", "a.txt", False),
+        ("a+b.txt", "a+b.txt", True),
+        ("[unclosed", "[unclosed", True),
+        ("foo[[]1].conf", "foo[1].conf", True),
+        ("foo[[]1].conf", "foo1.conf", False),
+        ("[*]", "*", True),
+        ("[*]", "a", False),
+    ],
+)
+def test_glob_matcher(pattern: str, path: str, matched: bool) -> None:
+    assert glob_matcher([pattern])(path) is matched
+
+
+def test_glob_matcher_empty() -> None:
+    assert not glob_matcher([])("anything")
+
+
+@pytest.mark.parametrize(
+    "unsupported",
+    [
+        [],
+        ["_try_reflink"],
+        ["_try_reflink", "_copy_file_range"],
+        ["_try_reflink", "_copy_file_range", "_sendfile"],
+    ],
+)
+def test_copy_fd(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, unsupported: list[str]
+) -> None:
+    def fail(*_args: object) -> NoReturn:
+        raise _KernelCopyUnsupported()
+
+    for name in unsupported:
+        if name == "_try_reflink":
+            monkeypatch.setattr(util, name, lambda *_args: False)
+        else:
+            monkeypatch.setattr(util, name, fail)
+    data = os.urandom(200_000)
+    (tmp_path / "src").write_bytes(data)
+    with (tmp_path / "src").open("rb") as src, (tmp_path / "dest").open("wb") as dst:
+        os.lseek(src.fileno(), 10, os.SEEK_SET)
+        copy_fd(src.fileno(), dst.fileno())
+    assert (tmp_path / "dest").read_bytes() == data[10:]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Requires os.pipe() & os.fstat()")
+@pytest.mark.parametrize("unsupported", [[], ["_sendfile"]])
+def test_copy_fd_pipe(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, unsupported: list[str]
+) -> None:
+    def fail(*_args: object) -> NoReturn:
+        raise AssertionError("Should not be called on a pipe")
+
+    def unsupported_copier(*_args: object) -> NoReturn:
+        raise _KernelCopyUnsupported()
+
+    monkeypatch.setattr(util, "_try_reflink", fail)
+    monkeypatch.setattr(util, "_copy_file_range", fail)
+    for name in unsupported:
+        monkeypatch.setattr(util, name, unsupported_copier)
+    data = os.urandom(200_000)
+    (tmp_path / "src").write_bytes(data)
+    rfd, wfd = os.pipe()
+    received = bytearray()
+
+    def drain() -> None:
+        with open(rfd, "rb") as fp:
+            while chunk := fp.read(65536):
+                received.extend(chunk)
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    try:
+        with (tmp_path / "src").open("rb") as src:
+            copy_fd(src.fileno(), wfd)
+    finally:
+        os.close(wfd)
+        reader.join()
+    assert received == data
+
+
+def test_suite_matcher() -> None:
+    m = SuiteMatcher(
+        {
+            "fonts": ["fonts/", "x.txt"],
+            "images": ["**/*.png", "x.txt"],
+            "ttf": ["fonts/*.ttf"],
+            "exact": ["y.txt"],
+        }
+    )
+    assert m.bits == {"fonts": 1, "images": 2, "ttf": 4, "exact": 8}
+    assert m["x.txt"] == 0b0011
+    assert m["fonts/a.ttf"] == 0b0101
+    assert m["fonts/sub/a.ttf"] == 0b0001
+    assert m["fonts/logo.png"] == 0b0011
+    assert m["logo.png"] == 0b0010
+    assert m["y.txt"] == 0b1000
+    assert m["fonts"] == 0
+    assert m["z.txt"] == 0
+
+
+def test_suite_matcher_literal_brackets() -> None:
+    m = SuiteMatcher({"literal": ["foo[1].conf"], "escaped": ["bar[[]2].conf"]})
+    assert m["foo[1].conf"] == 0b01
+    # The entry is still a glob as well:
+    assert m["foo1.conf"] == 0b01
+    assert m["bar[2].conf"] == 0b10
+    assert m["bar2.conf"] == 0
+
+
+def test_template_table() -> None:
+    matcher = SuiteMatcher({"vim": [".vim/", ".vimrc"], "work": [".vimrc", "w"]})
+    table = TemplateTable(["w", ".vimrc", ".profile", ".vim/a.vim"], matcher)
+    assert list(table) == [".profile", ".vim/a.vim", ".vimrc", "w"]
+    assert len(table) == 4
+    assert "w" in table
+    assert "x" not in table
+    none = table.suite_mask([])
+    vim = table.suite_mask(["vim", "undefined"])
+    work = table.suite_mask(["work"])
+    assert table.active(none) == [".profile"]
+    assert table.active(vim) == [".profile", ".vim/a.vim", ".vimrc"]
+    assert table.active(work) == [".profile", ".vimrc", "w"]
+    assert table.is_active(".vimrc", work)
+    assert not table.is_active(".vim/a.vim", work)
+    with pytest.raises(KeyError):
+        table.is_active("x", vim)
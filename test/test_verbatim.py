@@ -0,0 +1,109 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import pytest
+from dotplate import DiffStat, DiffState, Dotplate, RenderedFile, VerbatimFile
+from dotplate.__main__ import main
+
+BLOB = b"\x89PNG\r\n\x1a\n{{ not a template }}\xff\xfe\x00"
+
+
+@pytest.fixture
+def srcdir(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "dotplate.toml").write_text(
+        "[core]\n"
+        'dest = "../dest"\n'
+        'state-file = "../state.json"\n'
+        'verbatim = ["**/*.png", "bin/**"]\n',
+        encoding="utf-8",
+    )
+    (src / "images").mkdir()
+    (src / "images" / "logo.png").write_bytes(BLOB)
+    (src / "bin").mkdir()
+    (src / "bin" / "tool").write_bytes(b"#!/bin/sh\necho {{ x }}\n")
+    (src / "bin" / "tool").chmod(0o755)
+    (src / "hello.txt").write_text(
+        '{% include "bin/tool" %}{{ "Hello" }}\n', encoding="utf-8"
+    )
+    return src
+
+
+def test_install_verbatim(srcdir: Path) -> None:
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert dp.is_verbatim("images/logo.png")
+    assert dp.is_verbatim("bin/tool")
+    assert not dp.is_verbatim("hello.txt")
+    f = dp.render_file("images/logo.png")
+    assert isinstance(f, VerbatimFile)
+    assert f.diff().state is DiffState.MISSING
+    assert f.diff().delta == (
+        f"Binary files {dp.dest / 'images' / 'logo.png'} and images/logo.png differ\n"
+    )
+    assert f.diff().stat == DiffStat(added=0, removed=0)
+    assert isinstance(dp.render_file("hello.txt"), RenderedFile)
+    dp.install()
+    dest = srcdir.parent / "dest"
+    assert (dest / "images" / "logo.png").read_bytes() == BLOB
+    assert (dest / "bin" / "tool").read_bytes() == b"#!/bin/sh\necho {{ x }}\n"
+    if os.name == "posix":
+        assert os.access(dest / "bin" / "tool", os.X_OK)
+    # Templates that include verbatim files still render them with Jinja:
+    assert (dest / "hello.txt").read_text(encoding="utf-8") == "#!/bin/sh\necho Hello\n"
+    assert not dp.render_file("images/logo.png").diff()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_render_many_verbatim(srcdir: Path, jobs: int) -> None:
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    files = list(dp.render_many(jobs=jobs))
+    assert [type(f) for f in files] == [VerbatimFile, RenderedFile, VerbatimFile]
+    dp.install()
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    assert list(dp.render_many(jobs=jobs, skip_unchanged=True)) == []
+
+
+def test_verbatim_not_parsed(srcdir: Path) -> None:
+    (srcdir / "images" / "broken.png").write_text("{% include", encoding="utf-8")
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    # A broken template would be assumed to depend on everything
+    assert dp.dependents("bin/tool") == ["hello.txt"]
+    assert dp.dependencies("images/broken.png") == []
+
+
+def test_verbatim_from_bytes(tmp_path: Path) -> None:
+    f = VerbatimFile(
+        source=BLOB,
+        template="logo.png",
+        dest_path=tmp_path / "logo.png",
+        backup_ext=".bak",
+    )
+    assert f.size() == len(BLOB)
+    f.install()
+    assert (tmp_path / "logo.png").read_bytes() == BLOB
+    assert f.sha256() == VerbatimFile(
+        source=tmp_path / "logo.png",
+        template="logo.png",
+        dest_path=tmp_path / "other.png",
+        backup_ext=".bak",
+    ).sha256()
+
+
+def test_cli_render_verbatim(
+    srcdir: Path, capsysbinary: pytest.CaptureFixture[bytes]
+) -> None:
+    cfg = str(srcdir / "dotplate.toml")
+    assert main(["-c", cfg, "--no-daemon", "render", "images/logo.png"]) == 0
+    assert capsysbinary.readouterr().out == BLOB
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Requires os.pipe()")
+def test_render_verbatim_to_pipe(srcdir: Path) -> None:
+    dp = Dotplate.from_config_file(srcdir / "dotplate.toml")
+    rfd, wfd = os.pipe()
+    with open(wfd, "wb") as fp:
+        # Small enough to fit in the pipe's buffer without a reader:
+        dp.copy("images/logo.png").write_to(fp)
+    with open(rfd, "rb") as fp:
+        assert fp.read() == BLOB
@@ -0,0 +1,300 @@
+from __future__ import annotations
+from collections.abc import Callable, Iterator
+from pathlib import Path
+import shutil
+import sys
+import time
+from typing import Any
+from conftest import git
+import pytest
+from pytest_mock import MockerFixture
+from dotplate import Dotplate
+from dotplate.__main__ import main
+from dotplate.dotplate import BaseRenderedFile
+from dotplate.watch import InotifyWatcher, PollingWatcher, WatchSession, Watcher
+
+WATCHERS: list[Any] = [
+    lambda tree, files: PollingWatcher(tree, files, interval=0.01),
+    pytest.param(
+        InotifyWatcher,
+        marks=pytest.mark.skipif(
+            not sys.platform.startswith("linux"), reason="Linux only"
+        ),
+    ),
+]
+
+
+@pytest.fixture(params=WATCHERS)
+def watcher(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> Iterator[tuple[Watcher, Path]]:
+    tree = tmp_path / "tree"
+    (tree / "sub").mkdir(parents=True)
+    (tree / ".git").mkdir()
+    (tree / "sub" / "file.txt").write_text("Original\n")
+    (tmp_path / "config.toml").write_text("Config\n")
+    (tmp_path / "other.txt").write_text("Other\n")
+    with request.param(tree, [tmp_path / "config.toml"]) as w:
+        yield (w, tmp_path)
+
+
+def wait_for(w: Watcher, expected: set[Path]) -> set[Path] | None:
+    # Changes may be reported in more than one batch (e.g., as a file is
+    # created and then written), so keep collecting until they're all seen
+    seen: set[Path] = set()
+    deadline = time.monotonic() + 5
+    while not expected <= seen and time.monotonic() < deadline:
+        changes = w.wait(timeout=0.5)
+        if changes is None:
+            return None
+        seen |= changes
+    return seen
+
+
+def test_watcher_modify(watcher: tuple[Watcher, Path]) -> None:
+    w, tmp_path = watcher
+    p = tmp_path / "tree" / "sub" / "file.txt"
+    p.write_text("Modified, with a different size\n")
+    assert wait_for(w, {p}) == {p}
+
+
+def test_watcher_create_delete(watcher: tuple[Watcher, Path]) -> None:
+    w, tmp_path = watcher
+    tree = tmp_path / "tree"
+    (tree / "sub" / "file.txt").unlink()
+    (tree / "new").mkdir()
+    (tree / "new" / "file.txt").write_text("New\n")
+    expected = {tree / "sub" / "file.txt", tree / "new" / "file.txt"}
+    assert wait_for(w, expected) == expected
+    # The new directory is watched as well:
+    (tree / "new" / "other.txt").write_text("Other\n")
+    assert wait_for(w, {tree / "new" / "other.txt"}) == {tree / "new" / "other.txt"}
+
+
+def test_watcher_ignores(watcher: tuple[Watcher, Path]) -> None:
+    w, tmp_path = watcher
+    (tmp_path / "tree" / ".git" / "index").write_text("Index\n")
+    (tmp_path / "other.txt").write_text("Modified\n")
+    assert w.wait(timeout=0.2) == set()
+
+
+def test_watcher_config_replaced(watcher: tuple[Watcher, Path]) -> None:
+    w, tmp_path = watcher
+    cfg = tmp_path / "config.toml"
+    (tmp_path / "config.toml.new").write_text("New config\n")
+    (tmp_path / "config.toml.new").replace(cfg)
+    assert wait_for(w, {cfg}) == {cfg}
+
+
+class Session:
+    def __init__(
+        self, tmp_path: Path, install: bool = False, extra_config: str = ""
+    ) -> None:
+        self.src = tmp_path / "src"
+        self.dest = tmp_path / "dest"
+        self.src.mkdir()
+        self.dest.mkdir()
+        self.cfgfile = self.src / "dotplate.toml"
+        self.extra_config = extra_config
+        self.write_config("1")
+        (self.src / "_partial").write_text("Partial {{ dotplate.vars.x }}")
+        (self.src / "_chain").write_text('{% include "_partial" %} via chain')
+        (self.src / "a.txt").write_text('A: {% include "_partial" %}')
+        (self.src / "b.txt").write_text('B: {% include "_chain" %}')
+        (self.src / "c.txt").write_text("C")
+        self.rendered: list[str] = []
+        self.errors: list[str] = []
+        self.session = WatchSession(
+            self.load(),
+            reload=self.load,
+            config_files=[self.cfgfile],
+            install=install,
+            on_result=self.on_result,
+            on_error=self.errors.append,
+        )
+
+    def write_config(self, x: str) -> None:
+        self.cfgfile.write_text(
+            "[core]\n"
+            f'dest = "{self.dest.as_posix()}"\n'
+            "[suites.partials]\n"
+            'files = ["_partial", "_chain"]\n'
+            "[vars]\n"
+            f'x = "{x}"\n' + self.extra_config
+        )
+
+    def load(self) -> Dotplate:
+        return Dotplate.from_config_file(self.cfgfile)
+
+    def on_result(self, f: BaseRenderedFile) -> None:
+        self.rendered.append(f.template)
+
+    def take(self) -> list[str]:
+        rendered = sorted(self.rendered)
+        self.rendered.clear()
+        return rendered
+
+
+def test_session_partial_changed(tmp_path: Path, mocker: MockerFixture) -> None:
+    s = Session(tmp_path)
+    s.session.start()
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    spy = mocker.spy(Dotplate, "render")
+    (s.src / "_partial").write_text("Changed partial")
+    s.session.handle({s.src / "_partial"})
+    assert s.take() == ["a.txt", "b.txt"]
+    assert sorted(c.args[1] for c in spy.call_args_list) == ["a.txt", "b.txt"]
+    assert s.errors == []
+
+
+def test_session_template_changed(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    s.session.start()
+    s.take()
+    (s.src / "c.txt").write_text('C: {% include "_chain" %}')
+    s.session.handle({s.src / "c.txt"})
+    assert s.take() == ["c.txt"]
+    # The new reference is picked up:
+    s.session.handle({s.src / "_partial"})
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+
+
+def test_session_new_and_deleted(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    s.session.start()
+    s.take()
+    (s.src / "d.txt").write_text("D")
+    (s.src / "_chain").unlink()
+    s.session.handle({s.src / "d.txt", s.src / "_chain"})
+    assert s.take() == ["d.txt"]
+    assert len(s.errors) == 1
+    assert s.errors[0].startswith("Error rendering b.txt: TemplateNotFound: ")
+
+
+def test_session_ignores_unrelated(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    s.session.start()
+    s.take()
+    s.session.handle({tmp_path / "elsewhere", s.src})
+    assert s.take() == []
+
+
+def test_session_config_changed(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    s.session.start()
+    s.take()
+    old = s.session.dotplate
+    s.write_config("2")
+    s.session.handle({s.cfgfile})
+    assert s.session.dotplate is not old
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    s.cfgfile.write_text("[core\n")
+    s.session.handle({s.cfgfile})
+    assert len(s.errors) == 1
+    assert s.errors[0].startswith("Failed to reload config: TOMLDecodeError: ")
+    assert s.take() == []
+
+
+def test_session_install(tmp_path: Path) -> None:
+    s = Session(tmp_path, install=True)
+    s.session.start()
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    assert (s.dest / "b.txt").read_text() == "B: Partial 1 via chain\n"
+    s.session.start()
+    assert s.take() == []
+    (s.src / "_chain").write_text('{% include "_partial" %} via new chain')
+    s.session.handle({s.src / "_chain"})
+    assert s.take() == ["b.txt"]
+    assert (s.dest / "b.txt").read_text() == "B: Partial 1 via new chain\n"
+
+
+def test_session_no_auto_reload(tmp_path: Path) -> None:
+    s = Session(tmp_path, install=True, extra_config="[jinja]\nauto-reload = false\n")
+    assert not s.session.dotplate.jinja_env.auto_reload
+    s.session.start()
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    (s.src / "_partial").write_text("New partial")
+    (s.src / "c.txt").write_text("New C")
+    s.session.handle({s.src / "_partial", s.src / "c.txt"})
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    assert (s.dest / "a.txt").read_text() == "A: New partial\n"
+    assert (s.dest / "b.txt").read_text() == "B: New partial via chain\n"
+    assert (s.dest / "c.txt").read_text() == "New C\n"
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="Git not installed")
+def test_session_git_changes(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    git(s.src, "init", "-q")
+    git(s.src, "add", ".")
+    git(s.src, "commit", "-q", "-m", "Initial")
+    s.session.start()
+    assert s.take() == ["a.txt", "b.txt", "c.txt"]
+    gitdir = s.src.resolve() / ".git"
+    branch = gitdir / "refs" / "heads" / "main"
+    assert s.session.git_files() == {
+        gitdir / "HEAD",
+        gitdir / "index",
+        gitdir / "packed-refs",
+        branch,
+    }
+    assert s.session.git_files() <= s.session.watched_files()
+    # Untracked files aren't templates:
+    (s.src / "d.txt").write_text("D")
+    s.session.handle({s.src / "d.txt"})
+    assert s.take() == []
+    git(s.src, "add", "d.txt")
+    s.session.handle({gitdir / "index"})
+    assert s.take() == []
+    git(s.src, "commit", "-q", "-m", "Add d.txt")
+    s.session.handle({gitdir / "index", branch})
+    assert s.take() == ["d.txt"]
+    git(s.src, "checkout", "-q", "-b", "other")
+    assert gitdir / "refs" / "heads" / "other" in s.session.git_files()
+    s.session.handle({gitdir / "HEAD"})
+    assert s.take() == []
+    assert s.errors == []
+
+
+class OneShotWatcher(Watcher):
+    """Makes one change and reports it, then simulates a Ctrl-C"""
+
+    def __init__(self, tree: Path, edit: Callable[[], set[Path]]) -> None:
+        super().__init__(tree)
+        self.edit: Callable[[], set[Path]] | None = edit
+
+    def add_file(self, path: Path) -> None:
+        self.files.add(path)
+
+    def wait(self, timeout: float | None = None) -> set[Path] | None:  # noqa: U100
+        if self.edit is None:
+            raise KeyboardInterrupt
+        edit, self.edit = self.edit, None
+        return edit()
+
+
+def test_cli_watch_install(
+    tmp_path: Path, mocker: MockerFixture, capsys: pytest.CaptureFixture[str]
+) -> None:
+    s = Session(tmp_path)
+
+    def edit() -> set[Path]:
+        (s.src / "a.txt").write_text("New A")
+        return {s.src / "a.txt"}
+
+    mocker.patch(
+        "dotplate.watch.make_watcher",
+        side_effect=lambda tree, *_args, **_kwargs: OneShotWatcher(tree, edit),
+    )
+    assert main(["-c", str(s.cfgfile), "watch", "--install"]) == 0
+    assert capsys.readouterr().out == "".join(
+        f"Installed {t} at {s.dest / t}\n" for t in ["a.txt", "b.txt", "c.txt", "a.txt"]
+    )
+    assert (s.dest / "a.txt").read_text() == "New A\n"
+
+
+def test_cli_watch_rev(tmp_path: Path) -> None:
+    s = Session(tmp_path)
+    with pytest.raises(SystemExit) as excinfo:
+        main(["-c", str(s.cfgfile), "--rev", "HEAD", "watch"])
+    assert excinfo.value.code == 2